@@ -1,14 +1,28 @@
+import queue
+import threading
+from functools import partial
+
+import streamlit as st
 from langchain.agents import AgentExecutor, create_react_agent
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.callbacks.manager import adispatch_custom_event, dispatch_custom_event
 from langchain.schema import StrOutputParser
 from langchain.tools import Tool
 from langchain_core.prompts import ChatPromptTemplate, PromptTemplate
+from langchain_core.runnables import RunnableLambda
 from langchain_core.runnables.history import RunnableWithMessageHistory
 from langchain_neo4j import Neo4jChatMessageHistory
 
-from graph import graph
-from llm import llm
+from entity_linker import get_linker
+from graph import get_graph
+from llm import get_llm
+from memory import BufferedSummaryHistory, SessionMemoryCache, SummaryStore
+from resources import resource
+from router import DIRECT, QuestionRouter
+from tracing import FINAL_ANSWER_TAG, trace
 from utils import get_session_id
-from tools.cypher import cypher_qa
+from tools.cypher import CYPHER_ANSWER_TAG, cypher_qa
+from tools.symptom import rank_diseases_by_symptoms
 # from tools.vector import retrieve_disease_description
 
 chat_prompt = ChatPromptTemplate.from_messages(
@@ -22,20 +36,28 @@ chat_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-consult_chat = chat_prompt | llm | StrOutputParser()
+@resource("consult_chat")
+def get_consult_chat():
+    return chat_prompt | get_llm() | StrOutputParser()
 
 # Create a set of tools
 tools = [
     Tool.from_function(
         name="通用对话",
         description="用于处理无法通过知识图谱检索到答案的医疗相关问题，提供专业医学建议。",
-        func=consult_chat.invoke,
+        # Streamed, so routed turns can forward the answer token by token
+        func=lambda question: "".join(get_consult_chat().stream(question)),
     ),
     Tool.from_function(
         name="医疗信息查询",
         description="基于医疗知识图谱，使用Cypher语句检索疾病、症状、药物等结构化信息，适合‘某疾病有哪些症状’、‘某症状可能是什么病’等问题。",
         func=cypher_qa
     ),
+    Tool.from_function(
+        name="症状鉴别诊断",
+        description="根据用户描述的一个或多个症状，对知识图谱中的所有疾病按症状匹配程度排序，返回最可能的疾病及其匹配的症状，适合‘我发烧、咳嗽、头痛，可能是什么病’等问题。",
+        func=rank_diseases_by_symptoms,
+    ),
     # Tool.from_function(
     #     name="疾病描述语义检索",  
     #     description="用于不好直接使用Cypher语句查询的问题，如用户描述自己的症状并询问疾病类型，受限于描述的任意性，更适合使用向量表示进行语义检索。",
@@ -43,9 +65,37 @@ tools = [
     # )
 ]
 
+summary_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system",
+         "你负责维护医生与患者对话的摘要。请将新的对话内容合并进已有摘要，"
+         "保留症状、病史、用药、已给出的建议等关键信息，删去寒暄，摘要不超过300字。"),
+        ("human", "已有摘要：\n{summary}\n\n新的对话：\n{conversation}\n\n更新后的摘要："),
+    ]
+)
+
+@resource("summary_chat")
+def get_summary_chat():
+    return summary_prompt | get_llm() | StrOutputParser()
+
+def summarize_history(summary, messages):
+    conversation = "\n".join(f"{message.type}: {message.content}" for message in messages)
+    return get_summary_chat().invoke({"summary": summary or "（无）", "conversation": conversation})
+
+# Working memory of recent sessions, so the history is not refetched every turn
+@resource("memory_cache")
+def get_memory_cache():
+    return SessionMemoryCache(max_sessions=st.secrets.get("MEMORY_MAX_SESSIONS", 1000))
+
 # Create chat history callback
 def get_memory(session_id):
-    return Neo4jChatMessageHistory(session_id=session_id, graph=graph)
+    return get_memory_cache().get(session_id, lambda session_id: BufferedSummaryHistory(
+        Neo4jChatMessageHistory(session_id=session_id, graph=get_graph()),
+        summarize_history,
+        max_turns=st.secrets.get("MEMORY_MAX_TURNS", 4),
+        max_tokens=st.secrets.get("MEMORY_MAX_TOKENS", 1500),
+        store=SummaryStore(get_graph(), session_id),
+    ))
 
 # Create the agent
 agent_prompt = PromptTemplate.from_template("""
@@ -92,29 +142,245 @@ Final Answer: [你的回复]
 {agent_scratchpad}
 """)
 
-agent = create_react_agent(llm, tools, agent_prompt)
-agent_executor = AgentExecutor(
-    agent=agent,
-    tools=tools,
-    verbose=True,
-    handle_parsing_errors=True
-    )
-chat_agent = RunnableWithMessageHistory(
-    agent_executor,
-    get_memory,
-    input_messages_key="input",
-    history_messages_key="chat_history",
+# Answer from a tool's result in one LLM call, for turns routed past the ReAct loop
+routed_answer_prompt = ChatPromptTemplate.from_messages(
+    [
+        ("system",
+         "你是一位专业医学专家，请根据工具返回的结果回答用户问题，尽量完整列出相关内容。"
+         "只能基于工具结果回答，不要编造信息，结果不足时请建议用户咨询专业医生。"),
+        ("human", "历史对话记录：\n{chat_history}\n\n工具结果：\n{observation}\n\n用户问题：{input}"),
+    ]
 )
 
+@resource("routed_answer_chat")
+def get_routed_answer_chat():
+    return routed_answer_prompt | get_llm() | StrOutputParser()
+
+tools_by_name = {tool.name: tool for tool in tools}
+
+# Tools whose result is not an answer yet, one LLM call turns it into one
+SYNTHESIZED_TOOLS = {"症状鉴别诊断"}
+
+# Tools whose only LLM call writes the answer, tagged as a whole
+STREAMED_TOOLS = {"通用对话"}
+
+# Tag of the LLM run writing the answer of a routed turn, streamed to the user
+ANSWER_TAGS = {"通用对话": FINAL_ANSWER_TAG, "医疗信息查询": CYPHER_ANSWER_TAG, "症状鉴别诊断": FINAL_ANSWER_TAG}
+
+@resource("router")
+def get_router():
+    return QuestionRouter(get_linker, threshold=st.secrets.get("ROUTER_THRESHOLD", 0.8))
+
+def choose_route(inputs):
+    """Return the route of a turn, or None if the ReAct agent should handle it."""
+
+    if not st.secrets.get("ROUTER_ENABLED", True):
+        return None
+    router = get_router()
+    route = router.route(inputs["input"], has_history=bool(inputs.get("chat_history")))
+    taken = route.tool is not None and route.confidence >= router.threshold
+    router.record(route, taken)
+    return route if taken else None
+
+def route_event(route, inputs):
+    return {"tool": route.tool, "input": inputs["input"], "confidence": route.confidence, "reason": route.reason,
+            "answer_tag": ANSWER_TAGS.get(route.tool)}
+
+def tool_answer(observation):
+    # 医疗信息查询 returns the chain's {"query", "result"} dict
+    return observation["result"] if isinstance(observation, dict) else observation
+
+def answer_config(config):
+    # Tag the runs whose LLM output is the final answer
+    return {**config, "tags": [*(config.get("tags") or []), FINAL_ANSWER_TAG]}
+
+def synthesis_inputs(inputs, observation):
+    history = "\n".join(f"{message.type}: {message.content}" for message in inputs.get("chat_history") or [])
+    return {"input": inputs["input"], "chat_history": history or "（无）", "observation": observation}
+
+def run_routed(agent_executor, inputs, config):
+    """
+    Answer a turn with the routed tool and at most one more LLM call,
+    falling back to the ReAct agent when the router is unsure.
+    """
+
+    route = choose_route(inputs)
+    if route is None:
+        return agent_executor.invoke(inputs, config)
+    dispatch_custom_event("route", route_event(route, inputs), config=config)
+    if route.tool == DIRECT:
+        return {"output": route.answer}
+
+    observation = tool_answer(tools_by_name[route.tool].invoke(
+        inputs["input"], answer_config(config) if route.tool in STREAMED_TOOLS else config))
+    if route.tool in SYNTHESIZED_TOOLS:
+        observation = "".join(get_routed_answer_chat().stream(synthesis_inputs(inputs, observation),
+                                                               answer_config(config)))
+    return {"output": observation}
+
+async def arun_routed(agent_executor, inputs, config):
+    """Async version of `run_routed`."""
+
+    route = choose_route(inputs)
+    if route is None:
+        return await agent_executor.ainvoke(inputs, config)
+    await adispatch_custom_event("route", route_event(route, inputs), config=config)
+    if route.tool == DIRECT:
+        return {"output": route.answer}
+
+    observation = tool_answer(await tools_by_name[route.tool].ainvoke(
+        inputs["input"], answer_config(config) if route.tool in STREAMED_TOOLS else config))
+    if route.tool in SYNTHESIZED_TOOLS:
+        observation = "".join([chunk async for chunk in get_routed_answer_chat().astream(
+            synthesis_inputs(inputs, observation), answer_config(config))])
+    return {"output": observation}
+
+@resource("chat_agent")
+def get_chat_agent():
+    agent = create_react_agent(get_llm(), tools, agent_prompt)
+    agent_executor = AgentExecutor(
+        agent=agent,
+        tools=tools,
+        verbose=True,
+        handle_parsing_errors=True
+        )
+    routed_agent = RunnableLambda(partial(run_routed, agent_executor), partial(arun_routed, agent_executor),
+                                  name="routed_agent")
+    return RunnableWithMessageHistory(
+        routed_agent,
+        get_memory,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
+
 # Create a handler to call the agent
-def generate_response(user_input):
+def generate_response(user_input, session_id=None):
     """
     Create a handler that calls the Conversational agent
     and returns a response to be rendered in the UI
     """
 
-    response = chat_agent.invoke(
-        {"input": user_input},
-        {"configurable": {"session_id": get_session_id()}})
+    config = {"configurable": {"session_id": session_id or get_session_id()}}
+    with trace() as handler:
+        if handler is not None:
+            config["callbacks"] = [handler]
+        response = get_chat_agent().invoke({"input": user_input}, config)
+
+    return response['output']
+
+
+class AgentStreamHandler(BaseCallbackHandler):
+    """
+    Forwards the progress of the ReAct agent to a queue: every tool call as
+    ("step", tool, tool_input), and the tokens of the Final Answer as ("token", text)
+    as soon as the LLM produces them. LLM runs tagged as writing the final
+    answer, in routed turns, are streamed from their first token.
+
+    Events are put with `events.put_nowait`. For an asyncio.Queue, pass its
+    event loop: sync tools run in executor threads and report from there.
+    """
+    FINAL_ANSWER = "Final Answer:"
+
+    # Called on the thread of the run, the queue put is made thread-safe below
+    run_inline = True
+
+    def __init__(self, events, loop=None):
+        self.events = events
+        self.loop = loop
+        self.buffers = {}   # run_id -> [text held back, final answer started, answer emitted]
+        self.answer_tags = {FINAL_ANSWER_TAG}
+
+    def _emit(self, event):
+        if self.loop is None:
+            self.events.put_nowait(event)
+        else:
+            self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, tags=None, **kwargs):
+        self.buffers[run_id] = ["", not self.answer_tags.isdisjoint(tags or ()), False]
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs):
+        self.buffers[run_id] = ["", not self.answer_tags.isdisjoint(tags or ()), False]
+
+    def on_llm_new_token(self, token, *, run_id, **kwargs):
+        buffer = self.buffers.get(run_id)
+        if buffer is None:
+            return
+        buffer[0] += token
+        if not buffer[1]:
+            # Hold tokens back until the marker shows up, it may span several tokens
+            index = buffer[0].find(self.FINAL_ANSWER)
+            if index < 0:
+                return
+            buffer[1] = True
+            buffer[0] = buffer[0][index + len(self.FINAL_ANSWER):]
+
+        # Drop the whitespace between the marker and the answer
+        text = buffer[0] if buffer[2] else buffer[0].lstrip()
+        if text:
+            self._emit(("token", text))
+            buffer[0] = ""
+            buffer[2] = True
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self.buffers.pop(run_id, None)
+
+    def on_agent_action(self, action, **kwargs):
+        self._emit(("step", action.tool, action.tool_input))
+
+    def on_custom_event(self, name, data, **kwargs):
+        if name == "route" and data["tool"] != DIRECT:
+            # The answer of a routed tool may come from an LLM run of its own tag
+            if data["answer_tag"]:
+                self.answer_tags.add(data["answer_tag"])
+            self._emit(("step", data["tool"], data["input"]))
+
+
+def stream_response(user_input, on_step=None, session_id=None):
+    """
+    Like generate_response, but yields the Final Answer token by token
+    while the agent is still running. The complete answer is saved to
+    the chat history when the agent finishes, as with generate_response.
+
+    Args:
+        user_input: The user's question
+        on_step: Optional function called with (tool, tool_input) for every tool call
+        session_id: Chat history to use, defaults to the Streamlit session
+    """
+
+    events = queue.Queue()
+    config = {
+        "configurable": {"session_id": session_id or get_session_id()},
+        "callbacks": [AgentStreamHandler(events)],
+    }
+
+    def run():
+        try:
+            # Traced in the worker thread, which does not inherit the caller's context
+            with trace() as handler:
+                if handler is not None:
+                    config["callbacks"].append(handler)
+                response = get_chat_agent().invoke({"input": user_input}, config)
+            events.put(("done", response['output']))
+        except Exception as e:
+            events.put(("error", e))
+
+    # The agent runs in a worker thread, the UI consumes its events here
+    threading.Thread(target=run, daemon=True).start()
 
-    return response['output']
\ No newline at end of file
+    streamed = False
+    while True:
+        event = events.get()
+        if event[0] == "token":
+            streamed = True
+            yield event[1]
+        elif event[0] == "step":
+            if on_step:
+                on_step(event[1], event[2])
+        elif event[0] == "done":
+            # Nothing was streamed, e.g. the answer came from a parsing error handler
+            if not streamed:
+                yield event[1]
+            return
+        else:
+            raise event[1]
\ No newline at end of file
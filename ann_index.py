@@ -0,0 +1,225 @@
+import argparse
+import json
+import os
+import shutil
+import time
+
+import numpy as np
+
+ARTIFACT_VERSION = 1
+
+
+def normalize(vectors):
+    """L2-normalize rows, so inner products are cosine similarities."""
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def quantize(vectors):
+    """Symmetric int8 quantization with one scale per vector."""
+
+    scales = np.abs(vectors).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def kmeans(vectors, k, iterations=10, seed=0):
+    """Spherical k-means, returns unit-length centroids."""
+
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)]
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        empty = ~sums.any(axis=1)
+        # Reseed empty clusters with random vectors
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize(sums)
+    return centroids
+
+
+class AnnIndex:
+    """
+    In-process approximate nearest neighbour index over disease embeddings.
+
+    Vectors are L2-normalized, quantized to int8 and grouped into IVF lists
+    by spherical k-means. The lists are stored contiguously in one file, so a
+    search reads only the `nprobe` lists whose centroids are closest to the
+    query. All arrays are memory-mapped read-only, so worker processes
+    share a single copy through the page cache.
+
+    Artifact layout in the index directory:
+    - meta.json: version, dimensions, list offsets, names and node IDs
+    - codes.int8: int8 vectors, N x dimensions, in list order
+    - scales.float32: dequantization scale per vector
+    - centroids.float32: one unit-length centroid per list
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path: Directory written by `AnnIndex.build`
+        """
+        with open(os.path.join(path, "meta.json"), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta["version"] != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported ANN index version {meta['version']}")
+
+        self.dimensions = meta["dimensions"]
+        self.offsets = np.asarray(meta["offsets"], dtype=np.int64)
+        self.names = meta["names"]
+        self.node_ids = meta["node_ids"]
+
+        count, nlist = len(self.names), len(self.offsets) - 1
+        self.codes = np.memmap(os.path.join(path, "codes.int8"), dtype=np.int8, mode='r',
+                               shape=(count, self.dimensions))
+        self.scales = np.memmap(os.path.join(path, "scales.float32"), dtype=np.float32, mode='r', shape=(count,))
+        self.centroids = np.memmap(os.path.join(path, "centroids.float32"), dtype=np.float32, mode='r',
+                                   shape=(nlist, self.dimensions))
+
+
+    def __len__(self):
+        return len(self.names)
+
+
+    @staticmethod
+    def build(path, names, node_ids, vectors, nlist=None, iterations=10):
+        """
+        Cluster, quantize and write an index directory, replacing any previous one.
+
+        Args:
+            path: Index directory
+            names: Disease name of every vector
+            node_ids: Neo4j element ID of every vector
+            vectors: Embeddings, N x dimensions
+            nlist: Number of IVF lists, defaults to about sqrt(N)
+            iterations: k-means iterations
+        """
+
+        vectors = normalize(vectors)
+        count, dimensions = vectors.shape
+        nlist = max(1, min(count, nlist or int(np.sqrt(count))))
+
+        centroids = kmeans(vectors, nlist, iterations)
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=nlist))])
+        codes, scales = quantize(vectors[order])
+
+        # Write next to the old index and swap, so readers never see a partial artifact
+        tmp_path = path.rstrip("/\\") + ".tmp"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        codes.tofile(os.path.join(tmp_path, "codes.int8"))
+        scales.tofile(os.path.join(tmp_path, "scales.float32"))
+        centroids.astype(np.float32).tofile(os.path.join(tmp_path, "centroids.float32"))
+        with open(os.path.join(tmp_path, "meta.json"), 'w', encoding='utf-8') as f:
+            json.dump({
+                "version": ARTIFACT_VERSION,
+                "dimensions": dimensions,
+                "offsets": offsets.tolist(),
+                "names": [names[i] for i in order],
+                "node_ids": [node_ids[i] for i in order],
+            }, f, ensure_ascii=False)
+
+        old_path = path.rstrip("/\\") + ".old"
+        shutil.rmtree(old_path, ignore_errors=True)
+        if os.path.exists(path):
+            os.replace(path, old_path)
+        os.replace(tmp_path, path)
+        shutil.rmtree(old_path, ignore_errors=True)
+
+        print(f"ANN index written to {path}: {count} vectors, {dimensions} dimensions, {nlist} lists, "
+              f"{codes.nbytes + scales.nbytes} bytes of vectors")
+
+
+    def _scores(self, query, start, end):
+        return (self.codes[start:end] @ query) * self.scales[start:end]
+
+
+    def search(self, query, k=10, nprobe=8):
+        """
+        Find the stored vectors most similar to a query.
+
+        Args:
+            query: Query embedding
+            k: Number of results
+            nprobe: Number of IVF lists searched, None or 0 searches all vectors (brute force)
+
+        Returns:
+            Up to k (name, node ID, cosine similarity) tuples, best first
+        """
+
+        query = normalize(query)
+        if query.shape[-1] != self.dimensions:
+            raise ValueError(f"Query has {query.shape[-1]} dimensions, the index has {self.dimensions}")
+
+        if not nprobe or nprobe >= len(self.centroids):
+            rows = np.arange(len(self))
+            scores = self._scores(query, 0, len(self))
+        else:
+            closest = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+            ranges = [(self.offsets[i], self.offsets[i + 1]) for i in closest]
+            rows = np.concatenate([np.arange(start, end) for start, end in ranges])
+            scores = np.concatenate([self._scores(query, start, end) for start, end in ranges])
+
+        k = min(k, len(rows))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return [(self.names[rows[i]], self.node_ids[rows[i]], float(scores[i])) for i in top]
+
+
+    def recall(self, names, vectors, k=10, nprobe=8, samples=200, seed=0):
+        """
+        Measure recall@k of the index against exact search over the original
+        float vectors, so the loss of both IVF and int8 quantization counts.
+        Sampled original vectors are the queries.
+
+        Args:
+            names: Disease name of every vector, as passed to `build`
+            vectors: Original embeddings, N x dimensions
+
+        Returns:
+            (recall, mean index latency in ms, mean exact search latency in ms)
+        """
+
+        vectors = normalize(vectors)
+        rng = np.random.default_rng(seed)
+        rows = rng.choice(len(vectors), min(samples, len(vectors)), replace=False)
+        k = min(k, len(vectors))
+        hits, ivf_time, exact_time = 0, 0.0, 0.0
+        for row in rows:
+            query = vectors[row]
+            start = time.perf_counter()
+            approximate = {name for name, _, _ in self.search(query, k, nprobe)}
+            ivf_time += time.perf_counter() - start
+            start = time.perf_counter()
+            scores = vectors @ query
+            exact = {names[i] for i in np.argpartition(-scores, k - 1)[:k]}
+            exact_time += time.perf_counter() - start
+            hits += len(approximate & exact)
+        return hits / (len(rows) * k), ivf_time / len(rows) * 1000, exact_time / len(rows) * 1000
+
+
+if __name__ == '__main__':
+    from build_vec import fetch_embeddings
+
+    parser = argparse.ArgumentParser(description="Check an ANN index against exact search over the stored embeddings.")
+    parser.add_argument("--path", default="./data/ann", help="Index directory written by build_vec.py")
+    parser.add_argument("--property", default="descEmbedding", help="Disease property the index was built from")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", type=int, default=8)
+    parser.add_argument("--samples", type=int, default=200)
+    args = parser.parse_args()
+
+    index = AnnIndex(args.path)
+    names, _, vectors = fetch_embeddings(args.property)
+    recall, ivf_ms, exact_ms = index.recall(names, vectors, args.k, args.nprobe, args.samples)
+    print(f"{len(index)} vectors, recall@{args.k} with nprobe={args.nprobe}: {recall:.3f}, "
+          f"IVF {ivf_ms:.2f} ms, exact {exact_ms:.2f} ms per query")
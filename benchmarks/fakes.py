@@ -0,0 +1,133 @@
+import asyncio
+import hashlib
+import re
+import time
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+# Cypher the fake writes for a question, by the first matching pattern; {0} is the captured name
+FAKE_CYPHER = [
+    (r"^(.+?)(?:有哪些|有什么|的)症状", 'MATCH (d:Disease {{name: "{0}"}})-[:has_symptom]->(s:Symptom) RETURN s.name AS symptom'),
+    (r"^(.+?)(?:不能|不宜|忌)吃", 'MATCH (d:Disease {{name: "{0}"}})-[:not_eat]->(f:Food) RETURN f.name AS no_eat_food'),
+    (r"^(.+?)(?:怎么|如何)?治疗", 'MATCH (d:Disease {{name: "{0}"}}) RETURN d.cure_way AS cure_way'),
+    (r"^(.+?)(?:可能)?是什么病", 'MATCH (d:Disease)-[:has_symptom]->(s:Symptom {{name: "{0}"}}) RETURN d.name AS disease'),
+    (r"^(.+?)(?:要|需要)?做(?:什么|哪些)检查", 'MATCH (d:Disease {{name: "{0}"}})-[:need_check]->(c:Check) RETURN c.name AS check_name'),
+    (r"^(.+?)(?:吃|用)(?:什么|哪些)药", 'MATCH (d:Disease {{name: "{0}"}})-[:recommend_drug]->(r:Drug) RETURN r.name AS drug'),
+    (r"^(.+)$", 'MATCH (d:Disease {{name: "{0}"}}) RETURN d.desc AS desc'),
+]
+
+
+class FakeReActChatModel(BaseChatModel):
+    """
+    A deterministic stand-in for the chat model, for load tests and benchmarks.
+
+    It always answers in the ReAct "Final Answer" format, so the agent finishes
+    in one step, and the answer only depends on the prompt. With `tool` set,
+    the agent first calls that tool with the user's question. Given the
+    Cypher generation prompt, it writes a valid query for the question by
+    the patterns of FAKE_CYPHER instead. `latency`
+    simulates the time to the first token and `token_latency` the time
+    between tokens.
+    """
+    latency: float = 0.5
+    token_latency: float = 0.01
+    tool: str | None = None
+
+    @property
+    def _llm_type(self):
+        return "fake-react"
+
+    def _answer(self, messages):
+        prompt = "".join(str(message.content) for message in messages)
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        cypher_question = re.search(r"用户问题:\s*(.*?)\s*Cypher查询语句:\s*$", prompt, re.DOTALL)
+        if cypher_question:
+            question = cypher_question.group(1).strip().rstrip("?？。")
+            for pattern, cypher in FAKE_CYPHER:
+                match = re.search(pattern, question)
+                if match:
+                    return cypher.format(match.group(1).replace('"', ''))
+        question = re.search(r"用户新问题: (.*)", prompt)
+        # The instructions mention "Observation:" too, only the scratchpad after the question counts
+        if self.tool and question and "Observation:" not in prompt[question.end():]:
+            return f"Thought: Do I need to use a tool? Yes\nAction: {self.tool}\nAction Input: {question.group(1)}"
+        return f"Thought: Do I need to use a tool? No\nFinal Answer: 这是一个用于测试的回答（{digest}），建议及时就医。"
+
+    def _chunks(self, text):
+        # Split into short pieces that look like streamed tokens
+        return [text[i:i + 4] for i in range(0, len(text), 4)]
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._answer(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.latency)
+        for piece in self._chunks(self._answer(messages)):
+            time.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.latency)
+        for piece in self._chunks(self._answer(messages)):
+            await asyncio.sleep(self.token_latency)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=piece))
+            if run_manager:
+                await run_manager.on_llm_new_token(piece, chunk=chunk)
+            yield chunk
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic stand-in for the embedding model: the vector of a text is
+    seeded by its hash, so equal texts always get equal unit vectors.
+    `latency` simulates the time of one request, plus `text_latency` per text.
+    """
+    def __init__(self, dimensions=1536, latency=0.1, text_latency=0.0):
+        self.dimensions = dimensions
+        self.latency = latency
+        self.text_latency = text_latency
+        self.model = f"fake-embedding-{dimensions}"
+
+
+    def _vector(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+    def embed_documents(self, texts):
+        time.sleep(self.latency + self.text_latency * len(texts))
+        return [self._vector(text) for text in texts]
+
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def install_fakes(llm_latency=0.5, token_latency=0.01, tool=None, dimensions=1536, embedding_latency=0.1,
+                  embedding_cache_path="./data/embedding_cache"):
+    """
+    Replace the "llm" and "embeddings" resources of llm.py with the fakes, so
+    nothing calls OpenAI. The fake embeddings sit behind the usual cache,
+    written by this process as by build_vec.py.
+    """
+
+    from embedding_cache import CachedEmbeddings
+    from resources import override
+
+    override("llm", FakeReActChatModel(latency=llm_latency, token_latency=token_latency, tool=tool))
+    override("embeddings", CachedEmbeddings(FakeEmbeddings(dimensions, embedding_latency),
+                                            path=embedding_cache_path, max_entries=1_000_000, writable=True))
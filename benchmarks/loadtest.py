@@ -0,0 +1,110 @@
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from collections import Counter
+from uuid import uuid4
+
+import httpx
+
+QUESTIONS = [
+    "感冒有哪些症状？",
+    "头痛可能是什么病？",
+    "糖尿病不能吃什么？",
+    "高血压怎么治疗？",
+    "胃炎推荐吃什么菜？",
+]
+
+
+def percentile(values, q):
+    """Return the q-th percentile (0-100) of a list of values, nearest rank."""
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, max(0, round(q / 100 * len(values)) - 1))]
+
+
+async def run_session(client, url, turns, stream, results):
+    """Run one conversation of `turns` questions and record latency per turn."""
+    session_id = str(uuid4())
+    for turn in range(turns):
+        payload = {"session_id": session_id, "message": QUESTIONS[turn % len(QUESTIONS)]}
+        start = time.perf_counter()
+        first_token = None
+        try:
+            if stream:
+                async with client.stream("POST", f"{url}/chat/stream", json=payload) as response:
+                    status = response.status_code
+                    async for line in response.aiter_lines():
+                        if line == "event: token" and first_token is None:
+                            first_token = time.perf_counter() - start
+                        elif line == "event: error":
+                            status = "stream_error"
+            else:
+                response = await client.post(f"{url}/chat", json=payload)
+                status = response.status_code
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        results.append({
+            "status": status,
+            "latency": time.perf_counter() - start,
+            "ttft": first_token,
+        })
+
+
+async def run(url, sessions, turns, concurrency, stream, timeout):
+    """Run `sessions` conversations with at most `concurrency` of them at once."""
+    results = []
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def bounded():
+            async with semaphore:
+                await run_session(client, url, turns, stream, results)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(bounded() for _ in range(sessions)))
+        elapsed = time.perf_counter() - start
+
+    ok = [r for r in results if r["status"] == 200]
+    latencies = [r["latency"] for r in ok]
+    ttfts = [r["ttft"] for r in ok if r["ttft"] is not None]
+    return {
+        "url": url,
+        "sessions": sessions,
+        "turns": turns,
+        "concurrency": concurrency,
+        "stream": stream,
+        "requests": len(results),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "status": dict(Counter(str(r["status"]) for r in results)),
+        "latency_s": {
+            "mean": statistics.mean(latencies) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+        },
+        "ttft_s": {
+            "p50": percentile(ttfts, 50),
+            "p95": percentile(ttfts, 95),
+            "p99": percentile(ttfts, 99),
+        },
+    }
+
+
+if __name__ == "__main__":
+    # Start the server against the fake LLM first, e.g.: python server.py --fake-llm
+    parser = argparse.ArgumentParser(description="Load test the agent HTTP server.")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--sessions", type=int, default=100, help="Number of conversations")
+    parser.add_argument("--turns", type=int, default=3, help="Questions per conversation")
+    parser.add_argument("--concurrency", type=int, default=20, help="Conversations running at once")
+    parser.add_argument("--stream", action="store_true", help="Use the server-sent events endpoint")
+    parser.add_argument("--timeout", type=float, default=180.0, help="Client timeout per request")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args.url, args.sessions, args.turns, args.concurrency, args.stream, args.timeout))
+    print(json.dumps(report, indent=2, ensure_ascii=False))
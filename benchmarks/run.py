@@ -0,0 +1,265 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from uuid import uuid4
+
+# Run from anywhere: the modules under test live in the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.fakes import install_fakes
+from benchmarks.loadtest import percentile
+from benchmarks.synthetic import generate
+
+# Questions of the end-to-end scenario, filled in with names from the synthetic corpus
+QUESTION_TEMPLATES = ["{disease}有哪些症状？", "{disease}不能吃什么？", "{disease}怎么治疗？", "{symptom}可能是什么病？"]
+
+
+def latency_stats(latencies):
+    return {
+        "mean": statistics.mean(latencies) if latencies else None,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else None,
+    }
+
+
+def reset_graph(graph):
+    """Delete every node, so each build starts from an empty database."""
+
+    graph.query("""
+    MATCH (n)
+    CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF 10000 ROWS
+    """)
+
+
+def bench_build_kg(data_path, batch_size, workers, reset):
+    """Throughput of MedicalKnowledgeGraphBuilder.build over the synthetic corpus."""
+
+    from build_kg import MedicalKnowledgeGraphBuilder
+
+    builder = MedicalKnowledgeGraphBuilder(batch_size=batch_size, workers=workers)
+    if reset:
+        reset_graph(builder.graph)
+
+    start = time.perf_counter()
+    builder.build(data_path, cards_path="./data/summary/disease_cards.json")
+    elapsed = time.perf_counter() - start
+    builder.export("./data/summary")
+
+    records = len(builder.disease_infos)
+    relationships = sum(len(getattr(builder, attr)) for attr, _, _, _ in builder.RELATION_TYPES)
+    return {
+        "records": records,
+        "relationships": relationships,
+        "elapsed_s": elapsed,
+        "records_per_s": records / elapsed,
+        "relationships_per_s": relationships / elapsed,
+        "stages_s": dict(builder.timings),
+    }
+
+
+def bench_incremental(data_path, batch_size, workers, changed, removed):
+    """
+    Latency of an incremental build that changes and removes a few diseases,
+    on top of the graph built from the same corpus by the build_kg scenario.
+    Checks that the removed diseases lost their properties.
+    """
+
+    from build_kg import MedicalKnowledgeGraphBuilder
+
+    builder = MedicalKnowledgeGraphBuilder(batch_size=batch_size, workers=workers)
+    manifest_path = "./data/summary/manifest.json"
+    records = list(builder.iter_records(data_path))
+    # The graph holds the whole corpus, record that as the last build
+    builder.seed_manifest(data_path, manifest_path)
+
+    kept, gone = records[:len(records) - removed], records[len(records) - removed:]
+    for record in kept[:changed]:
+        record["desc"] += "（已更新）"
+    incremental_path = "./data/medical_incremental.json"
+    with open(incremental_path, 'w', encoding='utf-8') as f:
+        for record in kept:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    start = time.perf_counter()
+    builder.build(incremental_path, manifest_path=manifest_path, incremental=True)
+    elapsed = time.perf_counter() - start
+
+    names = [record["name"] for record in gone]
+    left = builder.graph.query("""
+    MATCH (d:Disease) WHERE d.name IN $names AND d.desc IS NOT NULL
+    RETURN count(d) AS left
+    """, {"names": names}, cache=False)[0]["left"]
+    if left:
+        print(f"Error: {left} of {len(names)} removed diseases still have their properties")
+    return {
+        "changed": changed,
+        "removed": removed,
+        "removed_left": left,
+        "elapsed_s": elapsed,
+    }
+
+
+def bench_build_vec(batch_size, concurrency):
+    """Throughput of build_vec.main with the fake embedding model, re-embedding every description."""
+
+    import build_vec
+    from llm import get_embeddings
+
+    start = time.perf_counter()
+    build_vec.main(batch_size=batch_size, concurrency=concurrency, force=True)
+    elapsed = time.perf_counter() - start
+
+    embedded = get_embeddings().stats()
+    descriptions = len(build_vec.fetch_descriptions(force=True))
+    return {
+        "descriptions": descriptions,
+        "elapsed_s": elapsed,
+        "descriptions_per_s": descriptions / elapsed,
+        "embedding_cache": embedded,
+    }
+
+
+def bench_agent(data_path, turns, warmup):
+    """End-to-end latency of agent.generate_response with the fake LLM, one new session per turn."""
+
+    from agent import generate_response, get_router
+    from resources import startup_report
+    from tools.cypher import cypher_qa
+
+    with open(data_path, 'r', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    picked = [records[i % len(records)] for i in range(warmup + turns)]
+    questions = [QUESTION_TEMPLATES[i % len(QUESTION_TEMPLATES)].format(
+        disease=record["name"], symptom=record["symptom"][0]) for i, record in enumerate(picked)]
+    for question in questions[:warmup]:
+        generate_response(question, session_id=str(uuid4()))
+
+    latencies, error_latencies, errors = [], [], {}
+    for question in questions[warmup:]:
+        start = time.perf_counter()
+        try:
+            generate_response(question, session_id=str(uuid4()))
+            latencies.append(time.perf_counter() - start)
+        except Exception as e:
+            # Failed turns count too, a fast failure must not look like a speedup
+            error_latencies.append(time.perf_counter() - start)
+            errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+            print(f"Error answering {question}: {e}")
+    return {
+        "turns": turns,
+        "errors": len(error_latencies),
+        "error_rate": len(error_latencies) / turns if turns else 0.0,
+        "errors_by_type": errors,
+        "latency_s": latency_stats(latencies + error_latencies),
+        "ok_latency_s": latency_stats(latencies),
+        "cypher": cypher_qa.stats(),
+        "router": get_router().stats(),
+        "startup": startup_report(),
+    }
+
+
+def flatten(results, prefix=""):
+    """Flatten nested results into {dotted.key: number}."""
+
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[prefix + key] = value
+    return flat
+
+
+def compare(current, baseline_path):
+    """Print the relative change of every metric against a previous results file."""
+
+    with open(baseline_path, 'r', encoding='utf-8') as f:
+        baseline = flatten(json.load(f)["scenarios"])
+    print(f"Compared with {baseline_path}:")
+    for key, value in flatten(current["scenarios"]).items():
+        if baseline.get(key):
+            print(f"  {key:<48} {baseline[key]:>12.4g} -> {value:>12.4g} ({(value / baseline[key] - 1) * 100:+.1f}%)")
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description="Offline benchmarks with a synthetic corpus and fake models, against the Neo4j in secrets.toml.")
+    parser.add_argument("scenarios", nargs="*", default=["build_kg", "incremental", "build_vec", "agent"],
+                        choices=["build_kg", "incremental", "build_vec", "agent"])
+    parser.add_argument("--diseases", type=int, default=1000, help="Size of the synthetic corpus")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-size", type=int, default=1000, help="build_kg rows per transaction")
+    parser.add_argument("--workers", type=int, default=4, help="build_kg concurrent stages")
+    parser.add_argument("--changed", type=int, default=20, help="Records changed by the incremental scenario")
+    parser.add_argument("--removed", type=int, default=5, help="Records removed by the incremental scenario")
+    parser.add_argument("--embed-batch-size", type=int, default=64, help="build_vec descriptions per request")
+    parser.add_argument("--embed-concurrency", type=int, default=4, help="build_vec requests in flight")
+    parser.add_argument("--embedding-latency", type=float, default=0.1, help="Fake embedding seconds per request")
+    parser.add_argument("--dimensions", type=int, default=1536, help="Fake embedding dimensions")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Fake LLM seconds to first token")
+    parser.add_argument("--tool", default="医疗信息查询", help="Tool the fake agent calls first, '' for none")
+    parser.add_argument("--turns", type=int, default=100, help="Agent turns measured")
+    parser.add_argument("--warmup", type=int, default=5, help="Agent turns run before measuring")
+    parser.add_argument("--reset", action="store_true",
+                        help="DELETE ALL NODES of the configured database before building, for cold builds")
+    parser.add_argument("--workdir", help="Directory for the corpus and artifacts, defaults to a new temp dir")
+    parser.add_argument("--output", default="benchmark_results.json", help="Results JSON file")
+    parser.add_argument("--baseline", help="Previous results JSON file to compare with")
+    args = parser.parse_args()
+
+    import streamlit as st
+
+    # Read secrets.toml before leaving the repository, artifacts then go to the work directory
+    st.secrets.load_if_toml_exists()
+    output = os.path.abspath(args.output)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="ipc-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    install_fakes(llm_latency=args.llm_latency, tool=args.tool or None, dimensions=args.dimensions,
+                  embedding_latency=args.embedding_latency)
+    data_path = generate("./data/medical.json", args.diseases, args.seed)
+
+    results = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "workdir": workdir,
+            "args": vars(args),
+        },
+        "scenarios": {},
+    }
+    if "build_kg" in args.scenarios:
+        results["scenarios"]["build_kg"] = bench_build_kg(data_path, args.batch_size, args.workers, args.reset)
+    if "incremental" in args.scenarios:
+        results["scenarios"]["incremental"] = bench_incremental(data_path, args.batch_size, args.workers,
+                                                                args.changed, args.removed)
+    if "build_vec" in args.scenarios:
+        results["scenarios"]["build_vec"] = bench_build_vec(args.embed_batch_size, args.embed_concurrency)
+    if "agent" in args.scenarios:
+        results["scenarios"]["agent"] = bench_agent(data_path, args.turns, args.warmup)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(json.dumps(results["scenarios"], ensure_ascii=False, indent=2))
+    print(f"Results written to {output}")
+    if args.baseline:
+        compare(results, args.baseline)
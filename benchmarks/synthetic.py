@@ -0,0 +1,131 @@
+import argparse
+import json
+import os
+import random
+
+# Building blocks of synthetic entity names, combined and numbered to any scale
+PREFIXES = ["急性", "慢性", "小儿", "老年", "过敏性", "病毒性", "细菌性", "遗传性", "原发性", "继发性"]
+ORGANS = ["胃", "肺", "肝", "肾", "心", "皮肤", "支气管", "关节", "鼻", "咽", "肠", "胆", "甲状腺", "眼", "耳"]
+DISEASE_SUFFIXES = ["炎", "病", "综合征", "结石", "溃疡", "功能紊乱", "感染", "肿大"]
+SYMPTOM_SUFFIXES = ["疼痛", "出血", "肿胀", "瘙痒", "无力", "发热", "麻木", "痉挛", "不适", "分泌物增多"]
+DRUG_SUFFIXES = ["片", "胶囊", "颗粒", "口服液", "注射液", "软膏", "滴丸"]
+FOOD_NAMES = ["鸡蛋", "牛奶", "芹菜", "猪肝", "鲫鱼", "辣椒", "白酒", "螃蟹", "羊肉", "苹果", "香蕉", "菠菜",
+              "豆腐", "海带", "南瓜", "山药", "红枣", "绿豆", "花生", "核桃"]
+COOKING = ["粥", "汤", "羹", "炒", "蒸", "炖"]
+CHECK_SUFFIXES = ["常规", "CT", "B超", "核磁共振", "功能检查", "活检", "镜检查"]
+DEPARTMENTS = {
+    "内科": ["呼吸内科", "消化内科", "心内科", "肾内科", "内分泌科"],
+    "外科": ["普外科", "骨外科", "泌尿外科", "胸外科"],
+    "儿科": ["小儿内科", "新生儿科"],
+    "五官科": ["耳鼻喉科", "眼科", "口腔科"],
+    "皮肤性病科": ["皮肤科"],
+}
+CURE_WAYS = ["药物治疗", "手术治疗", "支持性治疗", "康复治疗", "饮食调理", "物理治疗", "中医治疗"]
+PRODUCERS = ["华北制药", "同仁堂", "云南白药", "白云山", "哈药集团", "修正药业", "太极集团", "扬子江药业"]
+
+
+def vocabulary(parts, size, rng, suffixes):
+    """Return `size` distinct names built from random parts and a suffix, numbered once combinations run out."""
+
+    names = []
+    seen = set()
+    while len(names) < size:
+        name = "".join(rng.choice(part) for part in parts) + rng.choice(suffixes)
+        if name in seen:
+            name = f"{name}{len(names)}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def zipf_sample(rng, population, k, s=0.3):
+    """Sample k distinct items, favouring the front of the population like real symptom frequencies."""
+
+    k = min(k, len(population))
+    chosen = set()
+    while len(chosen) < k:
+        chosen.add(min(int(rng.paretovariate(s)) - 1, len(population) - 1))
+    return [population[i] for i in chosen]
+
+
+def sentence(rng, name, topic, length):
+    """A filler paragraph of about `length` characters about one disease."""
+
+    pieces = [f"{name}{topic}", "与多种因素有关", "常见于免疫力低下人群", "早期症状不明显",
+              "需结合临床表现和检查结果综合判断", "病程长短不一", "注意休息和饮食", "及时就医可获得较好预后"]
+    text = ""
+    while len(text) < length:
+        text += rng.choice(pieces) + "，"
+    return text[:length - 1] + "。"
+
+
+def generate_records(diseases=1000, seed=0):
+    """
+    Yield synthetic disease records shaped like the real `medical.json`.
+
+    Every field the builder reads is present with the same type and format,
+    e.g. two-level `cure_department` lists and `drug_detail` entries written
+    as "producer drug(drug)". Vocabulary sizes grow with the number of diseases.
+
+    Args:
+        diseases: Number of disease records
+        seed: Random seed, the same seed yields the same corpus
+    """
+
+    rng = random.Random(seed)
+    disease_names = vocabulary([PREFIXES, ORGANS], diseases, rng, DISEASE_SUFFIXES)
+    symptoms = vocabulary([ORGANS], max(50, diseases * 2 // 3), rng, SYMPTOM_SUFFIXES)
+    drugs = vocabulary([ORGANS, ["康", "宁", "舒", "清", "安"]], max(50, diseases // 2), rng, DRUG_SUFFIXES)
+    recipes = vocabulary([FOOD_NAMES], max(30, diseases // 4), rng, COOKING)
+    checks = vocabulary([ORGANS], max(30, diseases // 10), rng, CHECK_SUFFIXES)
+
+    for i, name in enumerate(disease_names):
+        parent = rng.choice(list(DEPARTMENTS))
+        department = [parent, rng.choice(DEPARTMENTS[parent])] if rng.random() < 0.8 else [parent]
+        record_drugs = rng.sample(drugs, rng.randint(1, 6))
+        yield {
+            "_id": {"$oid": f"{seed:08x}{i:016x}"},
+            "name": name,
+            "desc": sentence(rng, name, "是一种常见疾病", rng.randint(80, 400)),
+            "category": ["疾病百科", parent],
+            "prevent": sentence(rng, name, "的预防", rng.randint(40, 200)),
+            "cause": sentence(rng, name, "的病因", rng.randint(40, 300)),
+            "symptom": zipf_sample(rng, symptoms, rng.randint(2, 10)),
+            "yibao_status": rng.choice(["是", "否"]),
+            "get_prob": f"{rng.uniform(0.001, 5):.3f}%",
+            "easy_get": rng.choice(["无特定人群", "儿童", "老年人", "孕妇", "中青年"]),
+            "get_way": rng.choice(["无传染性", "呼吸道传播", "接触传播"]),
+            "acompany": rng.sample(disease_names, rng.randint(0, 3)),
+            "cure_department": department,
+            "cure_way": rng.sample(CURE_WAYS, rng.randint(1, 3)),
+            "cure_lasttime": rng.choice(["7-14天", "1-2个月", "3个月", "长期随访"]),
+            "cured_prob": f"{rng.randint(30, 99)}%",
+            "common_drug": record_drugs[:2],
+            "cost_money": f"根据不同医院，收费标准不一致，市三甲医院约（{rng.randint(5, 50) * 100}元）",
+            "check": rng.sample(checks, rng.randint(1, 6)),
+            "do_eat": rng.sample(FOOD_NAMES, rng.randint(0, 4)),
+            "not_eat": rng.sample(FOOD_NAMES, rng.randint(0, 4)),
+            "recommand_eat": rng.sample(recipes, rng.randint(0, 8)),
+            "recommand_drug": record_drugs,
+            "drug_detail": [f"{rng.choice(PRODUCERS)}{drug}({drug})" for drug in record_drugs],
+        }
+
+
+def generate(path, diseases=1000, seed=0):
+    """Write a synthetic corpus as JSON lines, like `data/medical.json`. Returns the path."""
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in generate_records(diseases, seed):
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    return path
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic medical.json corpus.")
+    parser.add_argument("--output", default="./data/synthetic_medical.json")
+    parser.add_argument("--diseases", type=int, default=1000, help="Number of disease records")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"Wrote {args.diseases} records to {generate(args.output, args.diseases, args.seed)}")
@@ -1,6 +1,7 @@
 import streamlit as st
 
-from agent import generate_response
+from agent import generate_response, stream_response
+from tracing import get_recorder
 from utils import write_message
 
 # Page Config
@@ -22,6 +23,31 @@ if question := st.chat_input("输入你的症状"):
     write_message('user', question)
 
     # Generate a response
-    with st.spinner('思考中...'):
-        response = generate_response(question)
-        write_message('assistant', response)
+    if st.secrets.get("STREAM_RESPONSES", True):
+        with st.chat_message('assistant'):
+            status = st.status('思考中...')
+            response = st.write_stream(stream_response(
+                question,
+                on_step=lambda tool, tool_input: status.write(f"**{tool}**: {tool_input}")
+            ))
+            status.update(label='已完成', state='complete', expanded=False)
+        st.session_state.messages.append({"role": 'assistant', "content": response})
+    else:
+        with st.spinner('思考中...'):
+            response = generate_response(question)
+            write_message('assistant', response)
+
+# Per-stage latencies of all turns answered by this process
+if st.secrets.get("SHOW_TRACING", False):
+    with st.sidebar:
+        st.subheader("耗时统计")
+        summary = get_recorder().summary()
+        if summary:
+            st.dataframe([{
+                "阶段": row["stage"],
+                "次数": row["count"],
+                "p50 (ms)": round(row["p50"] * 1000),
+                "p95 (ms)": round(row["p95"] * 1000),
+            } for row in summary], hide_index=True)
+        else:
+            st.caption("暂无数据")
@@ -1,11 +1,18 @@
+import argparse
+import csv
+import hashlib
 import json
 import os
-import threading
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from neo4j.exceptions import TransientError
 from tqdm import tqdm
 
-from graph import graph
-from llm import llm, embeddings
+from entity_linker import compile_linker
+from graph import bump_graph_version, create_driver, get_graph, write_schema_snapshot
+from vector_storage import LEGACY_TARGET, load_targets
 
 
 class MedicalKnowledgeGraphBuilder:
@@ -13,19 +20,54 @@ class MedicalKnowledgeGraphBuilder:
     A class to build a medical knowledge graph from JSON data
     and store it in Neo4j database using langchain_neo4j.
     """
-    def __init__(self):
-        """Initialize the knowledge graph builder with empty entity and relation lists."""
-        self.graph = graph
-
-        # Entity nodes (8 types)
-        self.drugs = []          # Drugs
-        self.recipes = []        # Recipes
-        self.foods = []          # Foods
-        self.checks = []         # Medical checks
-        self.departments = []    # Medical departments
-        self.producers = []      # Drug manufacturers
-        self.diseases = []       # Diseases
-        self.symptoms = []       # Symptoms
+    # Entity labels, each gets a uniqueness constraint on `name`
+    ENTITY_LABELS = ["Drug", "Recipe", "Food", "Check", "Department", "Producer", "Disease", "Symptom"]
+
+    # (relation list attribute, relation type, source label, target label)
+    RELATION_TYPES = [
+        ("rels_department", "belongs_to", "Department", "Department"),
+        ("rels_not_eat", "not_eat", "Disease", "Food"),
+        ("rels_do_eat", "do_eat", "Disease", "Food"),
+        ("rels_recommend_eat", "recommend_recipes", "Disease", "Recipe"),
+        ("rels_common_drug", "has_common_drug", "Disease", "Drug"),
+        ("rels_recommend_drug", "recommend_drug", "Disease", "Drug"),
+        ("rels_check", "need_check", "Disease", "Check"),
+        ("rels_drug_producer", "production", "Producer", "Drug"),
+        ("rels_symptom", "has_symptom", "Disease", "Symptom"),
+        ("rels_accompany", "accompany_with", "Disease", "Disease"),
+        ("rels_category", "cure_department", "Disease", "Department"),
+    ]
+
+    # Retries of a batch failing with a transient error (e.g. a deadlock), and the delay before the first one
+    WRITE_RETRIES = 3
+    RETRY_BACKOFF = 0.5
+
+    # Disease cards: at most this many names per list and characters per text field
+    CARD_LIST_LIMIT = 15
+    CARD_TEXT_LIMIT = 150
+
+    def __init__(self, batch_size=1000, workers=4):
+        """
+        Initialize the knowledge graph builder with empty entity and relation lists.
+
+        Args:
+            batch_size: Number of rows sent to Neo4j in one UNWIND transaction
+            workers: Number of build stages run concurrently
+        """
+        self.graph = get_graph()
+        self.batch_size = batch_size
+        self.workers = workers
+        self.timings = {}        # Wall-clock seconds per build stage
+
+        # Entity nodes (8 types), deduplicated while extracting
+        self.drugs = set()          # Drugs
+        self.recipes = set()        # Recipes
+        self.foods = set()          # Foods
+        self.checks = set()         # Medical checks
+        self.departments = set()    # Medical departments
+        self.producers = set()      # Drug manufacturers
+        self.diseases = set()       # Diseases
+        self.symptoms = set()       # Symptoms
 
         self.disease_infos = []  # Disease information
         self.disease_properties = ['desc', 'prevent', 'cause', 'get_prob', 'easy_get', 'cure_way', 'cure_lasttime', 'cured_prob']  # Disease properties
@@ -43,139 +85,401 @@ class MedicalKnowledgeGraphBuilder:
         self.rels_category = []         # Disease-Department relations
         
         
-    def extract_triples(self, path):
+    def iter_records(self, path):
         """
-        Extract entity and relationship triples from JSON file.
+        Lazily read disease records from a JSON lines file.
         
         Args:
-            data_path: Path to the JSON data file
+            path: Path to the JSON data file
+        
+        Yields:
+            One parsed JSON object per non-empty line
         """
         
         with open(path, 'r', encoding='utf8') as f:
-            for line in tqdm(f.readlines(), desc="Extracting triples from JSON"):
-                data_json = json.loads(line)
-                disease_dict = {}
-                disease = data_json['name']
-                disease_dict['name'] = disease
-                self.diseases.append(disease)
-                
-                # Initialize disease attributes
-                disease_dict.update({k: '' for k in self.disease_properties})
-
-                # Process symptoms
-                if 'symptom' in data_json:
-                    self.symptoms.extend(data_json['symptom'])
-                    for symptom in data_json['symptom']:
-                        self.rels_symptom.append([disease, 'has_symptom', symptom])
-
-                # Process accompanying diseases
-                if 'acompany' in data_json:
-                    for accompany in data_json['acompany']:
-                        self.rels_accompany.append([disease, 'accompany_with', accompany])
-                        self.diseases.append(accompany)
-
-                # Process disease descriptions and attributes
-                for key in self.disease_properties:
-                    if key in data_json:
-                        disease_dict[key] = data_json[key]
-
-                # Process cure departments
-                if 'cure_department' in data_json:
-                    cure_department = data_json['cure_department']
-                    if len(cure_department) == 1:
-                        self.rels_category.append([disease, 'cure_department', cure_department[0]])
-                    if len(cure_department) == 2:
-                        parent = cure_department[0]
-                        child = cure_department[1]
-                        self.rels_department.append([child, 'belongs_to', parent])
-                        self.rels_category.append([disease, 'cure_department', child])
-
-                    disease_dict['cure_department'] = cure_department
-                    self.departments.extend(cure_department)
-
-                # Process drugs
-                if 'common_drug' in data_json:
-                    common_drug = data_json['common_drug']
-                    for drug in common_drug:
-                        self.rels_common_drug.append([disease, 'has_common_drug', drug])
-                    self.drugs.extend(common_drug)
-
-                if 'recommand_drug' in data_json:
-                    recommend_drug = data_json['recommand_drug']
-                    self.drugs.extend(recommend_drug)
-                    for drug in recommend_drug:
-                        self.rels_recommend_drug.append([disease, 'recommend_drug', drug])
-
-                # Process diet information
-                if 'not_eat' in data_json:
-                    not_eat = data_json['not_eat']
-                    for food in not_eat:
-                        self.rels_not_eat.append([disease, 'not_eat', food])
-                    self.foods.extend(not_eat)
-                    
-                if 'do_eat' in data_json:
-                    do_eat = data_json['do_eat']
-                    for food in do_eat:
-                        self.rels_do_eat.append([disease, 'do_eat', food])
-                    self.foods.extend(do_eat)
-
-                if 'recommand_eat' in data_json:
-                    recommend_eat = data_json['recommand_eat']
-                    for recipe in recommend_eat:
-                        self.rels_recommend_eat.append([disease, 'recommend_recipes', recipe])
-                    self.recipes.extend(recommend_eat)
-
-                # Process medical checks
-                if 'check' in data_json:
-                    checks = data_json['check']
-                    for check in checks:
-                        self.rels_check.append([disease, 'need_check', check])
-                    self.checks.extend(checks)
-
-                # Process drug details
-                if 'drug_detail' in data_json:
-                    for detail in data_json['drug_detail']:
-                        parts = detail.split('(')
-                        if len(parts) == 2:
-                            producer, drug = parts
-                            drug = drug.rstrip(')')
-                            if producer.find(drug) > 0:
-                                producer = producer.rstrip(drug)
-                            self.producers.append(producer)
-                            self.drugs.append(drug)
-                            self.rels_drug_producer.append([producer, 'production', drug])
-                        else:
-                            drug = parts[0]
-                            self.drugs.append(drug)
-
-                self.disease_infos.append(disease_dict)
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+    def _add(self, entities, names):
+        """Add interned entity names to an entity set and return them."""
+        
+        names = [sys.intern(name) for name in names]
+        entities.update(names)
+        return names
+
+
+    def parse_record(self, data_json):
+        """
+        Parse one disease record, registering its entities in the entity sets.
+        
+        Args:
+            data_json: A disease record from the JSON data file
+        
+        Returns:
+            A tuple (disease_dict, triples) where triples maps each relation
+            list attribute (e.g. 'rels_symptom') to the triples of this record
+        """
+        
+        triples = {attr: [] for attr, _, _, _ in self.RELATION_TYPES}
+        disease_dict = {}
+        disease = self._add(self.diseases, [data_json['name']])[0]
+        disease_dict['name'] = disease
+        
+        # Initialize disease attributes
+        disease_dict.update({k: '' for k in self.disease_properties})
+
+        # Process symptoms
+        if 'symptom' in data_json:
+            for symptom in self._add(self.symptoms, data_json['symptom']):
+                triples['rels_symptom'].append((disease, 'has_symptom', symptom))
+
+        # Process accompanying diseases
+        if 'acompany' in data_json:
+            for accompany in self._add(self.diseases, data_json['acompany']):
+                triples['rels_accompany'].append((disease, 'accompany_with', accompany))
+
+        # Process disease descriptions and attributes
+        for key in self.disease_properties:
+            if key in data_json:
+                disease_dict[key] = data_json[key]
+
+        # Process cure departments
+        if 'cure_department' in data_json:
+            cure_department = self._add(self.departments, data_json['cure_department'])
+            if len(cure_department) == 1:
+                triples['rels_category'].append((disease, 'cure_department', cure_department[0]))
+            if len(cure_department) == 2:
+                parent = cure_department[0]
+                child = cure_department[1]
+                triples['rels_department'].append((child, 'belongs_to', parent))
+                triples['rels_category'].append((disease, 'cure_department', child))
+
+            disease_dict['cure_department'] = cure_department
+
+        # Process drugs
+        if 'common_drug' in data_json:
+            for drug in self._add(self.drugs, data_json['common_drug']):
+                triples['rels_common_drug'].append((disease, 'has_common_drug', drug))
+
+        if 'recommand_drug' in data_json:
+            for drug in self._add(self.drugs, data_json['recommand_drug']):
+                triples['rels_recommend_drug'].append((disease, 'recommend_drug', drug))
+
+        # Process diet information
+        if 'not_eat' in data_json:
+            for food in self._add(self.foods, data_json['not_eat']):
+                triples['rels_not_eat'].append((disease, 'not_eat', food))
+            
+        if 'do_eat' in data_json:
+            for food in self._add(self.foods, data_json['do_eat']):
+                triples['rels_do_eat'].append((disease, 'do_eat', food))
+
+        if 'recommand_eat' in data_json:
+            for recipe in self._add(self.recipes, data_json['recommand_eat']):
+                triples['rels_recommend_eat'].append((disease, 'recommend_recipes', recipe))
+
+        # Process medical checks
+        if 'check' in data_json:
+            for check in self._add(self.checks, data_json['check']):
+                triples['rels_check'].append((disease, 'need_check', check))
+
+        # Process drug details
+        if 'drug_detail' in data_json:
+            for detail in data_json['drug_detail']:
+                parts = detail.split('(')
+                if len(parts) == 2:
+                    producer, drug = parts
+                    drug = drug.rstrip(')')
+                    if producer.find(drug) > 0:
+                        producer = producer.rstrip(drug)
+                    producer = self._add(self.producers, [producer])[0]
+                    drug = self._add(self.drugs, [drug])[0]
+                    triples['rels_drug_producer'].append((producer, 'production', drug))
+                else:
+                    self._add(self.drugs, [parts[0]])
+
+        return disease_dict, triples
+
+
+    def extract_triples(self, path):
+        """
+        Extract entity and relationship triples from JSON file
+        and keep all of them in memory (needed by `export`).
+        
+        Args:
+            path: Path to the JSON data file
+        """
+        
+        for data_json in tqdm(self.iter_records(path), desc="Extracting triples from JSON"):
+            disease_dict, triples = self.parse_record(data_json)
+            for attr, record_triples in triples.items():
+                getattr(self, attr).extend(record_triples)
+            self.disease_infos.append(disease_dict)
+
+
+    def iter_batches(self, path):
+        """
+        Stream triples and disease properties from the JSON file in batches
+        of at most `self.batch_size`, without keeping them in memory.
+        Entity names still accumulate in the (deduplicated) entity sets.
+        
+        Args:
+            path: Path to the JSON data file
+        
+        Yields:
+            Tuples (key, batch) where key is a relation list attribute
+            (e.g. 'rels_symptom') or 'disease_infos'
+        """
+        
+        buffers = {attr: [] for attr, _, _, _ in self.RELATION_TYPES}
+        buffers['disease_infos'] = []
+        
+        for data_json in tqdm(self.iter_records(path), desc="Streaming triples from JSON"):
+            disease_dict, triples = self.parse_record(data_json)
+            triples['disease_infos'] = [disease_dict]
+            for key, items in triples.items():
+                buffer = buffers[key]
+                buffer.extend(items)
+                if len(buffer) >= self.batch_size:
+                    yield key, buffer
+                    buffers[key] = []
+        
+        for key, buffer in buffers.items():
+            if buffer:
+                yield key, buffer
+
+
+    def write(self, cypher, params):
+        """
+        Run a write query, retrying with exponential backoff when it fails
+        with a transient error, e.g. a deadlock between concurrent stages.
+        """
+        
+        for attempt in range(self.WRITE_RETRIES + 1):
+            try:
+                return self.graph.query(cypher, params)
+            except TransientError as e:
+                if attempt == self.WRITE_RETRIES:
+                    raise
+                print(f"Transient error, retrying batch: {e}")
+                time.sleep(self.RETRY_BACKOFF * 2 ** attempt)
+
+
+    def write_node_batch(self, names, entity_type):
+        """
+        Merge one batch of nodes in a single transaction.
+        If the batch still fails after the retries of `write`, its rows are
+        retried one by one so the failing names are still reported.
+        
+        Args:
+            names: List of cleaned entity names
+            entity_type: Type label for the entities
+        """
+        
+        cypher = f"""
+        UNWIND $rows AS row
+        MERGE (n:{entity_type} {{name: row.name}})
+        """
+        try:
+            self.write(cypher, {"rows": [{"name": name} for name in names]})
+        except Exception as e:
+            print(f"Error creating {entity_type} batch of {len(names)} nodes: {e}")
+            self._create_nodes_one_by_one(names, entity_type)
 
 
     def create_nodes(self, entities, entity_type):
         """
         Create nodes in Neo4j for the given entities.
+
+        Names are sent in chunks of `self.batch_size` through a single
+        `UNWIND ... MERGE` per transaction.
         
         Args:
             entities: List of entity names
             entity_type: Type label for the entities
         """
         
-        for node in tqdm(set(entities), desc=f"Creating {entity_type} nodes"):
-            # Use MERGE to avoid duplicates
+        names = sorted({node.replace("'", "") for node in entities})
+        
+        start = time.perf_counter()
+        with tqdm(total=len(names), desc=f"Creating {entity_type} nodes") as pbar:
+            for i in range(0, len(names), self.batch_size):
+                batch = names[i:i + self.batch_size]
+                self.write_node_batch(batch, entity_type)
+                pbar.update(len(batch))
+        
+        elapsed = time.perf_counter() - start
+        rate = len(names) / elapsed if elapsed > 0 else float("inf")
+        print(f"Created {len(names)} {entity_type} nodes in {elapsed:.2f}s ({rate:.0f} nodes/s)")
+
+
+    def _create_nodes_one_by_one(self, names, entity_type):
+        """Fallback for a failed batch: create nodes one per query and report each failure."""
+        
+        cypher = f"""
+        MERGE (n:{entity_type} {{name: $name}})
+        """
+        for name in names:
+            try:
+                self.write(cypher, {"name": name})
+            except Exception as e:
+                print(f"Error creating node: {e}")
+                print(f"Failed query: {cypher} with name={name}")
+        
+        
+    def create_schema(self):
+        """
+        Create a uniqueness constraint on `name` for every entity label,
+        and the full-text index used by the hybrid disease retriever.
+
+        The constraint is backed by an index, so the MERGE and MATCH
+        lookups done during ingest become index seeks instead of label scans.
+        """
+        
+        for label in self.ENTITY_LABELS:
             cypher = f"""
-            MERGE (n:{entity_type} {{name: $name}})
+            CREATE CONSTRAINT {label.lower()}_name IF NOT EXISTS
+            FOR (n:{label}) REQUIRE n.name IS UNIQUE
             """
             try:
-                # In langchain_neo4j, we use query instead of run, and parameters instead of string formatting
-                self.graph.query(cypher, {"name": node.replace("'", "")})
+                self.graph.query(cypher)
             except Exception as e:
-                print(f"Error creating node: {e}")
-                print(f"Failed query: {cypher} with name={node}")
+                print(f"Error creating constraint on {label}.name: {e}")
+        
+        # Lexical search over disease texts, the cjk analyzer indexes Chinese as character bigrams
+        try:
+            self.graph.query("""
+            CREATE FULLTEXT INDEX diseaseFulltext IF NOT EXISTS
+            FOR (d:Disease) ON EACH [d.name, d.desc, d.cause, d.cure_way]
+            OPTIONS {indexConfig: {`fulltext.analyzer`: 'cjk'}}
+            """)
+        except Exception as e:
+            print(f"Error creating full-text index on Disease: {e}")
+        
+        # Constraints are populated asynchronously, wait before relying on them
+        self.graph.query("CALL db.awaitIndexes(300)")
+        print(f"Schema ready: name constraints on {', '.join(self.ENTITY_LABELS)}")
+
+
+    def explain_operators(self, driver, cypher, params=None):
+        """
+        Return the operators of the EXPLAIN plan for a query.
+        
+        Args:
+            driver: Neo4j driver, Neo4jGraph.query only returns records while
+                the plan lives on the result summary
+            cypher: Cypher query to explain
+            params: Query parameters
+        
+        Returns:
+            (operator type, [operator types of each child subtree]) per plan operator
+        """
+        
+        summary = driver.execute_query(f"EXPLAIN {cypher}", params or {},
+                                       database_=os.environ.get("NEO4J_DATABASE", "neo4j")).summary
+        
+        def subtree(plan):
+            operators = [plan["operatorType"].split("@")[0]]
+            for child in plan.get("children", []):
+                operators += subtree(child)
+            return operators
+        
+        operators = []
+        stack = [summary.plan] if summary.plan else []
+        while stack:
+            plan = stack.pop()
+            children = plan.get("children", [])
+            operators.append((plan["operatorType"].split("@")[0], [subtree(child) for child in children]))
+            stack.extend(children)
+        return operators
+
+
+    def verify_index_usage(self):
+        """
+        Check via EXPLAIN that relationship creation looks up both endpoints
+        through an index seek. Prints a warning for every relation that does not.
+        
+        Label or full scans fail the check, as does a CartesianProduct unless
+        every side of it is an index seek (the usual plan for two lookups).
+        
+        Returns:
+            True if every relation query uses index seeks
+        """
         
+        ok = True
+        with create_driver() as driver:
+            for _, relation, source_type, target_type in self.RELATION_TYPES:
+                cypher = self._relationship_query(relation, source_type, target_type)
+                try:
+                    operators = self.explain_operators(driver, cypher, {"rows": [{"source": "", "target": ""}]})
+                except Exception as e:
+                    print(f"Error explaining {relation} query: {e}")
+                    ok = False
+                    continue
+                
+                seeks = [op for op, _ in operators if "IndexSeek" in op]
+                scans = [op for op, children in operators
+                         if op in ("NodeByLabelScan", "AllNodesScan")
+                         or (op == "CartesianProduct"
+                             and not all(any("IndexSeek" in child_op for child_op in child) for child in children))]
+                if len(seeks) < 2 or scans:
+                    ok = False
+                    print(f"Warning: {relation} ({source_type}->{target_type}) plan does not use index seeks: "
+                          f"{[op for op, _ in operators]}")
         
+        if ok:
+            print("Index check passed: all relationship queries use index seeks")
+        return ok
+
+
+    def _relationship_query(self, relation, source_type, target_type, merge_nodes=False):
+        """
+        Build the UNWIND query that merges one batch of `relation` edges.
+        With `merge_nodes`, missing endpoint nodes are created as well.
+        """
+        
+        lookup = "MERGE" if merge_nodes else "MATCH"
+        return f"""
+        UNWIND $rows AS row
+        {lookup} (s:{source_type} {{name: row.source}})
+        {lookup} (t:{target_type} {{name: row.target}})
+        MERGE (s)-[r:{relation}]->(t)
+        """
+
+
+    def write_relationship_batch(self, triples, source_type, target_type, merge_nodes=False):
+        """
+        Write one batch of triples sharing a relation type in a single transaction.
+        If the batch still fails after the retries of `write`, its rows are
+        retried one by one so the failing triples are still reported.
+        
+        Args:
+            triples: List of [source, relation, target] triples with the same relation
+            source_type: Entity type for the source node
+            target_type: Entity type for the target node
+            merge_nodes: Create missing endpoint nodes instead of skipping the edge
+        """
+        
+        relation = triples[0][1]
+        # Sorted, so concurrent stages lock shared nodes in the same order
+        rows = sorted(({"source": source.replace("'", ""), "target": target.replace("'", "")}
+                       for source, _, target in triples), key=lambda row: (row["source"], row["target"]))
+        cypher = self._relationship_query(relation, source_type, target_type, merge_nodes)
+        try:
+            self.write(cypher, {"rows": rows})
+        except Exception as e:
+            print(f"Error creating {relation} batch of {len(rows)} relationships: {e}")
+            self._create_relationships_one_by_one(rows, relation, source_type, target_type)
+
+
     def create_relationships(self, triples, source_type, target_type):
         """
         Create relationships in Neo4j for the given triples.
+
+        Triples are grouped by relation type and sent in chunks of
+        `self.batch_size` through one `UNWIND` query per transaction.
         
         Args:
             triples: List of [source, relation, target] triples
@@ -185,66 +489,126 @@ class MedicalKnowledgeGraphBuilder:
         
         if not triples:
             return
+        
+        grouped = {}
+        for triple in triples:
+            grouped.setdefault(triple[1], []).append(triple)
+        
+        for relation, rows in grouped.items():
+            start = time.perf_counter()
+            with tqdm(total=len(rows), desc=f"Creating {relation} relationships") as pbar:
+                for i in range(0, len(rows), self.batch_size):
+                    batch = rows[i:i + self.batch_size]
+                    self.write_relationship_batch(batch, source_type, target_type)
+                    pbar.update(len(batch))
             
-        relation_type = triples[0][1]
+            elapsed = time.perf_counter() - start
+            rate = len(rows) / elapsed if elapsed > 0 else float("inf")
+            print(f"Created {len(rows)} {relation} relationships in {elapsed:.2f}s ({rate:.0f} rels/s)")
+
+
+    def _create_relationships_one_by_one(self, rows, relation, source_type, target_type):
+        """Fallback for a failed batch: create relationships one per query and report each failure."""
         
-        for source, relation, target in tqdm(triples, desc=f"Creating {relation_type} relationships"):
+        cypher = f"""
+        MATCH (s:{source_type} {{name: $source}})
+        MATCH (t:{target_type} {{name: $target}})
+        MERGE (s)-[r:{relation}]->(t)
+        """
+        for row in rows:
+            try:
+                self.write(cypher, row)
+            except Exception as e:
+                print(f"Error creating relationship: {e}")
+                print(f"Failed query: {cypher} with source={row['source']}, target={row['target']}")
+
+
+    def _clean_properties(self, entity_dict):
+        """Split an entity dict into its name and cleaned-up properties."""
+        
+        name = entity_dict['name'].replace("'", "")
+        properties = {k: v for k, v in entity_dict.items() if k != 'name'}
+        
+        # Strip quotes and newlines from text properties, lists are kept as they are
+        for k, v in properties.items():
+            if isinstance(v, str):
+                properties[k] = v.replace("'", "").replace("\n", " ")
+        return name, properties
+
+
+    def write_property_batch(self, entity_infos, entity_type, merge_nodes=False):
+        """
+        Set properties for one batch of nodes in a single transaction.
+        If the batch still fails after the retries of `write`, its rows are
+        retried one by one so the failing entities are still reported.
+        
+        Args:
+            entity_infos: List of dictionaries containing entity information
+            entity_type: Type of entity to update
+            merge_nodes: Create missing nodes instead of skipping them
+        """
+        
+        rows = []
+        for entity_dict in entity_infos:
+            name, properties = self._clean_properties(entity_dict)
+            if properties:
+                rows.append({"name": name, "properties": properties})
+        if not rows:
+            return
+        
+        lookup = "MERGE" if merge_nodes else "MATCH"
+        cypher = f"""
+        UNWIND $rows AS row
+        {lookup} (n:{entity_type} {{name: row.name}})
+        SET n += row.properties
+        """
+        rows.sort(key=lambda row: row["name"])
+        try:
+            self.write(cypher, {"rows": rows})
+        except Exception as e:
+            print(f"Error setting attributes for {entity_type} batch of {len(rows)} nodes: {e}")
+            self._set_properties_one_by_one(rows, entity_type)
+
+
+    def _set_properties_one_by_one(self, rows, entity_type):
+        """Fallback for a failed batch: set properties one node per query and report each failure."""
+        
+        for row in rows:
+            set_clauses = ", ".join([f"n.{k} = ${k}" for k in row["properties"].keys()])
             cypher = f"""
-            MATCH (s:{source_type}), (t:{target_type})
-            WHERE s.name = $source AND t.name = $target
-            MERGE (s)-[r:{relation}]->(t)
+            MATCH (n:{entity_type})
+            WHERE n.name = $name
+            SET {set_clauses}
             """
             try:
-                self.graph.query(cypher, {
-                    "source": source.replace("'", ""), 
-                    "target": target.replace("'", "")
-                })
+                params = {"name": row["name"]}
+                params.update(row["properties"])
+                self.write(cypher, params)
             except Exception as e:
-                print(f"Error creating relationship: {e}")
+                print(f"Error setting attributes: {e}")
                 print(f"Failed query: {cypher}")
 
 
     def set_node_properties(self, entity_infos, entity_type):
         """
-        Set properties for nodes in Neo4j.
+        Set properties for nodes in Neo4j, `self.batch_size` nodes per transaction.
         
         Args:
             entity_infos: List of dictionaries containing entity information
             entity_type: Type of entity to update
         """
         
-        for entity_dict in tqdm(entity_infos, desc=f"Setting {entity_type} properties"):
-            name = entity_dict['name']
-            properties = {k: v for k, v in entity_dict.items() if k != 'name'}
-            
-            # Convert list properties to string to avoid type issues
-            for k, v in properties.items():
-                # if isinstance(v, list):
-                #     properties[k] = v
-                if isinstance(v, str):
-                    properties[k] = v.replace("'", "").replace("\n", " ")
-            
-            # Set all properties in one query
-            if properties:
-                set_clauses = ", ".join([f"n.{k} = ${k}" for k in properties.keys()])
-                cypher = f"""
-                MATCH (n:{entity_type})
-                WHERE n.name = $name
-                SET {set_clauses}
-                """
-                try:
-                    params = {"name": name.replace("'", "")}
-                    params.update(properties)
-                    self.graph.query(cypher, params)
-                except Exception as e:
-                    print(f"Error setting attributes: {e}")
-                    print(f"Failed query: {cypher}")
+        with tqdm(total=len(entity_infos), desc=f"Setting {entity_type} properties") as pbar:
+            for i in range(0, len(entity_infos), self.batch_size):
+                batch = entity_infos[i:i + self.batch_size]
+                self.write_property_batch(batch, entity_type)
+                pbar.update(len(batch))
 
 
-    def build_nodes(self):
-        """Create all entity nodes in the knowledge graph."""
+    def entity_types(self):
+        """Return (entities, label) pairs for all entity types."""
         
-        entity_types = [
+        return [
             (self.drugs, "Drug"),
             (self.recipes, "Recipe"),
             (self.foods, "Food"),
@@ -254,41 +618,100 @@ class MedicalKnowledgeGraphBuilder:
             (self.diseases, "Disease"),
             (self.symptoms, "Symptom")
         ]
+
+
+    def build_nodes(self):
+        """Create all entity nodes in the knowledge graph."""
         
-        for entities, entity_type in entity_types:
+        for entities, entity_type in self.entity_types():
             self.create_nodes(entities, entity_type)
 
 
     def build_relationships(self):
         """Create all relationships in the knowledge graph."""
         
-        relation_types = [
-            (self.rels_department, "Department", "Department"),
-            (self.rels_not_eat, "Disease", "Food"),
-            (self.rels_do_eat, "Disease", "Food"),
-            (self.rels_recommend_eat, "Disease", "Recipe"),
-            (self.rels_common_drug, "Disease", "Drug"),
-            (self.rels_recommend_drug, "Disease", "Drug"),
-            (self.rels_check, "Disease", "Check"),
-            (self.rels_drug_producer, "Producer", "Drug"),
-            (self.rels_symptom, "Disease", "Symptom"),
-            (self.rels_accompany, "Disease", "Disease"),
-            (self.rels_category, "Disease", "Department")
-        ]
-        
-        for triples, source_type, target_type in relation_types:
-            self.create_relationships(triples, source_type, target_type)
+        for attr, _, source_type, target_type in self.RELATION_TYPES:
+            self.create_relationships(getattr(self, attr), source_type, target_type)
 
 
     def set_disease_properties(self):
-        """Set properties for disease nodes using threading to avoid timeout."""
+        """Set properties for disease nodes."""
         
-        thread = threading.Thread(
-            target=self.set_node_properties,
-            args=(self.disease_infos, "Disease")
-        )
-        thread.daemon = False
-        thread.start()
+        self.set_node_properties(self.disease_infos, "Disease")
+
+
+    def _timed(self, stage, func, *args):
+        """Run one build stage and record its wall-clock time."""
+        
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.timings[stage] = time.perf_counter() - start
+
+
+    def run_stages(self):
+        """
+        Run node creation, property setting and relationship creation on a
+        pool of `self.workers` threads, respecting their dependencies.
+        
+        Every label's nodes are created in parallel. Disease properties and
+        each relationship type are scheduled as soon as the labels they touch
+        exist. All stages are joined before returning.
+        
+        Returns:
+            List of (stage, exception) for stages that failed or were skipped
+        """
+        
+        # (stage name, labels it depends on, function, args)
+        dependent = [("properties:Disease", {"Disease"}, self.set_disease_properties, ())]
+        for attr, relation, source_type, target_type in self.RELATION_TYPES:
+            dependent.append((
+                f"relationships:{relation}",
+                {source_type, target_type},
+                self.create_relationships,
+                (getattr(self, attr), source_type, target_type)
+            ))
+        
+        failures = []
+        created = set()
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            pending = {}
+            for entities, entity_type in self.entity_types():
+                stage = f"nodes:{entity_type}"
+                future = pool.submit(self._timed, stage, self.create_nodes, entities, entity_type)
+                pending[future] = (stage, entity_type)
+            
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage, entity_type = pending.pop(future)
+                    try:
+                        future.result()
+                        if entity_type:
+                            created.add(entity_type)
+                    except Exception as e:
+                        print(f"Error in build stage {stage}: {e}")
+                        failures.append((stage, e))
+                
+                # Schedule every stage whose endpoint labels now exist
+                ready = [task for task in dependent if task[1] <= created]
+                for task in ready:
+                    dependent.remove(task)
+                    stage, _, func, args = task
+                    pending[pool.submit(self._timed, stage, func, *args)] = (stage, None)
+        
+        for stage, labels, _, _ in dependent:
+            failures.append((stage, RuntimeError(f"skipped, missing nodes for {sorted(labels - created)}")))
+        return failures
+
+
+    def report_timings(self):
+        """Print the wall-clock time of every build stage, slowest first."""
+        
+        print("Build stage timings:")
+        for stage, seconds in sorted(self.timings.items(), key=lambda item: -item[1]):
+            print(f"  {stage:<32} {seconds:8.2f}s")
 
     
     def export_json(self, data, path):
@@ -296,13 +719,13 @@ class MedicalKnowledgeGraphBuilder:
         Export data as JSON to a specified file path.
         
         Args:
-            data: List of items to export
+            data: Set of entity names or list of triples to export
             path: File path to save the JSON data
         """
         
         print(f"Exporting data to {path}")
-        if isinstance(data[0], str):
-            data = sorted([d.strip("...") for d in set(data)])
+        if isinstance(data, set):
+            data = sorted({d.strip("...") for d in data})
         
         # Create directory if it doesn't exist
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -311,10 +734,15 @@ class MedicalKnowledgeGraphBuilder:
             json.dump(data, f, indent=4, ensure_ascii=False)
 
 
-    def export(self, data_path):
+    def export(self, data_path, relations=True):
         """
         Export all entities and relationships to JSON files.
         Creates separate files for each entity type and relationship type.
+        
+        Args:
+            data_path: Summary directory
+            relations: Also export the relationships, False keeps the existing
+                relationship files, e.g. after a streaming build that kept no triples
         """
         
         # Create base directory
@@ -351,31 +779,550 @@ class MedicalKnowledgeGraphBuilder:
             (self.rels_category, os.path.join(data_path, 'rels_category.json'))
         ]
         
-        for data, path in relation_exports:
-            self.export_json(data, path)
+        if relations:
+            for data, path in relation_exports:
+                self.export_json(data, path)
+        else:
+            print("Relationships were not kept, keeping the existing relationship files")
+        
+        # Precompile the entity linker over the exported vocabularies
+        compile_linker(data_path)
         
         print("Export completed successfully!")
     
         
-    def build(self, path):
+    def export_csv(self, csv_path, array_delimiter=';'):
+        """
+        Export all entities and relationships as header-annotated CSV files
+        for `neo4j-admin database import`: one node file per label and one
+        relationship file per relation type.
+        
+        Node IDs are the entity names inside a per-label ID space
+        (e.g. `name:ID(Disease)`), so they are stable across exports and the
+        `name` property is set by the import itself. Disease nodes also carry
+        their properties from `disease_infos`.
+        
+        Args:
+            csv_path: Directory to write the CSV files to
+            array_delimiter: Delimiter for list properties such as `cure_department` and `cure_way`
+        
+        Returns:
+            The `neo4j-admin` command that imports the written files
+        """
+        
+        os.makedirs(csv_path, exist_ok=True)
+        print(f"Exporting bulk import CSV files to {csv_path}")
+        
+        infos = {}
+        for entity_dict in self.disease_infos:
+            name, properties = self._clean_properties(entity_dict)
+            infos[name] = properties
+        property_keys = self.disease_properties + ['cure_department']
+        # Declared as arrays when any disease has a list value, as the Cypher build stores them
+        list_keys = {k for properties in infos.values() for k, v in properties.items() if isinstance(v, list)}
+        
+        node_args = []
+        for entities, entity_type in self.entity_types():
+            names = sorted({node.replace("'", "") for node in entities})
+            header = [f"name:ID({entity_type})"]
+            if entity_type == "Disease":
+                header += [f"{k}:string[]" if k in list_keys else k for k in property_keys]
+            
+            file_path = os.path.join(csv_path, f"nodes_{entity_type}.csv")
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(header)
+                for name in names:
+                    row = [name]
+                    if entity_type == "Disease":
+                        properties = infos.get(name, {})
+                        for k in property_keys:
+                            value = properties.get(k, '')
+                            if isinstance(value, list):
+                                value = array_delimiter.join(v.replace(array_delimiter, ' ') for v in value)
+                            row.append(value)
+                    writer.writerow(row)
+            node_args.append(f"--nodes={entity_type}={file_path}")
+        
+        relationship_args = []
+        for attr, relation, source_type, target_type in self.RELATION_TYPES:
+            rows = sorted({(source.replace("'", ""), target.replace("'", ""))
+                           for source, _, target in getattr(self, attr)})
+            file_path = os.path.join(csv_path, f"rels_{relation}.csv")
+            with open(file_path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow([f":START_ID({source_type})", f":END_ID({target_type})"])
+                writer.writerows(rows)
+            relationship_args.append(f"--relationships={relation}={file_path}")
+        
+        command = " \\\n    ".join(
+            ["neo4j-admin database import full neo4j",
+             "--overwrite-destination",
+             f"--array-delimiter='{array_delimiter}'"]
+            + node_args + relationship_args
+        )
+        print("Export completed successfully!")
+        return command
+
+
+    def build_bulk(self, path, csv_path):
+        """
+        Prepare an offline cold build: extract all triples, export them as
+        bulk import CSV files and print the `neo4j-admin` command to load them.
+        
+        Args:
+            path: Path to the JSON data file
+            csv_path: Directory to write the CSV files to
+        """
+        
+        self.extract_triples(path)
+        command = self.export_csv(csv_path)
+        print("Stop the database, then run:")
+        print(command)
+        print("Afterwards start the database and run `python build_kg.py --schema-only` "
+              "to create the name constraints.")
+
+
+    def build_streaming(self, path):
+        """
+        Build the knowledge graph while streaming the JSON file.
+        
+        Relationship and property batches are written as soon as they fill up,
+        merging their endpoint nodes on the fly, so memory stays flat regardless
+        of input size. Entities that appear in no relationship are created at the end.
+        Triples are not kept, so export with `relations=False` afterwards.
+        
+        Args:
+            path: Path to the JSON data file
+        """
+        
+        relations = {attr: (source_type, target_type)
+                     for attr, _, source_type, target_type in self.RELATION_TYPES}
+        
+        for key, batch in self.iter_batches(path):
+            if key == 'disease_infos':
+                self.write_property_batch(batch, "Disease", merge_nodes=True)
+            else:
+                source_type, target_type = relations[key]
+                self.write_relationship_batch(batch, source_type, target_type, merge_nodes=True)
+        
+        self.build_nodes()
+
+
+    @classmethod
+    def format_card(cls, row):
+        """
+        Format the compact profile of one disease, one labelled line per field.
+        Empty fields are left out, lists and long texts are truncated.
+        """
+        
+        def text(value):
+            if isinstance(value, list):
+                value = "、".join(str(v) for v in value)
+            value = " ".join(str(value or "").split())
+            return value if len(value) <= cls.CARD_TEXT_LIMIT else value[:cls.CARD_TEXT_LIMIT] + "…"
+        
+        fields = [
+            ("疾病", row["name"]),
+            ("简介", text(row["desc"])),
+            ("症状", "、".join(row["symptoms"][:cls.CARD_LIST_LIMIT])),
+            ("药物", "、".join(row["drugs"][:cls.CARD_LIST_LIMIT])),
+            ("推荐食谱", "、".join(row["recipes"][:cls.CARD_LIST_LIMIT])),
+            ("病因", text(row["cause"])),
+            ("治疗方式", text(row["cure_way"])),
+            ("科室", "、".join(row["departments"])),
+        ]
+        return "\n".join(f"{label}: {value}" for label, value in fields if value)
+
+
+    def materialize_cards(self, cards_path, names=None):
+        """
+        Precompute a compact "disease card" per Disease from its properties and
+        edges, and store it as the `card` property and in a JSON artifact, so
+        retrieval reads one property instead of traversing the neighbourhood.
+        
+        Args:
+            cards_path: Path of the {disease name: card} JSON artifact
+            names: Only refresh these diseases (e.g. the changed records of an
+                incremental build), None refreshes all of them
+        """
+        
+        cards = {}
+        if names is not None and os.path.exists(cards_path):
+            with open(cards_path, 'r', encoding='utf-8') as f:
+                cards = json.load(f)
+        
+        cypher = f"""
+        MATCH (d:Disease)
+        {'WHERE d.name IN $names' if names is not None else ''}
+        RETURN d.name AS name, d.desc AS desc, d.cause AS cause, d.cure_way AS cure_way,
+               [(d)-[:has_symptom]->(s) | s.name] AS symptoms,
+               [(d)-[:recommend_drug|has_common_drug]->(x) | x.name] AS drugs,
+               [(d)-[:recommend_recipes]->(r) | r.name] AS recipes,
+               [(d)-[:cure_department]->(p) | p.name] AS departments
+        ORDER BY d.name SKIP $skip LIMIT $limit
+        """
+        params = {"names": sorted(names)} if names is not None else {}
+        for name in names or ():
+            cards.pop(name, None)    # Removed diseases disappear, existing ones are rewritten
+        
+        skip = 0
+        while True:
+            page = self.graph.query(cypher, dict(params, skip=skip, limit=self.batch_size), cache=False)
+            rows = []
+            for row in page:
+                row["drugs"] = list(dict.fromkeys(row["drugs"]))
+                card = self.format_card(row)
+                cards[row["name"]] = card
+                rows.append({"name": row["name"], "card": card})
+            self.graph.query("""
+            UNWIND $rows AS row
+            MATCH (d:Disease {name: row.name})
+            SET d.card = row.card
+            """, {"rows": rows})
+            skip += len(page)
+            if len(page) < self.batch_size:
+                break
+        
+        os.makedirs(os.path.dirname(cards_path) or '.', exist_ok=True)
+        tmp_path = cards_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cards, f, ensure_ascii=False, indent=1, sort_keys=True)
+        os.replace(tmp_path, cards_path)
+        print(f"Materialized {skip} disease cards to {cards_path}")
+
+
+    def record_hash(self, data_json):
+        """Return a stable content hash of one disease record."""
+        
+        content = json.dumps(data_json, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+    def load_manifest(self, manifest_path):
+        """
+        Load the {disease name: record hash} manifest of the last (incremental) build.
+        
+        Args:
+            manifest_path: Path to the manifest JSON file
+        """
+        
+        if not os.path.exists(manifest_path):
+            return {}
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)["records"]
+
+
+    def save_manifest(self, records, manifest_path):
+        """
+        Atomically write the manifest, so an interrupted run never leaves a truncated file.
+        
+        Args:
+            records: Mapping of disease name to record hash
+            manifest_path: Path to the manifest JSON file
+        """
+        
+        os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+        tmp_path = manifest_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"updated": time.strftime("%Y-%m-%dT%H:%M:%S"), "records": records},
+                      f, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, manifest_path)
+
+
+    def seed_manifest(self, path, manifest_path):
+        """
+        Write the manifest of a full build, so the next incremental run only applies what changed after it.
+        
+        Args:
+            path: Path to the JSON data file
+            manifest_path: Path to the manifest JSON file
+        """
+        
+        records = {data_json['name']: self.record_hash(data_json) for data_json in self.iter_records(path)}
+        self.save_manifest(records, manifest_path)
+        print(f"Manifest of {len(records)} disease records written to {manifest_path}")
+
+
+    def embedding_properties(self):
+        """Return the Disease properties holding description embeddings, see vector_storage."""
+        
+        return sorted({target.property for target in load_targets().values()} | {LEGACY_TARGET.property})
+
+
+    def clear_stale_embeddings(self, disease_infos):
+        """
+        Remove the description embeddings of diseases whose description changes,
+        so build_vec.py embeds them again. Call it before setting the new properties.
+        
+        Args:
+            disease_infos: Disease dicts about to be written
+        """
+        
+        rows = []
+        for entity_dict in disease_infos:
+            name, properties = self._clean_properties(entity_dict)
+            rows.append({"name": name, "desc": properties.get('desc')})
+        if not rows:
+            return
+        properties = ", ".join(f"d.{p}" for p in self.embedding_properties())
+        self.graph.query(f"""
+        UNWIND $rows AS row
+        MATCH (d:Disease {{name: row.name}})
+        WHERE d.desc IS NULL OR row.desc IS NULL OR d.desc <> row.desc
+        REMOVE {properties}
+        """, {"rows": rows})
+
+
+    def _reset_entities(self):
+        """Empty the entity sets, so they only hold the entities of the next chunk."""
+        
+        for entities, _ in self.entity_types():
+            entities.clear()
+
+
+    def delete_stale_relationships(self, targets_by_disease):
+        """
+        Delete outgoing relationships of diseases whose targets are no longer in the data.
+        
+        Args:
+            targets_by_disease: Mapping of disease name to {relation type: set of current target names}.
+                Relation types missing from the mapping lose all their edges.
+        """
+        
+        for _, relation, source_type, target_type in self.RELATION_TYPES:
+            if source_type != "Disease":
+                continue
+            rows = [{"name": name.replace("'", ""),
+                     "targets": [t.replace("'", "") for t in targets.get(relation, ())]}
+                    for name, targets in targets_by_disease.items()]
+            if not rows:
+                continue
+            cypher = f"""
+            UNWIND $rows AS row
+            MATCH (s:Disease {{name: row.name}})-[r:{relation}]->(t:{target_type})
+            WHERE NOT t.name IN row.targets
+            DELETE r
+            """
+            try:
+                self.graph.query(cypher, {"rows": rows})
+            except Exception as e:
+                print(f"Error deleting stale {relation} relationships: {e}")
+                raise
+
+
+    def apply_records(self, records):
+        """
+        Upsert a chunk of new or changed disease records: their nodes,
+        properties and outgoing relationships. Outgoing edges that are
+        no longer in a record are deleted, as are the embeddings of changed
+        descriptions. Department hierarchy and producer edges are shared
+        between diseases, so they are only merged.
+        
+        Args:
+            records: List of disease records from the JSON data file
+        """
+        
+        self._reset_entities()
+        disease_infos = []
+        triples = {attr: [] for attr, _, _, _ in self.RELATION_TYPES}
+        targets_by_disease = {}
+        for data_json in records:
+            disease_dict, record_triples = self.parse_record(data_json)
+            disease_infos.append(disease_dict)
+            targets = targets_by_disease.setdefault(disease_dict['name'], {})
+            for attr, items in record_triples.items():
+                triples[attr].extend(items)
+                for source, relation, target in items:
+                    if source == disease_dict['name']:
+                        targets.setdefault(relation, set()).add(target)
+        
+        for entities, entity_type in self.entity_types():
+            names = sorted({node.replace("'", "") for node in entities})
+            for i in range(0, len(names), self.batch_size):
+                self.write_node_batch(names[i:i + self.batch_size], entity_type)
+        self.clear_stale_embeddings(disease_infos)
+        self.write_property_batch(disease_infos, "Disease")
+        self.delete_stale_relationships(targets_by_disease)
+        for attr, _, source_type, target_type in self.RELATION_TYPES:
+            for i in range(0, len(triples[attr]), self.batch_size):
+                self.write_relationship_batch(triples[attr][i:i + self.batch_size], source_type, target_type)
+
+
+    def remove_diseases(self, names):
+        """
+        Remove diseases whose records disappeared from the data: their outgoing
+        edges and properties are deleted, and the node itself is deleted unless
+        another disease still references it (e.g. as an accompanying disease).
+        
+        Args:
+            names: Names of the removed diseases
+        """
+        
+        if not names:
+            return
+        self.delete_stale_relationships({name: {} for name in names})
+        properties = ", ".join(f"d.{k}" for k in self.disease_properties + ['cure_department', 'card']
+                               + self.embedding_properties())
+        cypher = f"""
+        UNWIND $names AS name
+        MATCH (d:Disease {{name: name}})
+        REMOVE {properties}
+        WITH d WHERE NOT EXISTS {{ (d)<--() }}
+        DETACH DELETE d
+        """
+        self.graph.query(cypher, {"names": [name.replace("'", "") for name in names]})
+
+
+    def build_incremental(self, path, manifest_path):
+        """
+        Apply only the disease records that changed since the last run.
+        
+        Every record is hashed and compared against the manifest. New or
+        changed records are applied in chunks of `self.batch_size`, and the
+        manifest is saved after each chunk as a checkpoint: an interrupted
+        run resumes by skipping everything already applied. Diseases missing
+        from the data are removed at the end. Without a manifest this is a
+        full build done in chunks.
+        
+        Args:
+            path: Path to the JSON data file
+            manifest_path: Path to the manifest JSON file
+        
+        Returns:
+            Names of the new, changed and removed diseases
+        """
+        
+        manifest = self.load_manifest(manifest_path)
+        seen = set()
+        chunk, chunk_hashes = [], {}
+        changed = 0
+        changed_names = []
+        
+        def flush():
+            self.apply_records(chunk)
+            manifest.update(chunk_hashes)
+            self.save_manifest(manifest, manifest_path)
+            chunk.clear()
+            chunk_hashes.clear()
+        
+        for data_json in tqdm(self.iter_records(path), desc="Checking records for changes"):
+            name = data_json['name']
+            seen.add(name)
+            digest = self.record_hash(data_json)
+            if manifest.get(name) == digest:
+                continue
+            chunk.append(data_json)
+            chunk_hashes[name] = digest
+            changed_names.append(name)
+            changed += 1
+            if len(chunk) >= self.batch_size:
+                flush()
+        if chunk:
+            flush()
+        
+        removed = sorted(set(manifest) - seen)
+        self.remove_diseases(removed)
+        for name in removed:
+            del manifest[name]
+        self.save_manifest(manifest, manifest_path)
+        
+        print(f"Incremental build: {changed} new or changed, {len(removed)} removed, "
+              f"{len(seen) - changed} unchanged disease records")
+        return changed_names + removed
+
+
+    def build(self, path, streaming=False, manifest_path=None, cards_path=None, incremental=False):
         """
         Build the entire knowledge graph by extracting triples,
         creating nodes, relationships, and setting attributes.
+        
+        Args:
+            path: Path to the JSON data file
+            streaming: Stream the file in bounded memory instead of loading all triples first
+            manifest_path: If given, the manifest of record hashes, written after a successful full build
+            cards_path: If given, materialize the disease cards and write them to this artifact
+            incremental: Only apply records changed since the manifest was written
         """
         
         print("Building medical knowledge graph")
+        self.timings = {}
+        start = time.perf_counter()
         
-        # Extract triples from JSON data
-        self.extract_triples(path)
-        self.build_nodes()
-        self.set_disease_properties()
-        self.build_relationships()
+        # Make sure name lookups are index-backed before ingest
+        self._timed("schema", self.create_schema)
+        self.verify_index_usage()
         
-        print("Knowledge graph built successfully!")
+        failures = []
+        touched = None
+        if incremental:
+            touched = self._timed("incremental", self.build_incremental, path, manifest_path)
+        elif streaming:
+            self._timed("streaming", self.build_streaming, path)
+        else:
+            # Extract triples from JSON data
+            self._timed("extract", self.extract_triples, path)
+            failures = self.run_stages()
+        
+        # Cards depend on every edge of a disease, so they are built last
+        if cards_path:
+            self._timed("cards", self.materialize_cards, cards_path, touched)
+        
+        self.timings["total"] = time.perf_counter() - start
+        self.report_timings()
+        
+        if failures:
+            print(f"Knowledge graph build finished with {len(failures)} failed stages:")
+            for stage, e in failures:
+                print(f"  {stage}: {e}")
+        else:
+            print("Knowledge graph built successfully!")
+            if manifest_path and not incremental:
+                # The next incremental run starts from this build instead of applying everything again
+                self.seed_manifest(path, manifest_path)
+        
+        # Serving processes load this instead of introspecting the database
+        write_schema_snapshot(self.graph)
+        # Drop the query caches of serving processes, after the snapshot so they never see the old schema
+        bump_graph_version(self.graph)
         
 
 if __name__ == '__main__':
-    data_path = "./data/medical.json"
-    kg_builder = MedicalKnowledgeGraphBuilder()
-    kg_builder.build(data_path)
-    kg_builder.export("./data/summary")
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the medical knowledge graph.")
+    parser.add_argument("--data", default="./data/medical.json", help="Path to the JSON data file")
+    parser.add_argument("--summary", default="./data/summary", help="Directory for exported entities and relations")
+    parser.add_argument("--batch-size", type=int, default=1000, help="Rows per UNWIND transaction")
+    parser.add_argument("--streaming", action="store_true", help="Stream the data file in bounded memory")
+    parser.add_argument("--workers", type=int, default=4, help="Number of build stages run concurrently")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Only apply records changed since the last run (tracked in <summary>/manifest.json)")
+    parser.add_argument("--bulk-import", metavar="CSV_DIR",
+                        help="Write neo4j-admin import CSV files instead of building through Cypher")
+    parser.add_argument("--schema-only", action="store_true", help="Only create the name constraints")
+    parser.add_argument("--cards-only", action="store_true",
+                        help="Only materialize the disease cards, e.g. after a bulk import")
+    args = parser.parse_args()
+
+    cards_path = os.path.join(args.summary, "disease_cards.json")
+    kg_builder = MedicalKnowledgeGraphBuilder(batch_size=args.batch_size, workers=args.workers)
+    if args.schema_only:
+        kg_builder.create_schema()
+        kg_builder.verify_index_usage()
+    elif args.cards_only:
+        kg_builder.materialize_cards(cards_path)
+        bump_graph_version(kg_builder.graph)
+    elif args.bulk_import:
+        kg_builder.build_bulk(args.data, args.bulk_import)
+        kg_builder.export(args.summary)
+    elif args.incremental:
+        kg_builder.build(args.data, manifest_path=os.path.join(args.summary, "manifest.json"), cards_path=cards_path,
+                         incremental=True)
+        # Only changed records were extracted, read the whole file again for a complete summary
+        kg_builder._reset_entities()
+        kg_builder.extract_triples(args.data)
+        kg_builder.export(args.summary)
+    else:
+        kg_builder.build(args.data, streaming=args.streaming, manifest_path=os.path.join(args.summary, "manifest.json"),
+                         cards_path=cards_path)
+        # A streaming build keeps no triples, exporting them would empty the relationship files
+        kg_builder.export(args.summary, relations=not args.streaming)
\ No newline at end of file
@@ -1,40 +1,278 @@
-from llm import embeddings
-from graph import graph
-from tqdm import tqdm 
+import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
-def main():
-    results = graph.query("""
+from ann_index import AnnIndex
+from llm import create_embeddings, get_embeddings
+from graph import bump_graph_version, get_graph, write_schema_snapshot
+from resources import override
+from tqdm import tqdm
+from vector_storage import (LEGACY_TARGET, STORAGE_FORMATS, VectorTarget, create_vector_index, drop_target,
+                            get_target, load_targets, save_targets, storage_report, truncate)
+
+
+def fetch_descriptions(force=False, property="descEmbedding"):
+    """
+    Fetch the diseases whose description still needs an embedding.
+
+    Args:
+        force: Also return diseases that already have an embedding
+        property: Embedding property to check
+    """
+
+    return get_graph().query(f"""
                         MATCH (d:Disease)
                         WHERE d.desc IS NOT NULL AND d.desc <> ''
+                        {'' if force else f'AND d.{property} IS NULL'}
                         RETURN d.name AS name, d.desc AS desc
-                        """)
-
-    for record in tqdm(results, desc="Vectorizing Disease Descriptions"):
-        name = record["name"]
-        desc = record["desc"]
-        if desc:
-            try:
-                vector = embeddings.embed_query(desc)
-                graph.query(
-                    "MATCH (d:Disease {name: $name}) SET d.descEmbedding = $embedding",
-                    params={"name": name, "embedding": vector}
-                )
-            except Exception as e:
-                print(f"Error occur when creating embbeding: {e}")
+                        """, cache=False)
+
+
+def with_retry(func, *args, retries=3, backoff=1.0):
+    """
+    Call `func(*args)`, retrying with exponential backoff on failure.
+
+    Args:
+        func: Function to call
+        retries: Number of retries after the first attempt
+        backoff: Delay in seconds before the first retry, doubled after each one
+    """
+
+    for attempt in range(retries + 1):
+        try:
+            return func(*args)
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+
+def embed_batch(records, retries=3):
+    """Embed the descriptions of one batch of records in a single request."""
+
+    return with_retry(get_embeddings().embed_documents, [r["desc"] for r in records], retries=retries)
+
+
+def write_batch(records, vectors, targets, retries=3):
+    """
+    Write one batch of embeddings back to their Disease nodes, one transaction per target.
+
+    Every target gets the embeddings shortened to its dimensions, stored as
+    float32 arrays instead of lists of 64-bit floats.
+    """
+
+    for target in targets:
+        rows = [{"name": r["name"], "embedding": v}
+                for r, v in zip(records, truncate(vectors, target.dimensions).tolist())]
+        with_retry(get_graph().query, """
+            UNWIND $rows AS row
+            MATCH (d:Disease {name: row.name})
+            CALL db.create.setNodeVectorProperty(d, $property, row.embedding)
+            """, {"rows": rows, "property": target.property}, retries=retries)
+
+
+def detect_dimensions():
+    """Return the number of dimensions of the embedding model."""
+
+    return len(get_embeddings().embed_query("维度"))
+
+
+def print_storage(title, reports):
+    print(title)
+    for target, report in reports:
+        print(f"  {target.index} ({target.property}, {target.storage}): {report['nodes']} nodes, "
+              f"{report['dimensions']} dimensions, {report['property_bytes']} B property "
+              f"+ {report['index_bytes']} B index per node")
+
+
+def fetch_embeddings(property="descEmbedding", page_size=1000):
+    """
+    Fetch all disease embeddings from Neo4j.
+
+    Args:
+        property: Embedding property to fetch
+        page_size: Embeddings fetched per query
+
+    Returns:
+        (names, node IDs, embeddings), ordered by name
+    """
+
+    names, node_ids, vectors = [], [], []
+    while True:
+        page = get_graph().query(f"""
+            MATCH (d:Disease)
+            WHERE d.{property} IS NOT NULL
+            RETURN d.name AS name, elementId(d) AS id, d.{property} AS embedding
+            ORDER BY d.name
+            SKIP $skip LIMIT $limit
+            """, {"skip": len(names), "limit": page_size}, cache=False)
+        for row in page:
+            names.append(row["name"])
+            node_ids.append(row["id"])
+            vectors.append(row["embedding"])
+        if len(page) < page_size:
+            break
+    return names, node_ids, vectors
+
+
+def write_ann_index(path, property="descEmbedding", page_size=1000):
+    """
+    Export all disease embeddings from Neo4j into a local ANN index and
+    report its recall against exact search over the float embeddings.
+
+    Args:
+        path: Index directory, see ann_index.AnnIndex
+        property: Embedding property to export
+        page_size: Embeddings fetched per query
+    """
+
+    names, node_ids, vectors = fetch_embeddings(property, page_size)
+    if not vectors:
+        print("No embeddings found, ANN index not written.")
+        return
+    AnnIndex.build(path, names, node_ids, vectors)
+    recall, ivf_ms, exact_ms = AnnIndex(path).recall(names, vectors)
+    print(f"ANN recall@10: {recall:.3f}, IVF {ivf_ms:.2f} ms, exact {exact_ms:.2f} ms per query")
+
+
+def drop(index):
+    """Drop a vector index and its embedding property, the last step of a migration."""
+
+    targets = load_targets()
+    drop_target(get_graph(), targets.pop(index, None) or get_target(index))
+    save_targets(targets)
+    print(f"Dropped vector index {index}")
+    write_schema_snapshot(get_graph())
+    bump_graph_version(get_graph())
+
+
+def main(batch_size=64, concurrency=4, retries=3, force=False, ann_path="./data/ann",
+         index="diseaseDescriptions", property="descEmbedding", dimensions=None, storage="float32",
+         dual_write=()):
+    """
+    Embed all disease descriptions and create the vector index.
+
+    The index dimensions come from the embedding model, optionally shortened
+    to `dimensions`. Embeddings are stored as float32 arrays, and with
+    storage="int8" the index quantizes them. The layout of every index is
+    recorded in vector_storage.json for the retrievers.
+
+    To migrate to another layout without downtime, build a new index on a
+    new property while the old one keeps serving, passing the old index in
+    `dual_write` so that new diseases are embedded into both. Then point
+    VECTOR_INDEX_NAME at the new index and drop the old one with --drop.
+
+    Descriptions are embedded `batch_size` at a time with at most
+    `concurrency` embedding requests in flight, and every batch is written
+    back with one UNWIND query. Only diseases without an embedding are
+    processed, so rerunning after a failure resumes where it stopped.
+
+    Args:
+        batch_size: Number of descriptions per embedding request and write
+        concurrency: Maximum number of embedding requests in flight
+        retries: Retries per batch for embedding and writing
+        force: Re-embed descriptions that already have an embedding
+        ann_path: Directory of the local ANN index to write, None to skip it
+        index: Name of the vector index to build
+        property: Disease property holding its embeddings
+        dimensions: Dimensions of the index, defaults to those of the model
+        storage: "float32" or "int8"
+        dual_write: Names of existing indexes that also receive the new embeddings
+    """
+
+    native = detect_dimensions()
+    if dimensions and dimensions > native:
+        raise ValueError(f"The embedding model has {native} dimensions, cannot store {dimensions}")
+    target = VectorTarget(index, property, dimensions or native, storage)
+
+    targets = load_targets()
+    known = targets.get(index)
+    if known and known != target:
+        raise ValueError(f"Index {index} already stores {known}, build a new index to change its layout")
+    mirrors = [targets.get(name) or get_target(name)._replace(dimensions=native) for name in dual_write]
+    # Before this run, nodes may still hold embeddings in the legacy float64 layout
+    previous = known or LEGACY_TARGET._replace(index=index, property=property)
+    before = [(t, storage_report(get_graph(), t)) for t in [previous] + mirrors]
+
+    results = fetch_descriptions(force, property)
+    batches = [results[i:i + batch_size] for i in range(0, len(results), batch_size)]
+
+    done, failed = 0, 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool, \
+            tqdm(total=len(results), desc="Vectorizing Disease Descriptions") as pbar:
+        in_flight = {}
+        pending = iter(batches)
+        while True:
+            # Keep at most `concurrency` embedding requests in flight
+            for batch in pending:
+                in_flight[pool.submit(embed_batch, batch, retries)] = batch
+                if len(in_flight) >= concurrency:
+                    break
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                batch = in_flight.pop(future)
+                try:
+                    write_batch(batch, future.result(), [target] + mirrors, retries)
+                    done += len(batch)
+                except Exception as e:
+                    failed += len(batch)
+                    print(f"Error occur when creating embbeding for batch starting at {batch[0]['name']}: {e}")
+                pbar.update(len(batch))
+
+    elapsed = time.perf_counter() - start
+    rate = done / elapsed if elapsed > 0 else float("inf")
+    print(f"Embedded {done} descriptions in {elapsed:.2f}s ({rate:.1f} desc/s), {failed} failed")
+    if failed:
+        print("Rerun build_vec.py to retry the failed descriptions.")
+    get_embeddings().flush()
+    print(f"Embedding cache: {get_embeddings().stats()}")
 
     try:
-        graph.query("""
-        CREATE VECTOR INDEX diseaseDescriptions IF NOT EXISTS
-        FOR (d:Disease)
-        ON (d.descEmbedding)
-        OPTIONS {indexConfig: {
-        `vector.dimensions`: 1536,
-        `vector.similarity_function`: 'cosine'
-        }};
-        """)
-        print("Vector index created successfully.")
+        create_vector_index(get_graph(), target)
+        print(f"Vector index {index} created successfully ({target.dimensions} dimensions, {storage}).")
     except Exception as e:
         print(f"Error occur when creating vector index: {e}")
-        
+
+    targets[index] = target
+    for mirror in mirrors:
+        targets[mirror.index] = mirror
+    save_targets(targets)
+    print_storage("Storage before:", before)
+    print_storage("Storage after:", [(t, storage_report(get_graph(), t)) for t in [target] + mirrors])
+
+    if ann_path:
+        write_ann_index(ann_path, property)
+
+    write_schema_snapshot(get_graph())
+    bump_graph_version(get_graph())
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Embed disease descriptions and create the vector index.")
+    parser.add_argument("--batch-size", type=int, default=64, help="Descriptions per embedding request")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum embedding requests in flight")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per batch")
+    parser.add_argument("--force", action="store_true", help="Re-embed descriptions that already have an embedding")
+    parser.add_argument("--ann-path", default="./data/ann", help="Directory of the local ANN index")
+    parser.add_argument("--no-ann", action="store_true", help="Do not write the local ANN index")
+    parser.add_argument("--index", default="diseaseDescriptions", help="Name of the vector index")
+    parser.add_argument("--property", default="descEmbedding", help="Disease property holding the embeddings")
+    parser.add_argument("--dimensions", type=int, help="Shorten embeddings to this many dimensions")
+    parser.add_argument("--storage", choices=[f for f in STORAGE_FORMATS if f != "float64"], default="float32",
+                        help="Vector storage, int8 quantizes the index")
+    parser.add_argument("--dual-write", nargs="*", default=[], metavar="INDEX",
+                        help="Existing indexes that also receive the new embeddings during a migration")
+    parser.add_argument("--drop", metavar="INDEX", help="Drop a vector index and its property, then exit")
+    args = parser.parse_args()
+
+    if args.drop:
+        drop(args.drop)
+    else:
+        # The builder writes the embedding cache, serving processes only read it
+        override("embeddings", create_embeddings(writable=True))
+        main(batch_size=args.batch_size, concurrency=args.concurrency, retries=args.retries, force=args.force,
+             ann_path=None if args.no_ann else args.ann_path, index=args.index, property=args.property,
+             dimensions=args.dimensions, storage=args.storage, dual_write=args.dual_write)
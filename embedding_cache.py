@@ -0,0 +1,288 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Bytes of the checksum stored with every slot
+CHECK_BYTES = 16
+
+
+def try_lock(f):
+    """Take an exclusive, non-blocking lock on an open file. Returns False if another process holds it."""
+
+    try:
+        import fcntl
+    except ImportError:
+        import msvcrt
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            return False
+    try:
+        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        return True
+    except OSError:
+        return False
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    A disk-backed, content-addressed cache in front of an embedding model.
+
+    Vectors are stored in a fixed-size memory-mapped array (one slot per
+    entry), and an index maps `sha256(model + normalized text)` to a slot.
+    When the cache is full the least recently used entry is evicted.
+    It is a drop-in `Embeddings`, so it can be passed wherever the wrapped
+    model is used (Neo4jVector, build_vec.py, ...).
+
+    Every slot also stores a checksum of its key and vector, verified on
+    read, so a slot overwritten after the index was last saved (e.g. before
+    a crash) is a miss instead of a wrong vector. Only one process writes a
+    cache directory, guarded by a lock file: the builder (build_vec.py) opens
+    it `writable`, serving processes read-only, embedding what they cannot
+    find without storing it and picking up what the builder saves.
+    """
+    def __init__(self, embeddings, path="./data/embedding_cache", max_entries=100_000,
+                 dtype="float32", flush_every=256, writable=False):
+        """
+        Args:
+            embeddings: The embedding model to wrap
+            path: Directory of the cache, one subdirectory per model
+            max_entries: Maximum number of cached vectors
+            dtype: Storage type of the vectors, 'float32' or 'float16'
+            flush_every: Write the index to disk after this many new entries
+            writable: Whether to write the cache; opened read-only anyway while
+                another process writes it
+        """
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.path = os.path.join(path, re.sub(r"[^\w.-]", "_", self.model))
+        self.max_entries = max_entries
+        self.dtype = np.dtype(dtype)
+        self.flush_every = flush_every
+
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.RLock()
+        self._index = OrderedDict()   # key -> slot, least recently used first
+        self._free = []               # Unused slots
+        self._vectors = None          # np.memmap of shape (max_entries, dim)
+        self._checks = None           # np.memmap of shape (max_entries, CHECK_BYTES)
+        self._dim = None
+        self._dirty = 0
+        self._index_mtime = None
+
+        os.makedirs(self.path, exist_ok=True)
+        self._lock_file = open(os.path.join(self.path, "writer.lock"), 'a+')
+        self.writable = writable and try_lock(self._lock_file)
+        if writable and not self.writable:
+            print(f"Embedding cache at {self.path} is written by another process, opening it read-only")
+        self._load()
+        atexit.register(self.flush)
+
+
+    @property
+    def _index_path(self):
+        return os.path.join(self.path, "index.json")
+
+
+    @property
+    def _vectors_path(self):
+        return os.path.join(self.path, f"vectors.{self.dtype.name}.bin")
+
+
+    @property
+    def _checks_path(self):
+        return os.path.join(self.path, f"checks.{self.dtype.name}.bin")
+
+
+    def _load(self):
+        """Open an existing cache, or start an empty one if it is missing or incompatible."""
+
+        paths = [self._index_path, self._vectors_path, self._checks_path]
+        if not all(os.path.exists(path) for path in paths):
+            return
+        with open(self._index_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta["dtype"] != self.dtype.name or meta["max_entries"] != self.max_entries:
+            print(f"Embedding cache at {self.path} has a different layout, starting empty")
+            return
+
+        self._index_mtime = os.path.getmtime(self._index_path)
+        self._dim = meta["dim"]
+        mode = "r+" if self.writable else "r"
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode=mode,
+                                  shape=(self.max_entries, self._dim))
+        self._checks = np.memmap(self._checks_path, dtype=np.uint8, mode=mode,
+                                 shape=(self.max_entries, CHECK_BYTES))
+        self._index = OrderedDict(meta["entries"])
+        used = set(self._index.values())
+        self._free = [slot for slot in range(self.max_entries - 1, -1, -1) if slot not in used]
+
+
+    def _open(self, dim):
+        """Create the vector file once the embedding dimension is known."""
+
+        self._dim = dim
+        self._vectors = np.memmap(self._vectors_path, dtype=self.dtype, mode="w+",
+                                  shape=(self.max_entries, dim))
+        self._checks = np.memmap(self._checks_path, dtype=np.uint8, mode="w+",
+                                 shape=(self.max_entries, CHECK_BYTES))
+        self._free = list(range(self.max_entries - 1, -1, -1))
+
+
+    def flush(self):
+        """Write the index (in LRU order) to disk and flush the vector file."""
+
+        with self._lock:
+            if self._vectors is None or not self._dirty or not self.writable:
+                return
+            self._vectors.flush()
+            self._checks.flush()
+            meta = {
+                "model": self.model,
+                "dim": self._dim,
+                "dtype": self.dtype.name,
+                "max_entries": self.max_entries,
+                "entries": list(self._index.items()),
+            }
+            tmp_path = self._index_path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(meta, f)
+            os.replace(tmp_path, self._index_path)
+            self._dirty = 0
+
+
+    def key(self, text):
+        """Return the cache key of a text: the model name plus a hash of the normalized text."""
+
+        normalized = re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+        return hashlib.sha256(f"{self.model}\0{normalized}".encode("utf-8")).hexdigest()
+
+
+    def _index_changed(self):
+        try:
+            return os.path.getmtime(self._index_path) != self._index_mtime
+        except OSError:
+            return False
+
+
+    def _check(self, key, vector):
+        """Checksum of a slot: binds the stored vector to its key."""
+
+        return np.frombuffer(hashlib.blake2b(bytes.fromhex(key) + vector.tobytes(),
+                                             digest_size=CHECK_BYTES).digest(), dtype=np.uint8)
+
+
+    def _get(self, key):
+        """Return the cached vector for a key, or None."""
+
+        slot = self._index.get(key)
+        if slot is None and not self.writable and self._index_changed():
+            # Pick up the entries the writing process saved since
+            self._load()
+            slot = self._index.get(key)
+        if slot is None:
+            return None
+        vector = np.array(self._vectors[slot])
+        if not np.array_equal(self._checks[slot], self._check(key, vector)):
+            # The slot was reused for another key after the index was saved, or written partially
+            del self._index[key]
+            if self.writable:
+                self._free.append(slot)
+            return None
+        self._index.move_to_end(key)
+        return vector.astype(np.float32).tolist()
+
+
+    def _put(self, key, vector):
+        """Store a vector, evicting the least recently used entry if the cache is full."""
+
+        if not self.writable:
+            return
+        if self._vectors is None:
+            self._open(len(vector))
+        if len(vector) != self._dim:
+            return
+        if key in self._index:
+            slot = self._index[key]
+            self._index.move_to_end(key)
+        elif self._free:
+            slot = self._free.pop()
+            self._index[key] = slot
+        else:
+            _, slot = self._index.popitem(last=False)
+            self._index[key] = slot
+        self._vectors[slot] = vector
+        self._checks[slot] = self._check(key, np.asarray(self._vectors[slot]))
+
+        self._dirty += 1
+        if self._dirty >= self.flush_every:
+            self.flush()
+
+
+    def embed_documents(self, texts):
+        """Embed texts, calling the wrapped model only for texts not in the cache."""
+
+        keys = [self.key(text) for text in texts]
+        results = [None] * len(texts)
+        missing = {}   # key -> text, deduplicated
+        with self._lock:
+            for i, key in enumerate(keys):
+                results[i] = self._get(key)
+                if results[i] is None:
+                    missing.setdefault(key, texts[i])
+            self.hits += len(texts) - len(missing)
+            self.misses += len(missing)
+
+        if missing:
+            # Call the model outside the lock, so concurrent callers are not serialized
+            vectors = dict(zip(missing, self.embeddings.embed_documents(list(missing.values()))))
+            with self._lock:
+                for key, vector in vectors.items():
+                    self._put(key, vector)
+            for i, key in enumerate(keys):
+                if results[i] is None:
+                    results[i] = vectors[key]
+        return results
+
+
+    def embed_query(self, text):
+        """Embed a query text, using the cache when possible."""
+
+        key = self.key(text)
+        with self._lock:
+            vector = self._get(key)
+            if vector is not None:
+                self.hits += 1
+                return vector
+            self.misses += 1
+
+        vector = self.embeddings.embed_query(text)
+        with self._lock:
+            self._put(key, vector)
+        return vector
+
+
+    def stats(self):
+        """Return hit/miss counters and the size of the cache."""
+
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "entries": len(self._index),
+                "max_entries": self.max_entries,
+                "writable": self.writable,
+                "bytes": len(self._index) * (self._dim or 0) * self.dtype.itemsize,
+            }
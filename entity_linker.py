@@ -0,0 +1,230 @@
+import json
+import os
+import pickle
+import threading
+from array import array
+from collections import deque, namedtuple
+
+# Vocabulary files written by MedicalKnowledgeGraphBuilder.export, per label
+VOCABULARY_FILES = {
+    "Disease": "diseases.json",
+    "Symptom": "symptoms.json",
+    "Drug": "drugs.json",
+    "Food": "foods.json",
+    "Recipe": "recipes.json",
+    "Check": "checks.json",
+    "Department": "departments.json",
+    "Producer": "producers.json",
+}
+
+ARTIFACT_NAME = "entity_linker.pkl"
+ARTIFACT_VERSION = 1
+
+# A linked entity: text[start:end] is a name known under each of `labels`
+EntitySpan = namedtuple("EntitySpan", ["start", "end", "text", "labels"])
+
+
+class EntityLinker:
+    """
+    Finds knowledge graph entity names in free text with an Aho-Corasick automaton.
+
+    Scanning is linear in the length of the text, and overlapping matches are
+    resolved leftmost-longest, so "急性支气管炎" wins over "支气管炎". The automaton
+    is stored flat (an int-keyed transition dict, a failure array and an
+    output dict) so a compiled artifact unpickles in milliseconds.
+    """
+    def __init__(self, labels, transitions, fail, outputs):
+        """
+        Args:
+            labels: Label names, bit i of an output mask refers to labels[i]
+            transitions: Mapping of (state << 21 | code point) to the next state
+            fail: Failure link of every state
+            outputs: Mapping of state to ((match length, label mask), ...)
+        """
+        self.labels = labels
+        self.transitions = transitions
+        self.fail = fail
+        self.outputs = outputs
+
+
+    @classmethod
+    def build(cls, vocabularies, min_length=2):
+        """
+        Build the automaton from entity vocabularies.
+
+        Args:
+            vocabularies: Mapping of label to an iterable of entity names
+            min_length: Names shorter than this are ignored, single characters match everywhere
+        """
+
+        labels = list(vocabularies)
+        words = {}   # name -> label mask
+        for i, label in enumerate(labels):
+            for name in vocabularies[label]:
+                name = name.strip()
+                if len(name) >= min_length:
+                    words[name] = words.get(name, 0) | (1 << i)
+
+        # Trie
+        transitions = {}
+        depth = [0]
+        terminal = {}
+        for name, mask in words.items():
+            state = 0
+            for ch in name:
+                key = state << 21 | ord(ch)
+                if key not in transitions:
+                    transitions[key] = len(depth)
+                    depth.append(depth[state] + 1)
+                state = transitions[key]
+            terminal[state] = mask
+
+        children = {}
+        for key, child in transitions.items():
+            children.setdefault(key >> 21, []).append((key & 0x1FFFFF, child))
+
+        # Failure links and merged outputs, breadth first
+        fail = array('i', [0]) * len(depth)
+        outputs = {}
+        queue = deque()
+        for _, child in children.get(0, []):
+            queue.append(child)
+            if child in terminal:
+                outputs[child] = ((depth[child], terminal[child]),)
+        while queue:
+            state = queue.popleft()
+            for code, child in children.get(state, []):
+                queue.append(child)
+                target = fail[state]
+                while target and (target << 21 | code) not in transitions:
+                    target = fail[target]
+                link = transitions.get(target << 21 | code, 0)
+                fail[child] = link if link != child else 0
+                own = ((depth[child], terminal[child]),) if child in terminal else ()
+                inherited = outputs.get(fail[child], ())
+                if own or inherited:
+                    outputs[child] = own + inherited
+
+        return cls(labels, transitions, fail, outputs)
+
+
+    @classmethod
+    def from_summary(cls, summary_path):
+        """
+        Build the automaton from the vocabulary JSON files in a summary directory.
+
+        Args:
+            summary_path: Directory written by MedicalKnowledgeGraphBuilder.export
+        """
+
+        vocabularies = {}
+        for label, file_name in VOCABULARY_FILES.items():
+            path = os.path.join(summary_path, file_name)
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    vocabularies[label] = json.load(f)
+        return cls.build(vocabularies)
+
+
+    @classmethod
+    def load(cls, artifact_path):
+        """Load a compiled linker artifact."""
+
+        with open(artifact_path, 'rb') as f:
+            data = pickle.load(f)
+        if data["version"] != ARTIFACT_VERSION:
+            raise ValueError(f"Unsupported entity linker artifact version {data['version']}")
+        return cls(data["labels"], data["transitions"], data["fail"], data["outputs"])
+
+
+    def save(self, artifact_path):
+        """Write the compiled automaton to a pickle artifact."""
+
+        os.makedirs(os.path.dirname(artifact_path) or '.', exist_ok=True)
+        data = {
+            "version": ARTIFACT_VERSION,
+            "labels": self.labels,
+            "transitions": self.transitions,
+            "fail": self.fail,
+            "outputs": self.outputs,
+        }
+        with open(artifact_path, 'wb') as f:
+            pickle.dump(data, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+    def link(self, text):
+        """
+        Find all entity names in a text.
+
+        Args:
+            text: User input
+
+        Returns:
+            Non-overlapping EntitySpans, leftmost-longest, in text order
+        """
+
+        transitions, fail, outputs = self.transitions, self.fail, self.outputs
+
+        # Longest match (end, mask) per start position
+        longest = {}
+        state = 0
+        for end, ch in enumerate(text, 1):
+            code = ord(ch)
+            while state and (state << 21 | code) not in transitions:
+                state = fail[state]
+            state = transitions.get(state << 21 | code, 0)
+            for length, mask in outputs.get(state, ()):
+                start = end - length
+                if start not in longest or longest[start][0] < end:
+                    longest[start] = (end, mask)
+
+        spans = []
+        position = 0
+        for start in sorted(longest):
+            if start < position:
+                continue
+            end, mask = longest[start]
+            labels = tuple(label for i, label in enumerate(self.labels) if mask >> i & 1)
+            spans.append(EntitySpan(start, end, text[start:end], labels))
+            position = end
+        return spans
+
+
+    def entities(self, text, label):
+        """Return the names in a text that are known under one label."""
+
+        return [span.text for span in self.link(text) if label in span.labels]
+
+
+def compile_linker(summary_path):
+    """
+    Build the linker from a summary directory and save it there as an artifact.
+
+    Args:
+        summary_path: Directory written by MedicalKnowledgeGraphBuilder.export
+    """
+
+    linker = EntityLinker.from_summary(summary_path)
+    linker.save(os.path.join(summary_path, ARTIFACT_NAME))
+    print(f"Entity linker compiled with {len(linker.fail)} states")
+    return linker
+
+
+_linker = None
+_linker_lock = threading.Lock()
+
+
+def get_linker(summary_path="./data/summary"):
+    """
+    Return the process-wide linker, loading the compiled artifact on first use.
+    Returns None if no artifact has been compiled yet.
+    """
+
+    global _linker
+    with _linker_lock:
+        if _linker is None:
+            artifact_path = os.path.join(summary_path, ARTIFACT_NAME)
+            if not os.path.exists(artifact_path):
+                return None
+            _linker = EntityLinker.load(artifact_path)
+        return _linker
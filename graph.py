@@ -1,16 +1,255 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
 import streamlit as st
 from langchain_neo4j import Neo4jGraph
+from neo4j import GraphDatabase
+from neo4j_graphrag.schema import format_schema
+
+from resources import resource
+from tracing import observe
+
+SCHEMA_SNAPSHOT_PATH = "./data/summary/schema.json"
+
+# Bookkeeping node holding the graph version, kept out of the schema shown to the LLM
+GRAPH_VERSION_LABEL = "GraphVersion"
+
+
+def hide_graph_version(graph):
+    """Drop the GraphVersion bookkeeping node from the schema of a graph, as shown to the LLM."""
+
+    structured = graph.structured_schema
+    if GRAPH_VERSION_LABEL in structured.get("node_props", {}):
+        del structured["node_props"][GRAPH_VERSION_LABEL]
+        graph.schema = format_schema(schema=structured, is_enhanced=graph._enhanced_schema)
+
+
+def write_schema_snapshot(graph, path=SCHEMA_SNAPSHOT_PATH):
+    """
+    Introspect the database schema and save it, so serving processes can
+    load it instead of introspecting the database on startup.
+
+    Args:
+        graph: Connected Neo4jGraph
+        path: Path of the snapshot JSON file
+    """
+    graph.refresh_schema()
+    hide_graph_version(graph)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"schema": graph.schema, "structured_schema": graph.structured_schema},
+                  f, ensure_ascii=False, indent=2)
+    print(f"Schema snapshot written to {path}")
+
+
+def load_schema_snapshot(graph, path=SCHEMA_SNAPSHOT_PATH):
+    """
+    Load a schema snapshot into a graph. Returns False if there is none.
+
+    Args:
+        graph: Neo4jGraph created with refresh_schema=False
+        path: Path of the snapshot JSON file
+    """
+    if not os.path.exists(path):
+        return False
+    with open(path, 'r', encoding='utf-8') as f:
+        snapshot = json.load(f)
+    graph.schema = snapshot["schema"]
+    graph.structured_schema = snapshot["structured_schema"]
+    return True
+
+
+def bump_graph_version(graph):
+    """
+    Increment the graph version stamp, so query caches of serving processes
+    drop their results. Call it after every change of the graph data.
+
+    Args:
+        graph: Connected Neo4jGraph
+    """
+    result = graph.query(f"""
+    MERGE (v:{GRAPH_VERSION_LABEL})
+    ON CREATE SET v.version = 0
+    SET v.version = v.version + 1, v.updated = datetime()
+    RETURN v.version AS version
+    """)
+    version = result[0]["version"]
+    print(f"Graph version bumped to {version}")
+    return version
+
+
+# Clauses and procedure calls that may change the graph, string literals are removed before matching
+WRITE_PATTERN = re.compile(
+    r"\b(CREATE|MERGE|SET|DELETE|DETACH|REMOVE|DROP|FOREACH|LOAD\s+CSV|CALL(?!\s+db\.index\.))\b",
+    re.IGNORECASE)
+STRING_PATTERN = re.compile(r"'(?:[^'\\]|\\.)*'|\"(?:[^\"\\]|\\.)*\"")
+
+
+class CachedNeo4jGraph(Neo4jGraph):
+    """
+    Neo4jGraph with a read-through cache for the results of read-only queries.
+
+    Results are keyed by the whitespace-normalized query and its parameters,
+    and expire after `cache_ttl` seconds or when evicted as least recently
+    used. The whole cache is dropped when the graph version stamp (see
+    `bump_graph_version`) changes, checked at most every
+    `version_check_interval` seconds, and when a write goes through this graph.
+    """
+    def __init__(self, *args, cache_size=1024, cache_ttl=300.0, version_check_interval=5.0, **kwargs):
+        """
+        Args:
+            cache_size: Maximum number of cached results, 0 disables the cache
+            cache_ttl: Seconds a result stays cached
+            version_check_interval: Minimum seconds between two reads of the graph version
+        """
+        super().__init__(*args, **kwargs)
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.version_check_interval = version_check_interval
+
+        self._cache = OrderedDict()    # key -> (expires at, result), least recently used first
+        self._cache_lock = threading.Lock()
+        self._version = None
+        self._version_checked = float("-inf")
+        self._stats = {"hits": 0, "misses": 0, "bypassed": 0, "invalidations": 0}
+
+
+    @staticmethod
+    def normalize_query(query):
+        return " ".join(query.split()).rstrip(";").strip()
+
+
+    @staticmethod
+    def is_read_only(query):
+        return not WRITE_PATTERN.search(STRING_PATTERN.sub("''", query))
+
+
+    def query(self, query, params={}, session_params=None, cache=True, invalidate=True):
+        """
+        Like Neo4jGraph.query, `cache=False` skips the cache, e.g. for large one-off exports.
+        `invalidate=False` keeps the cache on a write that no cached read depends on,
+        e.g. of chat sessions.
+        """
+
+        read_only = self.is_read_only(query)
+        if not (cache and self.cache_size) or session_params or not read_only:
+            result = self._timed_query(query, params, session_params)
+            if not read_only and invalidate:
+                # Our own writes must never be hidden by cached reads
+                self.clear_cache()
+            with self._cache_lock:
+                self._stats["bypassed"] += 1
+            return result
+
+        self._check_version()
+        key = (self.normalize_query(query), json.dumps(params, sort_keys=True, ensure_ascii=False, default=str))
+        now = time.monotonic()
+        with self._cache_lock:
+            entry = self._cache.get(key)
+            if entry is not None and entry[0] > now:
+                self._cache.move_to_end(key)
+                self._stats["hits"] += 1
+                return [dict(row) for row in entry[1]]
+            self._stats["misses"] += 1
+
+        result = self._timed_query(query, params)
+        with self._cache_lock:
+            self._cache[key] = (now + self.cache_ttl, result)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return [dict(row) for row in result]
+
+
+    def refresh_schema(self):
+        """Like Neo4jGraph.refresh_schema, without the GraphVersion bookkeeping node."""
+
+        super().refresh_schema()
+        hide_graph_version(self)
+
+
+    def _timed_query(self, query, params, session_params=None):
+        start = time.perf_counter()
+        try:
+            # Neo4jGraph.query may setdefault() on session_params, so never hand it a shared dict
+            return super().query(query, params, dict(session_params or {}))
+        finally:
+            observe("neo4j", time.perf_counter() - start)
+
+
+    def clear_cache(self):
+        with self._cache_lock:
+            if self._cache:
+                self._stats["invalidations"] += 1
+            self._cache.clear()
+
+
+    def cache_stats(self):
+        """Return hits, misses, bypassed writes, invalidations and size of the query cache."""
+
+        with self._cache_lock:
+            stats = dict(self._stats, size=len(self._cache), version=self._version)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+    def _check_version(self):
+        now = time.monotonic()
+        if now - self._version_checked < self.version_check_interval:
+            return
+        self._version_checked = now
+        try:
+            result = super().query(f"MATCH (v:{GRAPH_VERSION_LABEL}) RETURN v.version AS version")
+        except Exception as e:
+            print(f"Error reading graph version, dropping the query cache: {e}")
+            self.clear_cache()
+            return
+        version = result[0]["version"] if result else None
+        if version != self._version:
+            self._version = version
+            self.clear_cache()
+
+
+def create_driver():
+    """
+    A plain Neo4j driver with the credentials of `get_graph`, for what
+    Neo4jGraph.query does not expose, e.g. query plans. Close it after use.
+    """
+    return GraphDatabase.driver(st.secrets["NEO4J_URI"],
+                                auth=(st.secrets["NEO4J_USERNAME"], st.secrets["NEO4J_PASSWORD"]))
+
+
+# Connect to Neo4j on first use
+@resource("graph")
+def get_graph():
+    graph = CachedNeo4jGraph(
+        url=st.secrets["NEO4J_URI"],
+        username=st.secrets["NEO4J_USERNAME"],
+        password=st.secrets["NEO4J_PASSWORD"],
+        refresh_schema=False,
+        # Bound concurrent Neo4j work, extra callers queue for a connection
+        driver_config={
+            "max_connection_pool_size": st.secrets.get("NEO4J_MAX_CONNECTIONS", 100),
+            "connection_acquisition_timeout": st.secrets.get("NEO4J_ACQUISITION_TIMEOUT", 60.0),
+        },
+        cache_size=st.secrets.get("GRAPH_CACHE_SIZE", 1024),
+        cache_ttl=st.secrets.get("GRAPH_CACHE_TTL", 300.0),
+        version_check_interval=st.secrets.get("GRAPH_VERSION_CHECK_INTERVAL", 5.0),
+    )
+    # Introspecting the whole schema is slow, prefer the snapshot written by the builders
+    if not load_schema_snapshot(graph):
+        graph.refresh_schema()
+    return graph
 
-# Connect to Neo4j
-graph = Neo4jGraph(
-    url=st.secrets["NEO4J_URI"],
-    username=st.secrets["NEO4J_USERNAME"],
-    password=st.secrets["NEO4J_PASSWORD"],
-)
 
 if __name__ == '__main__':
     try:
-        graph.query("RETURN 1")
+        get_graph().query("RETURN 1")
         print("Successfully connected to Neo4j.")
     except Exception as e:
         print(f"Failed to connect to Neo4j: {e}")
\ No newline at end of file
@@ -1,15 +1,44 @@
+import httpx
 import streamlit as st
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 
-# Create the LLM
-llm = ChatOpenAI(
-    openai_api_key=st.secrets["OPENAI_API_KEY"],
-    base_url=st.secrets["OPENAI_BASE_URL"],
-    model=st.secrets["OPENAI_MODEL"],
-)
-
-# Create the Embedding model
-embeddings = OpenAIEmbeddings(
-    openai_api_key=st.secrets["OPENAI_API_KEY"],
-    base_url=st.secrets["OPENAI_BASE_URL"]
-)
\ No newline at end of file
+from embedding_cache import CachedEmbeddings
+from resources import resource
+
+
+def http_limits():
+    """Connection limits for the OpenAI clients, bounding concurrent requests to the endpoint."""
+    max_connections = st.secrets.get("LLM_MAX_CONNECTIONS", 100)
+    return httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+
+
+# Create the LLM on first use
+@resource("llm")
+def get_llm():
+    return ChatOpenAI(
+        openai_api_key=st.secrets["OPENAI_API_KEY"],
+        base_url=st.secrets["OPENAI_BASE_URL"],
+        model=st.secrets["OPENAI_MODEL"],
+        http_client=httpx.Client(limits=http_limits()),
+        http_async_client=httpx.AsyncClient(limits=http_limits()),
+    )
+
+
+def create_embeddings(writable=False):
+    """The embedding model behind the persistent cache, which only the builder writes (see build_vec.py)."""
+    return CachedEmbeddings(
+        OpenAIEmbeddings(
+            openai_api_key=st.secrets["OPENAI_API_KEY"],
+            base_url=st.secrets["OPENAI_BASE_URL"]
+        ),
+        path=st.secrets.get("EMBEDDING_CACHE_PATH", "./data/embedding_cache"),
+        max_entries=st.secrets.get("EMBEDDING_CACHE_SIZE", 100_000),
+        dtype=st.secrets.get("EMBEDDING_CACHE_DTYPE", "float32"),
+        writable=writable,
+    )
+
+
+# Create the Embedding model on first use, behind a persistent cache shared by all callers
+@resource("embeddings")
+def get_embeddings():
+    return create_embeddings(writable=st.secrets.get("EMBEDDING_CACHE_WRITABLE", False))
\ No newline at end of file
@@ -0,0 +1,342 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from langchain_core.chat_history import BaseChatMessageHistory
+from langchain_core.messages import SystemMessage
+
+# Summaries are folded in the background, off the request path
+_summary_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory-summary")
+
+
+def estimate_tokens(messages):
+    """Cheap token estimate: one token per character, about right for Chinese text."""
+    return sum(len(str(message.content)) for message in messages)
+
+
+class BufferedSummaryHistory(BaseChatMessageHistory):
+    """
+    A bounded view over a persistent chat history.
+
+    The last `max_turns` turns are kept verbatim as long as they fit in
+    `max_tokens`. Older turns are folded into a rolling summary in the
+    background, at most `max_tokens` worth per summarizer call, so the prompt
+    stays roughly the same size however long the conversation gets. Until
+    they are folded, only the last `pending_tail` evicted messages stay in the
+    prompt, and at most `max_pending` wait, the oldest being dropped beyond
+    that. With a `store`, the summary outlives the process. The history is
+    read from the backing store only once; new messages are written through
+    to it.
+    """
+    def __init__(self, backing, summarize, max_turns=4, max_tokens=1500, count_tokens=estimate_tokens,
+                 store=None, pending_tail=2, max_pending=40):
+        """
+        Args:
+            backing: Persistent history, e.g. Neo4jChatMessageHistory
+            summarize: Function (summary, messages) -> new summary
+            max_turns: Number of recent turns (question and answer) kept verbatim
+            max_tokens: Token budget of the verbatim window, and of the messages folded per summarizer call
+            count_tokens: Function estimating the tokens of a list of messages
+            store: Optional SummaryStore keeping the summary with the session
+            pending_tail: Number of evicted, not yet folded messages still shown in the prompt
+            max_pending: Number of evicted messages waiting to be folded, older ones are dropped
+        """
+        self.backing = backing
+        self.summarize = summarize
+        self.max_turns = max_turns
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.store = store
+        self.pending_tail = pending_tail
+        self.max_pending = max_pending
+
+        self.window = list(backing.messages)
+        self.summary = ""
+        # Messages of the backing store before the first pending (or window) message
+        self.summarized = 0
+        if store is not None:
+            summary, summarized, total = store.load()
+            self.summary = summary or ""
+            # Skip the loaded messages that the stored summary already covers
+            unsummarized = max(total - (summarized or 0), 0)
+            self.window = self.window[len(self.window) - min(unsummarized, len(self.window)):]
+            self.summarized = total - len(self.window)
+        self.pending = []    # Evicted from the window, not folded into the summary yet
+        self.dropped = 0
+        self._folding = False
+        self._lock = threading.RLock()
+        self._trim()
+
+
+    @property
+    def messages(self):
+        with self._lock:
+            prefix = [SystemMessage(content=f"此前对话摘要：{self.summary}")] if self.summary else []
+            tail = self.pending[max(len(self.pending) - self.pending_tail, 0):]
+            return prefix + tail + self.window
+
+
+    def add_messages(self, messages):
+        self.backing.add_messages(messages)
+        with self._lock:
+            self.window.extend(messages)
+            self._trim()
+
+
+    def clear(self):
+        self.backing.clear()
+        with self._lock:
+            self.summary = ""
+            self.summarized = 0
+            self.window = []
+            self.pending = []
+        if self.store is not None:
+            self.store.save("", 0)
+
+
+    def _trim(self):
+        """Move the oldest turns out of the window until it fits, then fold them in the background."""
+
+        with self._lock:
+            evicted = False
+            while len(self.window) > 2 and (
+                    len(self.window) > 2 * self.max_turns or self.count_tokens(self.window) > self.max_tokens):
+                self.pending.extend(self.window[:2])
+                del self.window[:2]
+                evicted = True
+            self._drop_excess()
+            if evicted and not self._folding:
+                self._folding = True
+                _summary_executor.submit(self._fold)
+
+
+    def _drop_excess(self):
+        # Called with the lock held; whole turns are dropped, as they were evicted
+        excess = len(self.pending) - self.max_pending
+        if excess > 0:
+            excess += excess % 2
+            del self.pending[:excess]
+            self.summarized += excess
+            self.dropped += excess
+
+
+    def _chunk(self):
+        # Oldest pending turns fitting in the token budget, at least one turn
+        size = min(2, len(self.pending))
+        while size + 2 <= len(self.pending) and self.count_tokens(self.pending[:size + 2]) <= self.max_tokens:
+            size += 2
+        return self.pending[:size]
+
+
+    def _fold(self):
+        """Fold pending messages into the summary, one chunk per call, until none are left."""
+
+        while True:
+            with self._lock:
+                if not self.pending:
+                    self._folding = False
+                    return
+                summary, chunk, dropped = self.summary, self._chunk(), self.dropped
+            try:
+                summary = self.summarize(summary, chunk)
+            except Exception as e:
+                print(f"Error summarizing chat history: {e}")
+                with self._lock:
+                    self._drop_excess()
+                    self._folding = False
+                return
+            with self._lock:
+                self.summary = summary
+                # Messages dropped meanwhile came off the front, part of the chunk may be gone already
+                folded = max(len(chunk) - (self.dropped - dropped), 0)
+                del self.pending[:folded]
+                self.summarized += folded
+                summarized = self.summarized
+            if self.store is not None:
+                try:
+                    self.store.save(summary, summarized)
+                except Exception as e:
+                    print(f"Error saving chat summary: {e}")
+
+
+class SummaryStore:
+    """
+    Keeps the rolling summary of a chat on its session node, as created by
+    Neo4jChatMessageHistory, with the number of messages it covers.
+    """
+    def __init__(self, graph, session_id, node_label="Session"):
+        """
+        Args:
+            graph: Connected CachedNeo4jGraph
+            session_id: Id of the session node
+            node_label: Label of the session node
+        """
+        self.graph = graph
+        self.session_id = session_id
+        self.node_label = node_label
+
+
+    def load(self):
+        """Return the summary, the number of messages it covers and the number of messages of the session."""
+
+        result = self.graph.query(f"""
+        MATCH (s:`{self.node_label}` {{id: $session_id}})
+        OPTIONAL MATCH (s)-[:LAST_MESSAGE]->(last)
+        OPTIONAL MATCH p = (last)<-[:NEXT*0..]-(first) WHERE NOT ()-[:NEXT]->(first)
+        RETURN s.summary AS summary, s.summarized AS summarized, coalesce(length(p) + 1, 0) AS messages
+        """, {"session_id": self.session_id}, cache=False)
+        if not result:
+            return "", 0, 0
+        return result[0]["summary"], result[0]["summarized"] or 0, result[0]["messages"]
+
+
+    def save(self, summary, summarized):
+        # Only the session node changes, cached query results stay valid
+        self.graph.query(f"""
+        MATCH (s:`{self.node_label}` {{id: $session_id}})
+        SET s.summary = $summary, s.summarized = $summarized
+        """, {"session_id": self.session_id, "summary": summary, "summarized": summarized}, invalidate=False)
+
+
+class SessionMemoryCache:
+    """Keeps the working memory of recently active sessions in process, least recently used evicted first."""
+    def __init__(self, max_sessions=1000):
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+
+    def get(self, session_id, factory):
+        """Return the memory of a session, creating it with `factory(session_id)` if needed."""
+
+        with self._lock:
+            memory = self._sessions.get(session_id)
+            if memory is not None:
+                self._sessions.move_to_end(session_id)
+                return memory
+
+        memory = factory(session_id)
+        with self._lock:
+            memory = self._sessions.setdefault(session_id, memory)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return memory
+
+
+def message_bytes(message):
+    """Approximate memory held by a message: the UTF-8 size of its content."""
+    return len(str(message.content).encode("utf-8"))
+
+
+class BoundedChatHistory(BaseChatMessageHistory):
+    """In-memory chat history keeping only the last `max_messages` messages."""
+    def __init__(self, max_messages=20, on_change=None):
+        """
+        Args:
+            max_messages: Number of most recent messages kept, older ones are dropped
+            on_change: Function called with the change in bytes held after every update
+        """
+        self.max_messages = max_messages
+        self.on_change = on_change
+        self.messages = []
+        self.nbytes = 0
+
+
+    def add_messages(self, messages):
+        self.messages.extend(messages)
+        # Drop whole turns, so the history never starts with an answer
+        excess = len(self.messages) - self.max_messages
+        if excess > 0:
+            del self.messages[:excess + excess % 2]
+        self._resize()
+
+
+    def clear(self):
+        self.messages = []
+        self._resize()
+
+
+    def _resize(self):
+        nbytes = sum(message_bytes(message) for message in self.messages)
+        delta, self.nbytes = nbytes - self.nbytes, nbytes
+        if delta and self.on_change:
+            self.on_change(delta)
+
+
+class SessionHistoryStore:
+    """
+    Process-wide store of in-memory chat histories, one per session.
+
+    Sessions idle for longer than `ttl` seconds are dropped, and when all
+    histories together hold more than `max_bytes`, the least recently used
+    sessions are dropped until they fit again.
+    """
+    def __init__(self, max_messages=20, ttl=1800, max_bytes=64 * 1024 * 1024, clock=time.monotonic):
+        """
+        Args:
+            max_messages: Number of messages kept per session
+            ttl: Seconds a session may stay idle before it is dropped
+            max_bytes: Approximate bytes all sessions may hold together
+            clock: Function returning the current time in seconds
+        """
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.clock = clock
+
+        self._sessions = OrderedDict()    # session_id -> (history, last used), least recently used first
+        self._lock = threading.RLock()
+        self.nbytes = 0
+        self.expired = 0
+        self.evicted = 0
+
+
+    def get(self, session_id):
+        """Return the history of a session, creating an empty one if needed."""
+
+        with self._lock:
+            now = self.clock()
+            self._expire(now)
+            entry = self._sessions.pop(session_id, None)
+            history = entry[0] if entry else BoundedChatHistory(self.max_messages, self._on_change)
+            self._sessions[session_id] = (history, now)
+            return history
+
+
+    def metrics(self):
+        """Return the number of live sessions, the bytes they hold and how many were dropped."""
+
+        with self._lock:
+            self._expire(self.clock())
+            return {
+                "sessions": len(self._sessions),
+                "bytes": self.nbytes,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+    def _on_change(self, delta):
+        with self._lock:
+            self.nbytes += delta
+            while self.nbytes > self.max_bytes and len(self._sessions) > 1:
+                self._drop(next(iter(self._sessions)))
+                self.evicted += 1
+
+
+    def _expire(self, now):
+        # Sessions are ordered by last use, so the expired ones come first
+        while self._sessions:
+            session_id, (_, last_used) = next(iter(self._sessions.items()))
+            if now - last_used <= self.ttl:
+                return
+            self._drop(session_id)
+            self.expired += 1
+
+
+    def _drop(self, session_id):
+        history, _ = self._sessions.pop(session_id)
+        self.nbytes -= history.nbytes
+        history.on_change = None
@@ -1,11 +1,13 @@
+import streamlit as st
 from langchain.schema import StrOutputParser
 from langchain.tools import Tool
-from langchain_community.chat_message_histories import ChatMessageHistory
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables.history import RunnableWithMessageHistory
 
-from graph import graph
-from llm import llm
+from llm import get_llm
+from memory import SessionHistoryStore
+from resources import resource
+from utils import get_session_id
 
 chat_prompt = ChatPromptTemplate.from_messages(
     [
@@ -19,29 +21,54 @@ chat_prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-consult_chat = chat_prompt | llm | StrOutputParser()
-
-memory = ChatMessageHistory()
+# In-process chat histories, one per browser session
+@resource("history_store")
+def get_history_store():
+    return SessionHistoryStore(
+        max_messages=st.secrets.get("HISTORY_MAX_MESSAGES", 20),
+        ttl=st.secrets.get("HISTORY_TTL", 1800),
+        max_bytes=st.secrets.get("HISTORY_MAX_BYTES", 64 * 1024 * 1024),
+    )
 
 def get_memory(session_id):
-    return memory
+    return get_history_store().get(session_id)
 
-chat_with_message_history = RunnableWithMessageHistory(
-    consult_chat,
-    get_memory,
-    input_messages_key="question",
-    history_messages_key="chat_history",
-)
+@resource("plain_chat")
+def get_chat_with_message_history():
+    consult_chat = chat_prompt | get_llm() | StrOutputParser()
+    return RunnableWithMessageHistory(
+        consult_chat,
+        get_memory,
+        input_messages_key="input",
+        history_messages_key="chat_history",
+    )
 
 # Create a handler to call the agent
-def generate_response(user_input):
+def generate_response(user_input, session_id=None):
     """
     Create a handler that calls the Conversational agent
     and returns a response to be rendered in the UI
     """
 
-    response = chat_with_message_history.invoke(
+    response = get_chat_with_message_history().invoke(
         {"input": user_input},
-        {"configurable": {"session_id": "none"}})
+        {"configurable": {"session_id": session_id or get_session_id()}})
+
+    return response
+
+
+def stream_response(user_input, session_id=None):
+    """
+    Like generate_response, but yields the answer token by token.
+    The complete answer is saved to the history once the stream ends.
+    """
+
+    return get_chat_with_message_history().stream(
+        {"input": user_input},
+        {"configurable": {"session_id": session_id or get_session_id()}})
+
+
+def history_metrics():
+    """Return the live sessions and bytes held by the history store."""
 
-    return response
\ No newline at end of file
+    return get_history_store().metrics()
@@ -1,6 +1,6 @@
 import streamlit as st
 
-from plain_agent import generate_response
+from plain_agent import generate_response, history_metrics, stream_response
 from utils import write_message
 
 # Page Config
@@ -12,6 +12,11 @@ if "messages" not in st.session_state:
         {"role": "assistant", "content": "你好，我是您的问诊助手，请问有什么可以帮助您的？"},
     ]
 
+# Memory held by the chat histories of all sessions in this process
+with st.sidebar:
+    metrics = history_metrics()
+    st.caption(f"活跃会话: {metrics['sessions']}，占用内存: {metrics['bytes'] / 1024:.1f} KB")
+
 # Display messages in Session State
 for message in st.session_state.messages:
     write_message(message['role'], message['content'], save=False)
@@ -22,6 +27,11 @@ if question := st.chat_input("输入你的症状"):
     write_message('user', question)
 
     # Generate a response
-    with st.spinner('思考中...'):
-        response = generate_response(question)
-        write_message('assistant', response)
+    if st.secrets.get("STREAM_RESPONSES", True):
+        with st.chat_message('assistant'):
+            response = st.write_stream(stream_response(question))
+        st.session_state.messages.append({"role": 'assistant', "content": response})
+    else:
+        with st.spinner('思考中...'):
+            response = generate_response(question)
+            write_message('assistant', response)
@@ -0,0 +1,73 @@
+import threading
+import time
+from functools import wraps
+
+# Process-wide registry of lazily created resources (graph, LLM, chains, ...)
+_instances = {}
+_timings = {}
+_lock = threading.RLock()
+
+
+def resource(name):
+    """
+    Decorator turning a factory into a lazy, process-wide cached getter.
+
+    The factory runs on the first call only, and its initialization time is
+    recorded for `startup_report`. If it raises, nothing is cached, so the next
+    call retries (e.g. when Neo4j was briefly unavailable).
+
+    Args:
+        name: Name of the resource in the registry
+    """
+
+    def decorator(factory):
+        @wraps(factory)
+        def getter():
+            instance = _instances.get(name)
+            if instance is not None:
+                return instance
+            with _lock:
+                if name not in _instances:
+                    start = time.perf_counter()
+                    _instances[name] = factory()
+                    _timings[name] = time.perf_counter() - start
+                return _instances[name]
+        return getter
+    return decorator
+
+
+def override(name, instance):
+    """Replace a resource, e.g. with a fake LLM for load tests and benchmarks."""
+
+    with _lock:
+        _instances[name] = instance
+        _timings[name] = 0.0
+
+
+def reset(name=None):
+    """Drop one resource (or all of them), so it is created again on next use."""
+
+    with _lock:
+        for key in [name] if name else list(_instances):
+            _instances.pop(key, None)
+            _timings.pop(key, None)
+
+
+def startup_report():
+    """Return the initialization time of every created resource, in creation order."""
+
+    with _lock:
+        lines = ["Resource initialization times:"]
+        lines += [f"  {name:<24} {seconds * 1000:9.1f} ms" for name, seconds in _timings.items()]
+        lines.append(f"  {'total':<24} {sum(_timings.values()) * 1000:9.1f} ms")
+        return "\n".join(lines)
+
+
+if __name__ == '__main__':
+    # Profile a cold start: module import versus first use of each resource
+    start = time.perf_counter()
+    import agent
+    print(f"Importing agent took {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    agent.get_chat_agent()
+    print(startup_report())
@@ -0,0 +1,119 @@
+import re
+import threading
+from collections import namedtuple
+
+from tools.cypher import PROPERTY_KEYWORDS, RELATIONSHIP_KEYWORDS, normalize_question
+
+# Route of a turn: the tool to call (or DIRECT), a confidence between 0 and 1, why, and a reply for DIRECT
+Route = namedtuple("Route", ["tool", "confidence", "reason", "answer"], defaults=[None])
+
+DIRECT = "直接回答"
+
+# Small talk answered without any LLM call
+DIRECT_ANSWERS = [
+    (r"(?:你好|您好|嗨|hi|hello|在吗)", "你好，我是您的智能问诊助手，请问有什么可以帮助您的？"),
+    (r"(?:谢谢|多谢|感谢|谢啦)(?:你|您)?", "不客气，祝您早日康复！如有其他问题，欢迎随时咨询。"),
+    (r"(?:再见|拜拜|bye)", "再见，祝您身体健康！"),
+    (r"(?:你是谁|你叫什么|你能做什么|你会什么)", "我是智能问诊助手，可以查询疾病、症状、药物、饮食、检查等医疗知识，也可以根据症状帮您分析可能的疾病。"),
+]
+
+# Words referring back to earlier turns, the question cannot be answered on its own
+FOLLOW_UP = re.compile(r"它|他|她|这个|那个|这种|那种|这些|那些|上面|刚才|之前|还有|^那|^那么|^再")
+
+# Questions asking which disease explains a symptom
+ASKS_DISEASE = re.compile(r"什么病|哪种病|哪些病|什么疾病|哪种疾病|怎么回事|什么原因|可能是")
+
+# Health questions that the knowledge graph cannot answer, e.g. advice without a known entity
+ASKS_ADVICE = re.compile(r"怎么办|如何缓解|怎么缓解|注意什么|注意事项|要紧吗|严重吗|能不能|可不可以|可以吗|建议|怎么调理|正常吗")
+
+GRAPH_KEYWORDS = [keyword for keywords in (*RELATIONSHIP_KEYWORDS.values(), *PROPERTY_KEYWORDS.values())
+                  for keyword in keywords]
+
+
+class QuestionRouter:
+    """
+    Picks the tool for a turn from rules over the question, so common turns
+    skip the ReAct loop's tool selection LLM call.
+
+    Entities are found with the entity linker, intents with keywords. Each
+    rule comes with a fixed confidence; callers run the ReAct agent when
+    the confidence is below `threshold`, e.g. for follow-up questions that
+    need the chat history, or questions that name nothing the rules know.
+    """
+    def __init__(self, linker=None, threshold=0.8):
+        """
+        Args:
+            linker: Optional EntityLinker, or a function returning one (or None)
+            threshold: Minimum confidence for a route to be taken
+        """
+        self.linker = linker
+        self.threshold = threshold
+        self.direct_answers = [(re.compile(rf"^{pattern}[!！。.~～,，]*$", re.IGNORECASE), answer)
+                               for pattern, answer in DIRECT_ANSWERS]
+        self.counts = {}    # tool or "react" -> turns
+        self._lock = threading.Lock()
+
+
+    def route(self, question, has_history=False):
+        """
+        Classify a question.
+
+        Args:
+            question: The user's question
+            has_history: Whether the session has earlier turns
+
+        Returns:
+            Route, with tool None when no rule applies
+        """
+
+        question = normalize_question(question)
+        for pattern, answer in self.direct_answers:
+            if pattern.match(question):
+                return Route(DIRECT, 0.95, "small talk", answer)
+        if has_history and FOLLOW_UP.search(question):
+            return Route(None, 0.0, "follow-up question")
+
+        linker = self.linker() if callable(self.linker) else self.linker
+        spans = linker.link(question) if linker else []
+        diseases = [span for span in spans if "Disease" in span.labels]
+        symptoms = [span for span in spans if "Symptom" in span.labels and "Disease" not in span.labels]
+        graph_intent = any(keyword in question for keyword in GRAPH_KEYWORDS)
+        if has_history and not spans:
+            # Routed tools only see the question, which may rely on an entity of earlier turns
+            return Route(None, 0.0, "no entity of its own after earlier turns")
+
+        if len(symptoms) >= 2 and not diseases:
+            return Route("症状鉴别诊断", 0.9, f"{len(symptoms)} symptoms")
+        if symptoms and not diseases and ASKS_DISEASE.search(question):
+            return Route("医疗信息查询", 0.85, "one symptom, asks for diseases")
+        if diseases and graph_intent:
+            return Route("医疗信息查询", 0.9, "disease with a graph intent")
+        if spans and graph_intent:
+            return Route("医疗信息查询", 0.8, "entity with a graph intent")
+        if spans:
+            return Route("医疗信息查询", 0.5, "entity without a known intent")
+        if ASKS_ADVICE.search(question):
+            # Below the default threshold: advice often follows up on an earlier answer
+            return Route("通用对话", 0.7, "advice without a known entity")
+        return Route(None, 0.0, "no rule matched")
+
+
+    def record(self, route, taken):
+        """Count a decision and log it, `taken` being False when the ReAct agent ran instead."""
+
+        key = route.tool if taken else "react"
+        with self._lock:
+            self.counts[key] = self.counts.get(key, 0) + 1
+        print(f"Route: {route.tool or '-'} ({route.confidence:.2f}, {route.reason}) -> {key}")
+
+
+    def stats(self):
+        """Return the number of turns per route and the share of turns that skipped the ReAct loop."""
+
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "total": total,
+                **self.counts,
+                "routed_rate": (total - self.counts.get("react", 0)) / total if total else 0.0,
+            }
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import json
+import time
+from contextlib import asynccontextmanager
+from uuid import uuid4
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import BaseModel
+
+from agent import AgentStreamHandler, get_chat_agent, get_memory
+from tracing import get_recorder, trace
+
+
+class ChatRequest(BaseModel):
+    message: str
+    session_id: str | None = None
+
+
+class TurnLimiter:
+    """
+    Bounds the number of agent turns running at once. Requests beyond the
+    limit wait in a bounded queue for at most `queue_timeout` seconds,
+    after that (or when the queue is full) they are rejected.
+    """
+    def __init__(self, max_concurrent, max_waiting, queue_timeout):
+        self.semaphore = asyncio.Semaphore(max_concurrent)
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.running = 0
+        self.waiting = 0
+
+    @asynccontextmanager
+    async def slot(self):
+        if self.waiting >= self.max_waiting:
+            raise HTTPException(503, "Server busy, try again later", headers={"Retry-After": "1"})
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(503, "Server busy, try again later", headers={"Retry-After": "1"})
+        finally:
+            self.waiting -= 1
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            self.semaphore.release()
+
+
+def create_app(max_concurrent=32, max_waiting=256, queue_timeout=10.0, request_timeout=120.0):
+    """
+    Create the ASGI app serving the graph agent.
+
+    Args:
+        max_concurrent: Maximum number of agent turns running at once
+        max_waiting: Maximum number of requests waiting for a turn
+        queue_timeout: Seconds a request may wait for a turn before it is rejected with 503
+        request_timeout: Seconds an agent turn may take before it is cancelled with 504
+    """
+
+    app = FastAPI(title="智能问诊助手")
+    limiter = TurnLimiter(max_concurrent, max_waiting, queue_timeout)
+
+    async def run_agent(message, session_id, callbacks=()):
+        # Load the session's history off the event loop, the agent then finds it in the memory cache
+        await asyncio.get_running_loop().run_in_executor(None, get_memory, session_id)
+        # Traced inside the coroutine, so the trace follows it into its task
+        with trace() as handler:
+            callbacks = list(callbacks) + ([handler] if handler is not None else [])
+            return await get_chat_agent().ainvoke(
+                {"input": message}, {"configurable": {"session_id": session_id}, "callbacks": callbacks})
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "running": limiter.running, "waiting": limiter.waiting}
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def metrics():
+        # Prometheus text format, per-stage latency histograms and counters of all turns so far
+        return PlainTextResponse(get_recorder().to_prometheus(), media_type="text/plain; version=0.0.4")
+
+    @app.post("/chat")
+    async def chat(request: ChatRequest):
+        session_id = request.session_id or str(uuid4())
+        async with limiter.slot():
+            try:
+                response = await asyncio.wait_for(run_agent(request.message, session_id), request_timeout)
+            except asyncio.TimeoutError:
+                raise HTTPException(504, "Agent timed out")
+        return {"session_id": session_id, "answer": response["output"]}
+
+    @app.post("/chat/stream")
+    async def chat_stream(request: ChatRequest):
+        session_id = request.session_id or str(uuid4())
+
+        # Take the slot before responding, so a busy server answers 503 instead of an empty stream
+        slot = limiter.slot()
+        await slot.__aenter__()
+        released = False
+
+        async def release():
+            # Called when the stream ends, and again after the response in case it never started
+            nonlocal released
+            if not released:
+                released = True
+                await slot.__aexit__(None, None, None)
+
+        async def events():
+            queue = asyncio.Queue()
+            handler = AgentStreamHandler(queue, asyncio.get_running_loop())
+            task = asyncio.create_task(run_agent(request.message, session_id, [handler]))
+            task.add_done_callback(lambda _: queue.put_nowait(("finished",)))
+            deadline = time.monotonic() + request_timeout
+            streamed = False
+            try:
+                yield sse("session", {"session_id": session_id})
+                while True:
+                    try:
+                        event = await asyncio.wait_for(queue.get(), deadline - time.monotonic())
+                    except asyncio.TimeoutError:
+                        task.cancel()
+                        yield sse("error", {"detail": "Agent timed out"})
+                        return
+                    if event[0] == "token":
+                        streamed = True
+                        yield sse("token", {"text": event[1]})
+                    elif event[0] == "step":
+                        yield sse("step", {"tool": event[1], "input": str(event[2])})
+                    elif task.exception():
+                        yield sse("error", {"detail": str(task.exception())})
+                        return
+                    else:
+                        output = task.result()["output"]
+                        if not streamed:
+                            yield sse("token", {"text": output})
+                        yield sse("done", {"answer": output})
+                        return
+            finally:
+                # Also reached when the client disconnects
+                if not task.done():
+                    task.cancel()
+                await release()
+
+        return StreamingResponse(events(), media_type="text/event-stream",
+                                 headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+                                 background=BackgroundTask(release))
+
+    return app
+
+
+def sse(event, data):
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    from resources import override
+
+    parser = argparse.ArgumentParser(description="Serve the graph agent over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrent", type=int, default=32, help="Agent turns running at once")
+    parser.add_argument("--max-waiting", type=int, default=256, help="Requests waiting for a turn")
+    parser.add_argument("--queue-timeout", type=float, default=10.0, help="Seconds to wait for a turn")
+    parser.add_argument("--request-timeout", type=float, default=120.0, help="Seconds per agent turn")
+    parser.add_argument("--fake-llm", action="store_true", help="Use a deterministic fake LLM, for load tests")
+    parser.add_argument("--fake-latency", type=float, default=0.5, help="Fake LLM time to first token")
+    args = parser.parse_args()
+
+    if args.fake_llm:
+        from benchmarks.fakes import FakeReActChatModel
+        override("llm", FakeReActChatModel(latency=args.fake_latency))
+
+    uvicorn.run(create_app(args.max_concurrent, args.max_waiting, args.queue_timeout, args.request_timeout),
+                host=args.host, port=args.port)
@@ -1,9 +1,22 @@
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+
 import streamlit as st
 from langchain.prompts.prompt import PromptTemplate
 from langchain_neo4j import GraphCypherQAChain
+from langchain_neo4j.chains.graph_qa.cypher import extract_cypher
+from neo4j_graphrag.schema import format_schema
+
+from entity_linker import get_linker
+from graph import get_graph
+from llm import get_llm
+from resources import resource
+from vector_storage import LEGACY_TARGET, load_targets
 
-from graph import graph
-from llm import llm
+# Tag of the LLM runs writing the answer from query results, so routed turns can stream them
+CYPHER_ANSWER_TAG = "cypher_answer"
 
 # Create the Cypher QA chain
 CYPHER_GENERATION_TEMPLATE = """
@@ -29,18 +42,18 @@ CYPHER_GENERATION_TEMPLATE = """
 1.查询某种症状对应的所有可能疾病:
 ```
 MATCH (d:Disease)-[:has_symptom]->(s:Symptom {{name: "症状名称"}})
-RETURN s.name AS symptom
+RETURN d.name AS disease
 ```
 
 2.查询得了某种疾病后不能吃的食物:
 ```
-MATCH (d:Disease {{name: "疾病名称"}})-[:no_eat]->(r:Food)
+MATCH (d:Disease {{name: "疾病名称"}})-[:not_eat]->(r:Food)
 RETURN r.name AS no_eat_food
 ```
 
 3.查询得了某种疾病后推荐吃的菜肴：
 ```
-MATCH (d:Disease {{name: "疾病名称"}})-[:recommend_eat]->(r:Recipe)
+MATCH (d:Disease {{name: "疾病名称"}})-[:recommend_recipes]->(r:Recipe)
 RETURN r.name AS recommend_eat_recipe
 ```
 
@@ -62,10 +75,413 @@ Cypher查询语句:
 cypher_prompt = PromptTemplate.from_template(CYPHER_GENERATION_TEMPLATE)
 
 
-cypher_qa = GraphCypherQAChain.from_llm(
-    llm,
-    graph=graph,
-    verbose=True,
-    cypher_prompt=cypher_prompt,
-    allow_dangerous_requests=True
-)
\ No newline at end of file
+@resource("cypher_chain")
+def get_cypher_chain():
+    return GraphCypherQAChain.from_llm(
+        get_llm(),
+        graph=get_graph(),
+        verbose=True,
+        cypher_prompt=cypher_prompt,
+        allow_dangerous_requests=True,
+    )
+
+# Pre-validated Cypher for the most common question patterns, keyed by intent.
+# Each pattern captures the entity name the query is parameterized with,
+# and the label names that entity is expected to have.
+CYPHER_TEMPLATES = {
+    "symptom_to_disease": (
+        "Symptom",
+        [r"^(?:我)?(?:出现|有|总是|经常)?(?P<entity>.+?)(?:的症状|症状)?(?:可能|会|一般)?是(?:什么|哪种|哪些)(?:病|疾病)",
+         r"^(?P<entity>.+?)(?:的症状|症状)?(?:可能|会)?(?:是)?(?:由)?(?:什么|哪些)(?:病|疾病)(?:引起|导致)"],
+        """
+        MATCH (d:Disease)-[:has_symptom]->(s:Symptom {name: $entity})
+        RETURN d.name AS disease
+        """
+    ),
+    "no_eat": (
+        "Disease",
+        [r"^(?:得了|患了|有)?(?P<entity>.+?)(?:的人|患者|病人)?(?:不能|不可以|不宜|不应该|忌)吃(?:什么|哪些)"],
+        """
+        MATCH (d:Disease {name: $entity})-[:not_eat]->(f:Food)
+        RETURN f.name AS no_eat_food
+        """
+    ),
+    "recommend_recipes": (
+        "Disease",
+        [r"^(?:得了|患了|有)?(?P<entity>.+?)(?:的人|患者|病人)?(?:推荐|适合|应该|可以|宜)吃(?:什么|哪些)(?:菜|菜肴|食谱)"],
+        """
+        MATCH (d:Disease {name: $entity})-[:recommend_recipes]->(r:Recipe)
+        RETURN r.name AS recommend_eat_recipe
+        """
+    ),
+    "cure_way": (
+        "Disease",
+        [r"^(?:得了|患了)?(?P<entity>.+?)(?:该|要|应该)?(?:怎么|如何|怎样)(?:治疗|治|医治)",
+         r"^(?P<entity>.+?)的(?:治疗方法|治疗方式|疗法)"],
+        """
+        MATCH (d:Disease {name: $entity})
+        WHERE d.cure_way IS NOT NULL
+        RETURN d.cure_way AS cure_way
+        """
+    ),
+}
+
+
+# Keywords selecting the relationship types and Disease properties a question is about
+RELATIONSHIP_KEYWORDS = {
+    "has_symptom": ["症状", "表现", "什么病", "哪些病", "哪种病", "疾病"],
+    "not_eat": ["不能吃", "不可以吃", "不宜吃", "不应该吃", "忌", "不要吃"],
+    "do_eat": ["吃", "饮食", "食物"],
+    "recommend_recipes": ["菜", "食谱", "食疗"],
+    "has_common_drug": ["药"],
+    "recommend_drug": ["药"],
+    "need_check": ["检查", "化验", "诊断", "确诊"],
+    "production": ["生产", "厂"],
+    "accompany_with": ["并发", "伴随", "合并"],
+    "cure_department": ["科", "挂号", "看病"],
+    "belongs_to": ["科"],
+}
+PROPERTY_KEYWORDS = {
+    ("Disease", "desc"): ["是什么", "什么是", "介绍", "简介"],
+    ("Disease", "prevent"): ["预防", "避免"],
+    ("Disease", "cause"): ["原因", "病因", "引起", "导致", "为什么"],
+    ("Disease", "get_prob"): ["概率", "几率", "发病率"],
+    ("Disease", "easy_get"): ["人群", "易感", "容易得"],
+    ("Disease", "cure_way"): ["治疗", "怎么治", "如何治", "疗法"],
+    ("Disease", "cure_lasttime"): ["多久", "多长时间", "周期"],
+    ("Disease", "cured_prob"): ["治愈", "治好"],
+}
+
+
+def prune_schema(structured, question, labels=(), exclude=()):
+    """
+    Select the part of a structured graph schema a question is about.
+
+    Relationship types and properties are chosen by keywords in the
+    question, node labels by linked entities and the endpoints of the chosen
+    relationships. Properties in `exclude`, e.g. embeddings, are always left out.
+
+    Args:
+        structured: Structured schema of Neo4jGraph, with node_props, rel_props and relationships
+        question: Normalized user question
+        labels: Labels of the entities linked in the question
+        exclude: Property names never included
+
+    Returns:
+        Pruned structured schema, or None if nothing in the question matches
+    """
+
+    rel_types = {rel for rel, keywords in RELATIONSHIP_KEYWORDS.items() if any(k in question for k in keywords)}
+    properties = {key for key, keywords in PROPERTY_KEYWORDS.items() if any(k in question for k in keywords)}
+    labels = set(labels) | {label for label, _ in properties}
+    if not (labels or rel_types):
+        return None
+
+    relationships = [rel for rel in structured.get("relationships", []) if rel["type"] in rel_types]
+    if not (rel_types or properties):
+        # Only entities matched, offer everything around them
+        relationships = [rel for rel in structured.get("relationships", [])
+                         if rel["start"] in labels or rel["end"] in labels]
+        properties |= {(label, None) for label in labels}
+    labels |= {rel["start"] for rel in relationships} | {rel["end"] for rel in relationships}
+
+    node_props = {}
+    for label, props in structured.get("node_props", {}).items():
+        if label not in labels:
+            continue
+        node_props[label] = [prop for prop in props
+                             if prop["property"] not in exclude
+                             and (prop["property"] == "name" or (label, None) in properties
+                                  or (label, prop["property"]) in properties)]
+    return {
+        "node_props": node_props,
+        "rel_props": {rel: props for rel, props in structured.get("rel_props", {}).items()
+                      if rel in {r["type"] for r in relationships}},
+        "relationships": relationships,
+    }
+
+
+def schema_vocabulary(structured):
+    """Return the node labels, relationship types and property names of a structured schema."""
+
+    return ({label for label in structured["node_props"]} | {rel["type"] for rel in structured["relationships"]},
+            {prop["property"] for props in structured["node_props"].values() for prop in props}
+            | {prop["property"] for props in structured["rel_props"].values() for prop in props})
+
+
+def cypher_vocabulary(cypher):
+    """Return the labels and relationship types, and the property names, referenced by a Cypher query."""
+
+    cypher = re.sub(r"\"[^\"]*\"|'[^']*'", "''", cypher)
+    types = set(re.findall(r"[(\[]\s*\w*\s*:\s*`?(\w+)", cypher)) | set(re.findall(r"\|\s*:?\s*`?(\w+)", cypher))
+    properties = set(re.findall(r"\b[A-Za-z_]\w*\.`?(\w+)", cypher))
+    return types, properties
+
+
+def estimate_prompt_tokens(text):
+    """Cheap token estimate: one per CJK character, one per four other characters."""
+
+    cjk = len(re.findall(r"[\u3000-\u9fff\uff00-\uffef]", text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def normalize_question(question):
+    """Normalize a question for matching and cache lookups: NFKC, no whitespace or trailing punctuation."""
+
+    question = unicodedata.normalize("NFKC", question)
+    question = re.sub(r"\s+", "", question)
+    return question.rstrip("?？。.!！~")
+
+
+class CypherGenerationLayer:
+    """
+    A generation layer in front of `cypher_chain` that avoids the Cypher
+    generation LLM call where possible. Questions are answered through:
+
+    - template: a recognized intent and entity mapped to pre-validated Cypher
+    - cache: Cypher previously generated by the LLM for the same question template
+    - llm: Cypher generated by the LLM of `cypher_chain`, cached if it returns results
+
+    When an entity linker is available, entity names in the question are
+    replaced by their label to form the question template (e.g.
+    "{Disease}不能吃什么"), and names in the generated Cypher become parameters,
+    so a cached query also serves the same question about another entity.
+
+    Novel questions are generated with only the part of the schema they are
+    about (see `prune_schema`). If the generated Cypher uses anything outside
+    that part, or fails to run, it is generated again with the full schema.
+    """
+    def __init__(self, get_chain, templates, linker=None, max_cache_size=1024):
+        """
+        Args:
+            get_chain: Function returning the GraphCypherQAChain used for novel
+                questions and answer synthesis, called on first use
+            templates: Mapping of intent to (entity label, regex patterns, parameterized Cypher)
+            linker: Optional EntityLinker, or a function returning one (or None)
+            max_cache_size: Maximum number of cached generated queries (LRU)
+        """
+        self.get_chain = get_chain
+        self.templates = [(intent, label, [re.compile(p) for p in patterns], cypher)
+                          for intent, (label, patterns, cypher) in templates.items()]
+        self.linker = linker
+        self.max_cache_size = max_cache_size
+        self.cache = OrderedDict()   # question template (or exact question) -> parameterized Cypher
+        self.counts = {"template": 0, "cache": 0, "llm": 0}
+        # Prompt tokens with the full and the pruned schema, summed over LLM generations
+        self.schema_stats = {"pruned": 0, "fallbacks": 0, "full_tokens": 0, "pruned_tokens": 0}
+        self._lock = threading.Lock()
+
+
+    @property
+    def chain(self):
+        return self.get_chain()
+
+
+    def link(self, question):
+        """Return the entity spans in a question, or [] without a linker."""
+
+        linker = self.linker() if callable(self.linker) else self.linker
+        return linker.link(question) if linker else []
+
+
+    def match_template(self, question, spans=()):
+        """
+        Return (intent, cypher, params) for the first matching template, or None.
+        A linked entity of the expected label overlapping the captured text is
+        preferred over the raw capture, e.g. "最近头痛" becomes "头痛" and the
+        capture "糖尿" of "糖尿病人不能吃什么" becomes "糖尿病". A template
+        whose capture holds several such entities, e.g. "头痛和发热", is
+        skipped, as its query takes only one.
+        """
+
+        for intent, label, patterns, cypher in self.templates:
+            for pattern in patterns:
+                match = pattern.match(question)
+                if not match:
+                    continue
+                start, end = match.span("entity")
+                linked = [span for span in spans
+                          if span.start < end and start < span.end and label in span.labels]
+                if len(linked) > 1:
+                    break
+                entity = linked[0].text if linked else match.group("entity")
+                return intent, cypher, {"entity": entity}
+        return None
+
+
+    def question_template(self, question, spans):
+        """
+        Replace linked entities by their first label.
+
+        Returns:
+            (template, params) where params maps `e0`, `e1`, ... to the replaced names
+        """
+
+        parts, params = [], {}
+        position = 0
+        for i, span in enumerate(spans):
+            parts.append(question[position:span.start])
+            parts.append("{" + span.labels[0] + "}")
+            params[f"e{i}"] = span.text
+            position = span.end
+        parts.append(question[position:])
+        return "".join(parts), params
+
+
+    def parameterize(self, cypher, params):
+        """
+        Replace quoted entity names in generated Cypher by parameters.
+        Returns None if a name does not appear exactly once as a string literal.
+        """
+
+        for name, value in params.items():
+            literals = [f'"{value}"', f"'{value}'"]
+            if sum(cypher.count(literal) for literal in literals) != 1:
+                return None
+            for literal in literals:
+                cypher = cypher.replace(literal, f"${name}")
+        return cypher
+
+
+    def answer(self, question, cypher, params):
+        """Run a Cypher query and let the QA chain answer from its results. Returns None if empty."""
+
+        context = self.chain.graph.query(cypher, params)[: self.chain.top_k]
+        if not context:
+            return None
+        if self.chain.verbose:
+            print(f"Cached Cypher: {cypher} {params}")
+        return self.synthesize(question, context)
+
+
+    def synthesize(self, question, context):
+        """Let the QA chain answer from query results, streamed and tagged with CYPHER_ANSWER_TAG."""
+
+        return "".join(self.chain.qa_chain.stream({"question": question, "context": context},
+                                                  {"tags": [CYPHER_ANSWER_TAG]}))
+
+
+    def select_schema(self, question, spans):
+        """
+        Return the schema prompts to generate Cypher with, in order: (schema text, vocabulary),
+        with vocabulary None for the full schema.
+        """
+
+        chain = self.chain
+        full = [(chain.graph_schema, None)]
+        if not st.secrets.get("CYPHER_SCHEMA_PRUNING", True):
+            return full
+        embeddings = {target.property for target in load_targets().values()} | {LEGACY_TARGET.property}
+        pruned = prune_schema(chain.graph.get_structured_schema, question,
+                              {label for span in spans for label in span.labels}, embeddings)
+        if pruned is None:
+            return full
+
+        schema = format_schema(pruned, False)
+        full_tokens = estimate_prompt_tokens(cypher_prompt.format(schema=chain.graph_schema, question=question))
+        pruned_tokens = estimate_prompt_tokens(cypher_prompt.format(schema=schema, question=question))
+        with self._lock:
+            self.schema_stats["pruned"] += 1
+            self.schema_stats["full_tokens"] += full_tokens
+            self.schema_stats["pruned_tokens"] += pruned_tokens
+        if chain.verbose:
+            print(f"Pruned schema, Cypher prompt {full_tokens} -> {pruned_tokens} tokens")
+        return [(schema, schema_vocabulary(pruned))] + full
+
+
+    def generate(self, question, normalized, spans):
+        """
+        Generate Cypher for a question and run it.
+
+        Returns:
+            (cypher, context), context being at most `top_k` result rows
+        """
+
+        chain = self.chain
+        for schema, vocabulary in self.select_schema(normalized, spans):
+            cypher = extract_cypher(chain.cypher_generation_chain.invoke({"question": question, "schema": schema}))
+            if chain.cypher_query_corrector:
+                cypher = chain.cypher_query_corrector(cypher)
+            if chain.verbose:
+                print(f"Generated Cypher: {cypher}")
+
+            if vocabulary is not None:
+                types, properties = cypher_vocabulary(cypher)
+                if not (types <= vocabulary[0] and properties <= vocabulary[1]):
+                    self._record_fallback()
+                    continue
+            try:
+                return cypher, chain.graph.query(cypher)[: chain.top_k] if cypher else []
+            except Exception:
+                if vocabulary is None:
+                    raise
+                self._record_fallback()
+
+
+    def _record_fallback(self):
+        with self._lock:
+            self.schema_stats["fallbacks"] += 1
+
+
+    def _record(self, path):
+        with self._lock:
+            self.counts[path] += 1
+
+
+    def __call__(self, question):
+        """Answer a question, returning the same shape as GraphCypherQAChain."""
+
+        normalized = normalize_question(question)
+        spans = self.link(normalized)
+
+        template = self.match_template(normalized, spans)
+        if template:
+            _, cypher, params = template
+            result = self.answer(question, cypher, params)
+            if result is not None:
+                self._record("template")
+                return {"query": question, "result": result}
+
+        key, params = self.question_template(normalized, spans)
+        for cache_key, cache_params in ((key, params), (normalized, {})):
+            with self._lock:
+                cached = self.cache.get(cache_key)
+                if cached:
+                    self.cache.move_to_end(cache_key)
+            if cached:
+                result = self.answer(question, cached, cache_params)
+                if result is not None:
+                    self._record("cache")
+                    return {"query": question, "result": result}
+
+        self._record("llm")
+        generated, context = self.generate(question, normalized, spans)
+        if context:
+            cypher = self.parameterize(generated, params)
+            if cypher is None:
+                # Names could not be turned into parameters, cache for this exact question only
+                key, cypher = normalized, generated
+            with self._lock:
+                self.cache[key] = cypher
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.max_cache_size:
+                    self.cache.popitem(last=False)
+        result = self.synthesize(question, context)
+        return {"query": question, "result": result}
+
+
+    def stats(self):
+        """Return the number of questions answered per path and the share of each."""
+
+        with self._lock:
+            total = sum(self.counts.values())
+            return {
+                "total": total,
+                "cache_size": len(self.cache),
+                **{path: count for path, count in self.counts.items()},
+                **{f"{path}_rate": count / total if total else 0.0 for path, count in self.counts.items()},
+                **{f"schema_{key}": value for key, value in self.schema_stats.items()},
+            }
+
+
+cypher_qa = CypherGenerationLayer(get_cypher_chain, CYPHER_TEMPLATES, linker=get_linker)
\ No newline at end of file
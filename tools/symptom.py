@@ -0,0 +1,173 @@
+import json
+import os
+import re
+
+import numpy as np
+from scipy import sparse
+
+from entity_linker import get_linker
+from graph import get_graph
+from resources import resource
+
+SUMMARY_PATH = "./data/summary"
+
+
+class SymptomRanker:
+    """
+    Ranks diseases by how well they explain a set of symptoms.
+
+    Diseases and symptoms form a sparse disease x symptom matrix, weighted by
+    the inverse document frequency of each symptom (a symptom shared by many
+    diseases says little) and L2-normalized per disease, so diseases with very
+    long symptom lists are not favoured. A set of symptoms is scored against
+    every disease with one sparse matrix-vector product.
+    """
+    def __init__(self, diseases, symptoms, matrix):
+        """
+        Args:
+            diseases: Disease names, one per matrix row
+            symptoms: Symptom names, one per matrix column
+            matrix: CSR matrix of normalized IDF weights
+        """
+        self.diseases = diseases
+        self.symptoms = symptoms
+        self.symptom_index = {name: i for i, name in enumerate(symptoms)}
+        self.matrix = matrix
+        # Transposed copy, so the matched symptoms of the top diseases are cheap to read
+        self.columns = matrix.T.tocsr()
+
+
+    @classmethod
+    def build(cls, triples):
+        """
+        Build the matrix from (disease, 'has_symptom', symptom) triples.
+
+        Args:
+            triples: Iterable of triples as produced by MedicalKnowledgeGraphBuilder
+        """
+
+        disease_index, symptom_index = {}, {}
+        pairs = set()
+        for disease, _, symptom in triples:
+            row = disease_index.setdefault(disease, len(disease_index))
+            col = symptom_index.setdefault(symptom, len(symptom_index))
+            pairs.add((row, col))
+
+        pairs = np.array(sorted(pairs), dtype=np.int32).reshape(-1, 2)
+        rows, cols = pairs[:, 0], pairs[:, 1]
+        shape = (len(disease_index), len(symptom_index))
+
+        # Smoothed IDF of every symptom
+        df = np.bincount(cols, minlength=shape[1])
+        idf = np.log((1 + shape[0]) / (1 + df)) + 1
+
+        matrix = sparse.csr_matrix((idf[cols].astype(np.float32), (rows, cols)), shape=shape)
+        norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+        norms[norms == 0] = 1
+        matrix = sparse.diags(1 / norms).dot(matrix).tocsr()
+
+        return cls(list(disease_index), list(symptom_index), matrix)
+
+
+    @classmethod
+    def from_summary(cls, summary_path=SUMMARY_PATH):
+        """
+        Build the ranker from the rels_symptom.json file in a summary directory.
+
+        Args:
+            summary_path: Directory written by MedicalKnowledgeGraphBuilder.export
+        """
+
+        with open(os.path.join(summary_path, 'rels_symptom.json'), 'r', encoding='utf-8') as f:
+            return cls.build(json.load(f))
+
+
+    @classmethod
+    def from_graph(cls, graph):
+        """
+        Build the ranker from the has_symptom relationships in Neo4j, e.g.
+        after a streaming build, which exports no relationship files.
+
+        Args:
+            graph: Connected CachedNeo4jGraph
+        """
+
+        rows = graph.query("""
+        MATCH (d:Disease)-[:has_symptom]->(s:Symptom)
+        RETURN d.name AS disease, s.name AS symptom
+        """, cache=False)
+        return cls.build((row["disease"], "has_symptom", row["symptom"]) for row in rows)
+
+
+    def rank(self, symptoms, k=10):
+        """
+        Score every disease against a set of symptoms.
+
+        Args:
+            symptoms: Symptom names, unknown names are ignored
+            k: Number of diseases to return
+
+        Returns:
+            Up to k (disease, score, matched symptoms) tuples, best first
+        """
+
+        cols = sorted({self.symptom_index[s] for s in symptoms if s in self.symptom_index})
+        if not cols:
+            return []
+
+        # Unit query vector, so scores are cosine similarities in [0, 1]
+        query = np.zeros(len(self.symptoms), dtype=np.float32)
+        query[cols] = 1 / np.sqrt(len(cols))
+        scores = self.matrix.dot(query)
+
+        k = min(k, np.count_nonzero(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        matched = self.columns[cols]
+        results = []
+        for row in top:
+            names = [self.symptoms[cols[i]] for i in matched[:, row].nonzero()[0]]
+            results.append((self.diseases[row], float(scores[row]), names))
+        return results
+
+
+    def extract(self, text):
+        """Find the known symptom names in free text."""
+
+        linker = get_linker()
+        if linker is not None:
+            return linker.entities(text, "Symptom")
+        # No compiled linker yet, fall back to exact matches between punctuation
+        parts = re.split(r"[\s,，、;；。.!！?？]+", text)
+        return [part for part in parts if part in self.symptom_index]
+
+
+# Build the matrix on first use, from the exported relationships if there are any
+@resource("symptom_ranker")
+def get_symptom_ranker():
+    if os.path.exists(os.path.join(SUMMARY_PATH, 'rels_symptom.json')):
+        return SymptomRanker.from_summary()
+    return SymptomRanker.from_graph(get_graph())
+
+
+def rank_diseases_by_symptoms(question, k=10):
+    """
+    Tool function: rank possible diseases for the symptoms described in a question.
+    """
+
+    try:
+        ranker = get_symptom_ranker()
+    except Exception as e:
+        # Not cached, the next call tries again
+        print(f"Error building the symptom ranker: {e}")
+        return "症状数据暂不可用，请换用其他工具。"
+    symptoms = ranker.extract(question)
+    results = ranker.rank(symptoms, k)
+    if not results:
+        return "未能从问题中识别出知识图谱中的症状，请换用其他工具。"
+
+    lines = [f"识别出的症状: {'、'.join(dict.fromkeys(symptoms))}", "可能的疾病（按匹配程度排序）:"]
+    for i, (disease, score, matched) in enumerate(results, 1):
+        lines.append(f"{i}. {disease}（匹配度 {score:.2f}，匹配症状: {'、'.join(matched)}）")
+    return "\n".join(lines)
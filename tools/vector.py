@@ -1,35 +1,158 @@
+from concurrent.futures import ThreadPoolExecutor
+
 import streamlit as st
-from llm import llm, embeddings
-from graph import graph
+from ann_index import AnnIndex
+from llm import get_llm, get_embeddings
+from graph import get_graph
+from resources import resource
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
 from langchain_neo4j import Neo4jVector
+from langchain_neo4j.vectorstores.neo4j_vector import remove_lucene_chars
+from vector_storage import TruncatedEmbeddings, get_target
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 from langchain_core.prompts import ChatPromptTemplate
 
-# Create the Neo4jVector
-neo4jvector = Neo4jVector.from_existing_index(
-    embeddings,
-    graph=graph,
-    index_name="diseaseDescriptions",           
-    node_label="Disease",                       
-    text_node_property="desc",                  
-    embedding_node_property="descEmbedding",    
-    retrieval_query="""
+# The disease card materialized by build_kg.py already holds symptoms, drugs,
+# recipes, cause, cure way and department, so a hit is a single property read
+retrieval_query = """
 RETURN
-    node.desc AS text,
-    {
-        name: node.name,
-        symptoms: [ (node)-[:has_symptom]->(symptom) | symptom.name ],
-        recommend_eat: [ (node)-[:recommend_eat]->(recipe) | recipe.name ],
-        recommend_drug: [ (node)-[:recommend_drug]->(drug) | drug.name ],
-        cause: node.cause,
-        cure_way: node.cure_way,
-    } AS metadata
+    coalesce(node.card, node.desc) AS text,
+    score,
+    {name: node.name} AS metadata
 """
-)
 
-# Create the retriever
-retriever = neo4jvector.as_retriever()
+# Layout of the vector index to search, as recorded by build_vec.py
+@resource("vector_target")
+def get_vector_target():
+    return get_target(st.secrets.get("VECTOR_INDEX_NAME", "diseaseDescriptions"))
+
+# Embed queries with the dimensions of that index
+@resource("query_embeddings")
+def get_query_embeddings():
+    dimensions = get_vector_target().dimensions
+    return TruncatedEmbeddings(get_embeddings(), dimensions) if dimensions else get_embeddings()
+
+# Create the Neo4jVector on first use
+@resource("neo4jvector")
+def get_neo4jvector():
+    target = get_vector_target()
+    return Neo4jVector.from_existing_index(
+        get_query_embeddings(),
+        graph=get_graph(),
+        index_name=target.index,
+        node_label="Disease",                       
+        text_node_property="desc",                  
+        embedding_node_property=target.property,
+        retrieval_query=retrieval_query
+    )
+
+# Full-text search over the same node fields, created by MedicalKnowledgeGraphBuilder.create_schema
+FULLTEXT_INDEX = "diseaseFulltext"
+fulltext_query = f"""
+CALL db.index.fulltext.queryNodes($index, $query, {{limit: $k}}) YIELD node, score
+{retrieval_query}
+"""
+
+# Metadata of the hits of the local ANN index, fetched by node ID
+ann_metadata_query = f"""
+UNWIND $hits AS hit
+MATCH (node:Disease) WHERE elementId(node) = hit.id AND node.name = hit.name
+WITH node, hit.score AS score
+{retrieval_query}
+"""
+
+# Load the local ANN index written by build_vec.py on first use, memory-mapped
+@resource("ann_index")
+def get_ann_index():
+    return AnnIndex(st.secrets.get("ANN_INDEX_PATH", "./data/ann"))
+
+# Searches run concurrently in this pool, off the caller's thread
+_search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hybrid-search")
+
+
+class HybridDiseaseRetriever(BaseRetriever):
+    """
+    Retrieves diseases with the full-text and the vector index and fuses both
+    rankings with reciprocal rank fusion: score = sum of 1 / (rrf_k + rank).
+
+    Modes:
+    - hybrid: both searches run concurrently and are always fused
+    - auto: the full-text search runs first, and when its best hit is a
+      disease named in the question the embedding call is skipped
+    - fulltext / vector: a single index only
+
+    The vector search uses the Neo4j vector index, or with
+    vector_backend="local" the memory-mapped ANN index written by
+    build_vec.py (nprobe=0 searches it by brute force).
+    """
+    k: int = 4
+    candidates: int = 20
+    rrf_k: int = 60
+    mode: str = "auto"
+    vector_backend: str = "neo4j"
+    nprobe: int = 8
+
+
+    def fulltext_search(self, query):
+        """Return (document, score) pairs from the full-text index, best first."""
+
+        query = remove_lucene_chars(query).strip()
+        if not query:
+            return []
+        results = get_graph().query(fulltext_query, {"index": FULLTEXT_INDEX, "query": query, "k": self.candidates})
+        return [(Document(page_content=r["text"] or "", metadata=dict(r["metadata"])), r["score"]) for r in results]
+
+
+    def vector_search(self, query):
+        """Return (document, score) pairs from the vector index, best first."""
+
+        if self.vector_backend != "local":
+            return get_neo4jvector().similarity_search_with_score(query, k=self.candidates)
+
+        # Search in process, Neo4j only fetches the metadata of the hits
+        embedding = get_query_embeddings().embed_query(query)
+        hits = get_ann_index().search(embedding, self.candidates, self.nprobe)
+        results = get_graph().query(ann_metadata_query, {
+            "hits": [{"name": name, "id": node_id, "score": score} for name, node_id, score in hits]})
+        results.sort(key=lambda r: r["score"], reverse=True)
+        return [(Document(page_content=r["text"] or "", metadata=dict(r["metadata"])), r["score"]) for r in results]
+
+
+    def fuse(self, *rankings):
+        """Fuse rankings of (document, score) pairs by disease name."""
+
+        fused, documents = {}, {}
+        for ranking in rankings:
+            for rank, (document, _) in enumerate(ranking, 1):
+                name = document.metadata.get("name")
+                fused[name] = fused.get(name, 0.0) + 1 / (self.rrf_k + rank)
+                documents.setdefault(name, document)
+        names = sorted(fused, key=fused.get, reverse=True)[:self.k]
+        for name in names:
+            documents[name].metadata["rrf_score"] = fused[name]
+        return [documents[name] for name in names]
+
+
+    def _get_relevant_documents(self, query, *, run_manager: CallbackManagerForRetrieverRun):
+        if self.mode == "fulltext":
+            return self.fuse(self.fulltext_search(query))
+        if self.mode == "vector":
+            return self.fuse(self.vector_search(query))
+
+        if self.mode == "auto":
+            lexical = self.fulltext_search(query)
+            # The question names the best lexical hit, no need for semantic search
+            if lexical and lexical[0][0].metadata.get("name", "") in query:
+                return self.fuse(lexical)
+            return self.fuse(lexical, self.vector_search(query))
+
+        lexical = _search_executor.submit(self.fulltext_search, query)
+        semantic = _search_executor.submit(self.vector_search, query)
+        return self.fuse(lexical.result(), semantic.result())
+
 
 # Create the prompt
 instructions = (
@@ -45,13 +168,20 @@ prompt = ChatPromptTemplate.from_messages(
     ]
 )
 
-# Create the chain 
-question_answer_chain = create_stuff_documents_chain(llm, prompt)
-medical_retriever = create_retrieval_chain(
-    retriever, 
-    question_answer_chain
-)
+# Create the chain on first use
+@resource("medical_retriever")
+def get_medical_retriever():
+    question_answer_chain = create_stuff_documents_chain(get_llm(), prompt)
+    retriever = HybridDiseaseRetriever(
+        mode=st.secrets.get("RETRIEVAL_MODE", "auto"),
+        vector_backend=st.secrets.get("VECTOR_BACKEND", "neo4j"),
+        nprobe=st.secrets.get("ANN_NPROBE", 8),
+    )
+    return create_retrieval_chain(
+        retriever,
+        question_answer_chain
+    )
 
 # Create a function to call the chain
 def retrieve_disease_description(input):
-    return medical_retriever.invoke({"input": input})
\ No newline at end of file
+    return get_medical_retriever().invoke({"input": input})
\ No newline at end of file
@@ -0,0 +1,328 @@
+import bisect
+import contextvars
+import json
+import threading
+import time
+from contextlib import contextmanager
+from uuid import uuid4
+
+import streamlit as st
+from langchain_core.callbacks import BaseCallbackHandler
+
+from resources import resource
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, float("inf"))
+
+# Tag of LLM runs whose output is the final answer, outside of the ReAct loop
+FINAL_ANSWER_TAG = "final_answer"
+
+# Trace of the agent turn running in the current context, see `trace`
+_current = contextvars.ContextVar("trace", default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram with fixed buckets, as exported to Prometheus."""
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+    def quantile(self, q):
+        """Estimate a quantile (0-1) by linear interpolation inside its bucket."""
+
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if self.buckets[i] != float("inf") else lower
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-2]
+
+
+class TraceRecorder:
+    """
+    Process-wide aggregate of agent traces: a latency histogram per stage,
+    token, tool call, retry and error counters, and optionally one JSON line
+    per finished turn appended to `log_path`.
+    """
+    def __init__(self, log_path=None):
+        self.log_path = log_path
+        self.histograms = {}     # stage -> Histogram
+        self.tokens = {}         # (stage, "prompt" | "completion") -> count
+        self.tools = {}          # tool name -> calls
+        self.routes = {}         # routed tool, or "react" -> turns
+        self.retries = 0
+        self.errors = {}         # stage -> count
+        self._lock = threading.Lock()
+
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                histogram = self.histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+
+    def record(self, trace):
+        """Aggregate the spans and counters of a finished trace."""
+
+        for span in trace.spans:
+            self.observe(span["stage"], span["seconds"])
+        with self._lock:
+            for span in trace.spans:
+                for kind in ("prompt", "completion"):
+                    if span.get(f"{kind}_tokens"):
+                        key = (span["stage"], kind)
+                        self.tokens[key] = self.tokens.get(key, 0) + span[f"{kind}_tokens"]
+                if span.get("error"):
+                    self.errors[span["stage"]] = self.errors.get(span["stage"], 0) + 1
+            for tool in trace.tools:
+                self.tools[tool] = self.tools.get(tool, 0) + 1
+            route = trace.route["tool"] if trace.route else "react"
+            self.routes[route] = self.routes.get(route, 0) + 1
+            self.retries += trace.retries
+            if self.log_path:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+
+
+    def summary(self):
+        """Return count, mean, p50 and p95 seconds per stage, slowest total first."""
+
+        with self._lock:
+            rows = [{
+                "stage": stage,
+                "count": h.count,
+                "mean": h.sum / h.count,
+                "p50": h.quantile(0.5),
+                "p95": h.quantile(0.95),
+            } for stage, h in self.histograms.items() if h.count]
+        return sorted(rows, key=lambda row: row["mean"] * row["count"], reverse=True)
+
+
+    def to_prometheus(self, prefix="ipc"):
+        """Render all metrics in the Prometheus text exposition format."""
+
+        lines = [f"# TYPE {prefix}_stage_seconds histogram"]
+        with self._lock:
+            for stage, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip(h.buckets, h.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {h.sum}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {h.count}')
+            lines.append(f"# TYPE {prefix}_tokens_total counter")
+            for (stage, kind), count in sorted(self.tokens.items()):
+                lines.append(f'{prefix}_tokens_total{{stage="{stage}",kind="{kind}"}} {count}')
+            lines.append(f"# TYPE {prefix}_tool_calls_total counter")
+            for tool, count in sorted(self.tools.items()):
+                lines.append(f'{prefix}_tool_calls_total{{tool="{tool}"}} {count}')
+            lines.append(f"# TYPE {prefix}_routes_total counter")
+            for route, count in sorted(self.routes.items()):
+                lines.append(f'{prefix}_routes_total{{route="{route}"}} {count}')
+            lines.append(f"# TYPE {prefix}_errors_total counter")
+            for stage, count in sorted(self.errors.items()):
+                lines.append(f'{prefix}_errors_total{{stage="{stage}"}} {count}')
+            lines.append(f"# TYPE {prefix}_retries_total counter")
+            lines.append(f"{prefix}_retries_total {self.retries}")
+        return "\n".join(lines) + "\n"
+
+
+class Trace(BaseCallbackHandler):
+    """
+    Callback handler timing the stages of one agent turn.
+
+    Stages are derived from the runs LangChain reports: the whole turn,
+    loading the chat history, every tool, and LLM calls split into ReAct
+    reasoning, Cypher generation and answer synthesis (LLM calls inside a
+    tool, told apart by their prompt). Neo4j queries report themselves
+    through `observe`. Turns answered by the router record its decision.
+    """
+    # Called on the thread of the run, so no event loop round trip per token
+    run_inline = True
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.trace_id = str(uuid4())
+        self.start = time.time()
+        self.spans = []
+        self.tools = []
+        self.route = None
+        self.retries = 0
+        self._runs = {}     # run_id -> (stage, start, tool name of the closest tool run)
+        self._lock = threading.Lock()
+
+
+    def _begin(self, run_id, parent_run_id, stage=None, tool=None):
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+            inherited = parent[2] if parent else None
+            self._runs[run_id] = (stage, time.perf_counter(), tool or inherited)
+
+
+    def _end(self, run_id, error=None, **attributes):
+        with self._lock:
+            run = self._runs.pop(run_id, None)
+            if run is None or run[0] is None:
+                return
+            span = {"stage": run[0], "seconds": time.perf_counter() - run[1]}
+            if error is not None:
+                span["error"] = type(error).__name__
+            span.update({k: v for k, v in attributes.items() if v})
+            self.spans.append(span)
+
+
+    def span(self, stage, seconds, **attributes):
+        """Add a span measured outside of LangChain, e.g. a Neo4j query."""
+
+        with self._lock:
+            self.spans.append(dict(stage=stage, seconds=seconds, **attributes))
+
+
+    def on_chain_start(self, serialized, inputs, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name")
+        stage = "turn" if parent_run_id is None else "history:load" if name == "load_history" else None
+        self._begin(run_id, parent_run_id, stage)
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+    def on_tool_start(self, serialized, input_str, *, run_id, parent_run_id=None, **kwargs):
+        name = kwargs.get("name") or (serialized or {}).get("name", "tool")
+        with self._lock:
+            self.tools.append(name)
+        self._begin(run_id, parent_run_id, f"tool:{name}", tool=name)
+
+    def on_tool_end(self, output, *, run_id, **kwargs):
+        self._end(run_id)
+
+    def on_tool_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+    def _llm_start(self, prompt, run_id, parent_run_id, tags):
+        with self._lock:
+            parent = self._runs.get(parent_run_id)
+        in_tool = parent is not None and parent[2] is not None
+        if not in_tool:
+            stage = "llm:answer_synthesis" if FINAL_ANSWER_TAG in (tags or ()) else "llm:react"
+        elif "Cypher" in prompt:
+            stage = "llm:cypher_generation"
+        else:
+            stage = "llm:answer_synthesis"
+        self._begin(run_id, parent_run_id, stage)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._llm_start("".join(prompts), run_id, parent_run_id, tags)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, parent_run_id=None, tags=None, **kwargs):
+        self._llm_start("".join(str(m.content) for batch in messages for m in batch), run_id, parent_run_id, tags)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        prompt_tokens, completion_tokens = usage.get("prompt_tokens"), usage.get("completion_tokens")
+        if prompt_tokens is None:
+            # Chat models report usage on the message, also when streaming
+            for generations in response.generations:
+                for generation in generations:
+                    metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                    prompt_tokens = (prompt_tokens or 0) + metadata.get("input_tokens", 0)
+                    completion_tokens = (completion_tokens or 0) + metadata.get("output_tokens", 0)
+        self._end(run_id, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._end(run_id, error)
+
+
+    def on_retry(self, retry_state, *, run_id, **kwargs):
+        with self._lock:
+            self.retries += 1
+
+    def on_agent_action(self, action, *, run_id, **kwargs):
+        # Unparsable LLM output shows up as a call of the "_Exception" pseudo tool
+        if action.tool == "_Exception":
+            with self._lock:
+                self.retries += 1
+
+
+    def on_custom_event(self, name, data, *, run_id, **kwargs):
+        if name == "route":
+            with self._lock:
+                self.route = {key: value for key, value in data.items() if key in ("tool", "confidence", "reason")}
+
+
+    def finish(self):
+        self.recorder.record(self)
+
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "trace_id": self.trace_id,
+                "start": self.start,
+                "seconds": sum(span["seconds"] for span in self.spans if span["stage"] == "turn"),
+                "tools": list(self.tools),
+                "route": self.route,
+                "retries": self.retries,
+                "spans": list(self.spans),
+            }
+
+
+# Aggregate of all traces of this process
+@resource("trace_recorder")
+def get_recorder():
+    return TraceRecorder(log_path=st.secrets.get("TRACE_LOG_PATH"))
+
+
+def tracing_enabled():
+    return st.secrets.get("TRACING", True)
+
+
+@contextmanager
+def trace():
+    """
+    Trace one agent turn: yields the callback handler to pass to the agent,
+    or None when tracing is disabled. Spans reported with `observe` inside
+    the block are added to this trace.
+    """
+
+    if not tracing_enabled():
+        yield None
+        return
+    handler = Trace(get_recorder())
+    token = _current.set(handler)
+    try:
+        yield handler
+    finally:
+        _current.reset(token)
+        handler.finish()
+
+
+def observe(stage, seconds, **attributes):
+    """Record a span measured outside of LangChain, into the current trace if there is one."""
+
+    handler = _current.get()
+    if handler is not None:
+        handler.span(stage, seconds, **attributes)
+    elif tracing_enabled():
+        get_recorder().observe(stage, seconds)
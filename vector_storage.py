@@ -0,0 +1,133 @@
+import json
+import os
+import time
+from collections import namedtuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Layout of the vector indexes written by build_vec.py, read by the retrievers
+STORAGE_MANIFEST_PATH = "./data/summary/vector_storage.json"
+
+# Storage formats: bytes per dimension in the node property and in the index
+STORAGE_FORMATS = {
+    "float64": (8, 4),    # Plain Cypher list, as written before dimensions were configurable
+    "float32": (4, 4),
+    "int8": (4, 1),       # float32 property, int8-quantized index
+}
+
+# One embedding property of Disease nodes and the vector index over it
+VectorTarget = namedtuple("VectorTarget", ["index", "property", "dimensions", "storage"])
+
+# What build_vec.py wrote before the manifest existed
+LEGACY_TARGET = VectorTarget("diseaseDescriptions", "descEmbedding", None, "float64")
+
+
+def truncate(vectors, dimensions):
+    """
+    Keep the first `dimensions` components of embeddings and renormalize them.
+
+    Models trained with Matryoshka representation learning (e.g. OpenAI's
+    text-embedding-3 models) are meant to be shortened this way, and it gives
+    the same vectors as asking the API for fewer dimensions.
+    """
+
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if not dimensions or vectors.shape[-1] <= dimensions:
+        return vectors
+    vectors = vectors[..., :dimensions]
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class TruncatedEmbeddings(Embeddings):
+    """Embeddings shortened to the dimensions of a vector index, for embedding queries against it."""
+    def __init__(self, embeddings, dimensions):
+        self.embeddings = embeddings
+        self.dimensions = dimensions
+
+
+    def embed_documents(self, texts):
+        return truncate(self.embeddings.embed_documents(texts), self.dimensions).tolist()
+
+
+    def embed_query(self, text):
+        return truncate(self.embeddings.embed_query(text), self.dimensions).tolist()
+
+
+def load_targets(path=STORAGE_MANIFEST_PATH):
+    """Return the vector targets recorded in the manifest, by index name."""
+
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return {index: VectorTarget(**target) for index, target in json.load(f)["targets"].items()}
+
+
+def save_targets(targets, path=STORAGE_MANIFEST_PATH):
+    """Atomically write the vector targets to the manifest."""
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({"updated": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                   "targets": {index: target._asdict() for index, target in targets.items()}},
+                  f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def get_target(index, path=STORAGE_MANIFEST_PATH):
+    """Return the target of an index, assuming the legacy layout for unknown indexes."""
+
+    target = load_targets(path).get(index)
+    if target is None:
+        return LEGACY_TARGET._replace(index=index)
+    return target
+
+
+def create_vector_index(graph, target):
+    """Create the vector index of a target, with int8 quantization for int8 storage."""
+
+    graph.query(f"""
+    CREATE VECTOR INDEX {target.index} IF NOT EXISTS
+    FOR (d:Disease)
+    ON (d.{target.property})
+    OPTIONS {{indexConfig: {{
+    `vector.dimensions`: {int(target.dimensions)},
+    `vector.similarity_function`: 'cosine',
+    `vector.quantization.enabled`: {'true' if target.storage == 'int8' else 'false'}
+    }}}}
+    """)
+
+
+def drop_target(graph, target, batch_size=1000):
+    """Drop the vector index of a target and remove its property from all Disease nodes."""
+
+    graph.query(f"DROP INDEX {target.index} IF EXISTS")
+    graph.query(f"""
+    MATCH (d:Disease) WHERE d.{target.property} IS NOT NULL
+    CALL {{ WITH d REMOVE d.{target.property} }} IN TRANSACTIONS OF {int(batch_size)} ROWS
+    """)
+
+
+def storage_report(graph, target):
+    """
+    Measure the storage of a target: embedded nodes, dimensions and approximate bytes per node.
+
+    Returns:
+        Dict with nodes, dimensions, property_bytes and index_bytes (both per node)
+    """
+
+    result = graph.query(f"""
+    MATCH (d:Disease) WHERE d.{target.property} IS NOT NULL
+    RETURN count(d) AS nodes, max(size(d.{target.property})) AS dimensions
+    """, cache=False)[0]
+    dimensions = result["dimensions"] or target.dimensions or 0
+    property_width, index_width = STORAGE_FORMATS[target.storage]
+    return {
+        "nodes": result["nodes"],
+        "dimensions": dimensions,
+        "property_bytes": dimensions * property_width,
+        "index_bytes": dimensions * index_width,
+    }